@@ -12,5 +12,6 @@ pkgs.python310Packages.buildPythonPackage rec {
     pyyaml
     xdg-base-dirs
     rich
+    aiohttp
   ];
 }
\ No newline at end of file
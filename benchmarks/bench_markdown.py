@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+"""Benchmark the streaming markdown renderer: the cost of a chunk should not grow with the length of the answer."""
+import io
+import time
+
+from rich.console import Console
+
+from gpt_ui.markdown import StreamingMarkdown
+
+paragraph = ('The *renderer* prints finished blocks once and only re-renders the `open` block at the end. ' * 3).strip()
+code = '```python\n' + 'for i in range(10):\n    print(i)\n' * 5 + '```'
+
+
+def answer_chunks(n_blocks):
+    text = '\n\n'.join(code if i % 5 == 4 else f"{i}. {paragraph}" for i in range(n_blocks)) + '\n'
+    return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+
+def main():
+    for n_blocks in [10, 100, 300]:
+        chunks = answer_chunks(n_blocks)
+        console = Console(file=io.StringIO(), width=100, height=40, force_terminal=True)
+        # No frame rate cap, such that every chunk is rendered: the worst case
+        renderer = StreamingMarkdown(console, max_fps=1e9)
+        start = time.perf_counter()
+        with renderer:
+            for chunk in chunks:
+                renderer.feed(chunk)
+        seconds = time.perf_counter() - start
+        print(f"{n_blocks:>5} blocks, {len(chunks):>6} chunks: {seconds * 1000:9.1f} ms, "
+              f"{seconds / len(chunks) * 1e6:7.1f} us per chunk")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""Measure the gap between spoken sentences: one mpv process per sentence versus one mpv driven over IPC.
+
+Plays short silent wav files through mpv with the null audio output, so it needs mpv but no sound card.
+
+This has not been run yet, as mpv was not available where the IPC player was written. So there are no numbers yet
+showing that the IPC player shortens the gap.
+"""
+import shutil
+import tempfile
+import time
+import wave
+from pathlib import Path
+
+from gpt_ui.player import MpvPlayer, ProcessPlayer
+
+
+def silent_wav(path, seconds, rate=16000):
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b'\0\0' * int(rate * seconds))
+
+
+def mean_gap(player, files, seconds):
+    start = time.perf_counter()
+    for path in files:
+        # Like the Speaker, keep one file queued behind the one playing
+        player.wait(max_pending=1)
+        player.enqueue(path)
+    player.wait()
+    wall = time.perf_counter() - start
+    return (wall - len(files) * seconds) / (len(files) - 1)
+
+
+def main(n_files=20, seconds=0.3):
+    if shutil.which('mpv') is None:
+        print('mpv not found')
+        return
+    tmp_dir = Path(tempfile.mkdtemp())
+    files = []
+    for i in range(n_files):
+        files.append(tmp_dir / f'{i}.wav')
+        silent_wav(files[-1], seconds)
+    for name, make in [('one process per sentence', ProcessPlayer), ('persistent mpv over IPC', MpvPlayer)]:
+        player = make(args=['--ao=null'])
+        gap = mean_gap(player, files, seconds)
+        player.close()
+        print(f"{name:<26}: {gap * 1000:7.1f} ms between sentences")
+    shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+"""Benchmark the sentence segmenter of the speech path on multi-megabyte streams of small chunks."""
+import random
+import time
+
+from gpt_ui.sentences import SentenceSegmenter
+
+
+def synthetic_stream(n_bytes, seed=0):
+    rng = random.Random(seed)
+    words = ['the', 'model', 'streams', 'tokens', 'e.g.', 'Dr.', '3.14', 'sentence', 'speech', '你好。']
+    parts, size = [], 0
+    while size < n_bytes:
+        sentence = ' '.join(rng.choice(words) for _ in range(rng.randint(3, 30))) + rng.choice(['. ', '? ', '!\n', ':\n'])
+        if rng.random() < 0.02:
+            sentence += '```\n' + 'x = 1. y = 2\n' * rng.randint(1, 50) + '```\n'
+        parts.append(sentence)
+        size += len(sentence)
+    return ''.join(parts)
+
+
+def chunks(text, seed=0):
+    """Split the text into pieces of 1 to 8 characters, about the size of streamed tokens."""
+    rng = random.Random(seed)
+    i = 0
+    while i < len(text):
+        n = rng.randint(1, 8)
+        yield text[i:i + n]
+        i += n
+
+
+def main():
+    for n_bytes in [1 << 20, 4 << 20]:
+        text = synthetic_stream(n_bytes)
+        pieces = list(chunks(text))
+        segmenter = SentenceSegmenter()
+        start = time.perf_counter()
+        n_sentences = 0
+        for piece in pieces:
+            n_sentences += len(segmenter.feed(piece))
+        segmenter.flush()
+        seconds = time.perf_counter() - start
+        print(f"{len(text) / 2**20:4.1f} MiB in {len(pieces)} chunks: {seconds * 1000:8.1f} ms, "
+              f"{len(text) / 2**20 / seconds:5.1f} MiB/s, {n_sentences} sentences")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Measure the cold start of gpt-ui for each command, and fail if one takes longer than its budget.
+
+Every run is a new python process, with the config, chats and ledger in a temporary directory, so it runs offline
+and does not touch the real ones. Only the chat path can not be run without a terminal, so for it the time until
+everything it imports before showing the prompt is imported is measured. The 'daemon' runs are the commands as
+gpt-ui runs them when a daemon (gpt-ui --daemon) is running.
+
+    PYTHONPATH=. python benchmarks/bench_startup.py [--runs N] [--budget-scale X]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+
+from gpt_ui.daemon import daemon_running
+
+repo_dir = Path(__file__).parent.parent.absolute()
+
+# Seconds, for the median run
+budgets = {
+    '--help': 0.25,
+    '--list-chats': 0.3,
+    '--search': 0.3,
+    '--stats': 0.3,
+    'chat': 0.6,
+    'daemon --list-chats': 0.2,
+    'daemon --stats': 0.2,
+}
+
+commands = {
+    '--help': ['--help'],
+    '--list-chats': ['--list-chats'],
+    '--search': ['--search', 'budget'],
+    '--stats': ['--stats'],
+}
+
+
+def make_home(tmp_dir, n_chats=50):
+    config_dir = tmp_dir / 'config' / 'gpt-ui'
+    config_dir.mkdir(parents=True)
+    chat_dir = tmp_dir / 'chats'
+    chat_dir.mkdir()
+    vault_dir = tmp_dir / 'vault'
+    vault_dir.mkdir()
+    (config_dir / 'config.yaml').write_text(yaml.dump({
+        'default_model': 'gpt-4o', 'user': 'user', 'speak': False, 'chat_dir': str(chat_dir),
+        'obsidian_vault_dir': str(vault_dir), 'prompt_postfix': ' '}))
+    (config_dir / 'api_key.yaml').write_text(yaml.dump({'api_key': 'sk-benchmark'}))
+    for i in range(n_chats):
+        chat = [{'role': 'system', 'content': 'You are a helpful assistant.'}]
+        for j in range(20):
+            chat.append({'role': 'user' if j % 2 == 0 else 'assistant', 'model': 'gpt-4o', 'user': 'user',
+                         'date': '2024-01-01_00-00-00-000000', 'content': f'chat {i} message {j} about the token budget'})
+        (chat_dir / f'chat_{i}.json').write_text(json.dumps(chat))
+    return {**os.environ, 'XDG_CONFIG_HOME': str(tmp_dir / 'config'), 'XDG_DATA_HOME': str(tmp_dir / 'data'),
+            'XDG_CACHE_HOME': str(tmp_dir / 'cache'), 'XDG_RUNTIME_DIR': str(tmp_dir / 'run'),
+            'PYTHONPATH': str(repo_dir)}
+
+
+def time_run(argv, env) -> float:
+    start = time.perf_counter()
+    subprocess.run(argv, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-scale', type=float, default=1.0, help='Multiply all budgets, for slow machines.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = make_home(Path(tmp_dir))
+        runs = {name: [sys.executable, '-c', 'from gpt_ui.setup import main; main()', *argv]
+                for name, argv in commands.items()}
+        runs['chat'] = [sys.executable, '-c', 'import gpt_ui.setup, gpt_ui.cli, gpt_ui.gpt_ui']
+        for name in ['--list-chats', '--stats']:
+            # What the gpt-ui script does
+            runs[f'daemon {name}'] = [sys.executable, '-c', 'import sys; from gpt_ui.daemon import run_remote; '
+                                      'sys.exit(run_remote(sys.argv[1:]))', *commands[name]]
+        daemon = subprocess.Popen([sys.executable, '-c', 'from gpt_ui.setup import main; main()', '--daemon'],
+                                  env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        while not daemon_running(Path(tmp_dir) / 'run' / 'gpt-ui' / 'daemon.sock'):
+            time.sleep(0.01)
+        # The first run fills the caches of the file system and the sqlite indexes
+        for argv in runs.values():
+            time_run(argv, env)
+        over_budget = []
+        for name, argv in runs.items():
+            median = statistics.median(time_run(argv, env) for _ in range(args.runs))
+            budget = budgets[name] * args.budget_scale
+            status = 'ok' if median <= budget else 'OVER BUDGET'
+            if median > budget:
+                over_budget.append(name)
+            print(f"{name:<20} {median * 1000:7.0f} ms  (budget {budget * 1000:.0f} ms) {status}")
+        daemon.terminate()
+        daemon.wait()
+        interpreter = statistics.median(time_run([sys.executable, '-c', 'pass'], env) for _ in range(args.runs))
+        print(f"{'(python itself)':<20} {interpreter * 1000:7.0f} ms")
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+"""Benchmark the chat processing hot paths on synthetic chats, chat directories and Obsidian vaults.
+
+Runs offline: the tokenizer splits on whitespace (unless --tiktoken is given and its encoding is cached), the
+summary API call of --compact is stubbed, and the editor of edit_chat is `true`. Every case is timed --repeat times
+and the median is kept. The results are written as JSON, and compared to the results of an earlier run with
+--baseline: a case is a regression if it got slower by more than --threshold and by more than a millisecond.
+
+    PYTHONPATH=. python benchmarks/suite.py [--quick] [--output FILE] [--baseline FILE] [--threshold 0.25]
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+from prompt_toolkit.application import create_app_session
+from prompt_toolkit.output import DummyOutput
+
+from gpt_ui.catalog import ChatCatalog
+from gpt_ui.cli import list_chats
+from gpt_ui.export import chat_to_markdown
+from gpt_ui.expand import FileExpander
+from gpt_ui.gpt_ui import backup_chat, edit_chat, explode_chat, number_of_tokens, trim_chat
+from gpt_ui.journal import ChatJournal
+from gpt_ui.search import SearchIndex
+from gpt_ui.sentences import SentenceSegmenter
+from gpt_ui.tokens import TokenCounter, WhitespaceEncoder
+from gpt_ui.vault import VaultIndex
+from tests.helpers import make_conf as make_base_conf
+
+message_scales = [100, 10_000, 100_000]
+note_scales = [1_000, 50_000]
+chat_dir_scales = [100, 1_000]
+words = ['token', 'context', 'window', 'trim', 'model', 'budget', 'chat', 'message', 'e.g.', 'Dr.', 'vault',
+         'note', 'summary', 'journal', 'index', 'the', 'of', 'a']
+
+
+def sentence(rng, n_words):
+    return ' '.join(rng.choice(words) for _ in range(n_words)) + rng.choice(['. ', '? ', '!\n'])
+
+
+def synthetic_chat(n_messages, seed=0, link=None):
+    """A chat with messages of 5 to 120 words. link(i) can return a link that is added to message i."""
+    rng = random.Random(seed)
+    chat = [{'role': 'system', 'model': 'gpt-4', 'user': 'user', 'date': '2024-01-01_00-00-00-000000',
+             'content': 'You are a helpful assistant.'}]
+    for i in range(n_messages):
+        n_words = rng.randint(5, 120)
+        content = ''.join(sentence(rng, min(n_words, 15)) for _ in range(max(1, n_words // 15)))
+        if link is not None and link(i):
+            content += f' {link(i)}'
+        chat.append({'role': 'user' if i % 2 == 0 else 'assistant', 'model': 'gpt-4', 'user': 'user',
+                     'date': f'2024-01-01_00-00-00-{i:06d}', 'content': content})
+    return chat
+
+
+def synthetic_vault(vault_dir, n_notes, notes_per_dir=100, seed=0):
+    rng = random.Random(seed)
+    for i in range(n_notes):
+        note_dir = vault_dir / f'dir_{i // notes_per_dir}'
+        if i % notes_per_dir == 0:
+            note_dir.mkdir(parents=True)
+        (note_dir / f'note_{i}.md').write_text(f'# Note {i}\n\n' + ''.join(sentence(rng, 12) for _ in range(20)))
+
+
+def synthetic_chat_dir(chat_dir, n_chats):
+    chat_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(n_chats):
+        name = f'.backup_2024-01-01_{i:06d}.json' if i % 2 else f'chat_{i}.json'
+        (chat_dir / name).write_text(json.dumps(synthetic_chat(20, seed=i)))
+
+
+def make_conf(tmp_dir, enc, vault_dir=None):
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    vault_dir = vault_dir or tmp_dir / 'vault'
+    vault_index = VaultIndex(vault_dir, tmp_dir / 'vault_index.json')
+    return make_base_conf(
+        tmp_dir, enc=enc, max_tokens=128_000, completion_reserve=4096, obsidian_vault_dir=vault_dir,
+        vault_index=vault_index, file_expander=FileExpander(enc, 32_000), chat_dir=tmp_dir,
+        chat_backup_file=tmp_dir / '.backup_benchmark.json', journal=ChatJournal(tmp_dir / '.backup_benchmark.json'),
+        search_index=SearchIndex(tmp_dir), catalog=ChatCatalog(tmp_dir), client=StubClient())
+
+
+class StubClient:
+    """Answers the summary requests of --compact without the API."""
+    def stream(self, model, messages, stats=None, **params):
+        yield 'Summary of the earlier conversation.'
+
+
+@contextlib.contextmanager
+def quietly():
+    """Print nothing, neither with print nor with prompt_toolkit."""
+    with create_app_session(output=DummyOutput()), contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+class Suite:
+    def __init__(self, repeat, only=None):
+        self.repeat = repeat
+        self.only = only
+        self.results = []
+
+    def time(self, name, scale, unit, fn, setup=None, repeat=None):
+        """Time fn(setup()) (or fn() without setup) and record the median. setup is not timed."""
+        if self.only is not None and self.only not in name:
+            return
+        times = []
+        for _ in range(repeat or self.repeat):
+            state = setup() if setup is not None else None
+            start = time.perf_counter()
+            fn(state) if setup is not None else fn()
+            times.append(time.perf_counter() - start)
+        seconds = statistics.median(times)
+        self.results.append({'name': name, 'scale': scale, 'unit': unit, 'seconds': seconds, 'runs': len(times)})
+        print(f"{name:<34} {scale:>8} {unit:<9} {seconds * 1000:10.2f} ms")
+
+
+def bench_chats(suite, tmp_dir, enc):
+    for n in message_scales:
+        chat = synthetic_chat(n)
+        conf = make_conf(tmp_dir / f'chat_{n}', enc)
+        suite.time('number_of_tokens cold', n, 'messages', lambda counter: counter.count_chat(chat),
+                   setup=lambda: TokenCounter(enc))
+        suite.time('number_of_tokens warm', n, 'messages', lambda: number_of_tokens(conf, chat))
+        suite.time('trim_chat cold', n, 'messages', lambda conf: trim_chat(conf, chat),
+                   setup=lambda: make_conf(tmp_dir / f'chat_{n}', enc))
+        suite.time('trim_chat warm', n, 'messages', lambda: trim_chat(conf, chat))
+
+        # The first trim summarizes with the stubbed API and stores the summary in the chat, later ones reuse it
+        compact_conf = make_conf(tmp_dir / f'compact_{n}', enc)
+        compact_conf.args.compact = True
+        compact_chat = [dict(m) for m in chat]
+        suite.time('trim_chat --compact first', n, 'messages', lambda: trim_chat(compact_conf, compact_chat), repeat=1)
+        suite.time('trim_chat --compact warm', n, 'messages', lambda: trim_chat(compact_conf, compact_chat))
+
+        def fresh_backup():
+            backup_dir = tmp_dir / f'backup_{n}'
+            shutil.rmtree(backup_dir, ignore_errors=True)
+            return make_conf(backup_dir, enc)
+        suite.time('backup_chat full', n, 'messages', lambda conf: backup_chat(conf, chat), setup=fresh_backup,
+                   repeat=min(suite.repeat, 3))
+        backup_conf = fresh_backup()
+        backup_chat(backup_conf, chat)
+        growing_chat = list(chat)
+
+        def append_and_backup():
+            growing_chat.append({**chat[-1], 'content': 'one more message'})
+            backup_chat(backup_conf, growing_chat)
+        suite.time('backup_chat one new message', n, 'messages', append_and_backup)
+
+        def edit():
+            with quietly():
+                edit_chat(backup_conf, growing_chat, 'true')
+        # Includes printing the chat again, as edit_chat does that
+        suite.time('edit_chat round trip', n, 'messages', edit, repeat=min(suite.repeat, 3))
+
+        suite.time('chat_to_markdown', n, 'messages', lambda: chat_to_markdown(chat))
+        text = ''.join(m['content'] for m in chat)
+        stream = [text[i:i + 4] for i in range(0, len(text), 4)]
+
+        def segment():
+            segmenter = SentenceSegmenter()
+            for chunk in stream:
+                segmenter.feed(chunk)
+            segmenter.flush()
+        # Replaces get_first_sentence, which was called for every chunk of the streamed answer
+        suite.time('SentenceSegmenter', n, 'messages', segment)
+
+
+def bench_vaults(suite, tmp_dir, enc):
+    for n in note_scales:
+        vault_dir = tmp_dir / f'vault_{n}'
+        synthetic_vault(vault_dir, n)
+        # A new directory each time, such that there is no stored index
+        runs = itertools.count()
+        suite.time('vault_index cold', n, 'notes', lambda conf: conf.vault_index.refresh(force=True),
+                   setup=lambda: make_conf(tmp_dir / f'vault_conf_{n}_{next(runs)}', enc, vault_dir),
+                   repeat=min(suite.repeat, 3))
+        conf = make_conf(tmp_dir / f'vault_conf_{n}', enc, vault_dir)
+        conf.vault_index.refresh(force=True)
+        suite.time('vault_index unchanged', n, 'notes', lambda: conf.vault_index.refresh(force=True))
+        suite.time('note completion', n, 'notes', lambda: conf.vault_index.note_names('note_1'))
+
+        # Every tenth message links a note, every hundredth one a file
+        rng = random.Random(n)
+        links = {i: f':obsidian:note_{rng.randrange(n)}:' if i % 100 else f':file:{vault_dir / "dir_0" / "note_0.md"}:'
+                 for i in range(0, 10_000, 10)}
+        chat = synthetic_chat(10_000, link=links.get)
+        suite.time('explode_chat cold', n, 'notes', lambda conf: explode_chat(conf, chat),
+                   setup=lambda: SimpleNamespace(**{**vars(conf), 'file_expander': FileExpander(enc, 32_000)}))
+        suite.time('explode_chat warm', n, 'notes', lambda: explode_chat(conf, chat))
+
+
+def bench_chat_dirs(suite, tmp_dir, enc):
+    for n in chat_dir_scales:
+        chat_dir = tmp_dir / f'chats_{n}'
+        synthetic_chat_dir(chat_dir, n)
+
+        def fresh_catalog():
+            conf = make_conf(chat_dir, enc)
+            conf.catalog.db_path.unlink(missing_ok=True)
+            return conf
+
+        def list_quietly(conf):
+            with quietly():
+                list_chats(conf, hide_backups=False)
+        suite.time('list_chats cold', n, 'chats', list_quietly, setup=fresh_catalog, repeat=min(suite.repeat, 3))
+        conf = make_conf(chat_dir, enc)
+        suite.time('list_chats warm', n, 'chats', lambda: list_quietly(conf))
+
+
+def compare(results, baseline, threshold, min_delta=0.001):
+    """Print the change of every case against the baseline.
+       @return: the cases that got slower by more than threshold
+    """
+    base = {(r['name'], r['scale']): r['seconds'] for r in baseline['results']}
+    regressions = []
+    print(f"\n{'case':<44} {'baseline':>10} {'now':>10} {'change':>8}")
+    for r in results:
+        before = base.get((r['name'], r['scale']))
+        if before is None:
+            continue
+        change = (r['seconds'] - before) / before if before > 0 else 0.0
+        regressed = change > threshold and r['seconds'] - before > min_delta
+        if regressed:
+            regressions.append(r)
+        print(f"{r['name'] + ' ' + str(r['scale']):<44} {before * 1000:8.2f}ms {r['seconds'] * 1000:8.2f}ms "
+              f"{change:+8.0%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--quick', action='store_true', help='Only the smaller scales.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', type=str, help='Only the cases whose name contains this.')
+    parser.add_argument('--tiktoken', action='store_true', help='Count tokens with the cl100k_base encoding of tiktoken.')
+    parser.add_argument('--output', type=str, help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', type=str, help='Compare to the results in this JSON file.')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Relative slowdown that counts as regression.')
+    args = parser.parse_args()
+
+    global message_scales, note_scales, chat_dir_scales
+    if args.quick:
+        message_scales, note_scales, chat_dir_scales = message_scales[:2], note_scales[:1], chat_dir_scales[:1]
+    if args.tiktoken:
+        import tiktoken
+        enc = tiktoken.get_encoding('cl100k_base')
+    else:
+        enc = WhitespaceEncoder()
+    suite = Suite(args.repeat, args.only)
+    tmp_dir = Path(tempfile.mkdtemp(prefix='gpt-ui-bench-'))
+    try:
+        bench_chats(suite, tmp_dir, enc)
+        bench_vaults(suite, tmp_dir, enc)
+        bench_chat_dirs(suite, tmp_dir, enc)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    output = {
+        'meta': {'time': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                 'platform': platform.platform(), 'encoder': enc.name, 'quick': args.quick},
+        'results': suite.results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(output, indent=4))
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        if baseline['meta'].get('encoder') != enc.name:
+            print(f"WARNING: the baseline was counted with the {baseline['meta'].get('encoder')} encoder.")
+        regressions = compare(suite.results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regressions.")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
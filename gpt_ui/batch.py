@@ -0,0 +1,185 @@
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional, Set, Tuple
+
+from gpt_ui.client import APIError
+from gpt_ui.compare import find_model
+from gpt_ui.tokens import TokenCounter
+
+
+class RateLimiter:
+    """Token buckets for the requests and tokens per minute of one model. None means unlimited."""
+    def __init__(self, rpm: Optional[int], tpm: Optional[int]):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm) if rpm else 0.0
+        self.tokens = float(tpm) if tpm else 0.0
+        self.last = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self.last = now - self.last, now
+        if self.rpm:
+            self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    def _wait_time(self, n_tokens) -> float:
+        wait = 0.0
+        if self.rpm and self.requests < 1:
+            wait = max(wait, (1 - self.requests) * 60 / self.rpm)
+        if self.tpm:
+            # A request larger than the whole bucket only waits for a full bucket
+            needed = min(n_tokens, self.tpm)
+            if self.tokens < needed:
+                wait = max(wait, (needed - self.tokens) * 60 / self.tpm)
+        return wait
+
+    async def acquire(self, n_tokens):
+        while True:
+            self._refill()
+            wait = self._wait_time(n_tokens)
+            if wait == 0:
+                if self.rpm:
+                    self.requests -= 1
+                if self.tpm:
+                    self.tokens -= n_tokens
+                return
+            await asyncio.sleep(wait)
+
+    def refund(self, n_tokens):
+        """Give back the tokens that were reserved but not used."""
+        if self.tpm:
+            self.tokens = min(self.tpm, self.tokens + n_tokens)
+
+
+def read_done(out_path) -> Tuple[Set[str], Set[str]]:
+    """Return the ids of the requests that were already answered in out_path, and the ids that have any result.
+       A last line that was cut off by a crash is removed.
+    """
+    out_path = Path(out_path)
+    done = set()
+    seen = set()
+    if not out_path.exists():
+        return done, seen
+    with out_path.open('rb+') as f:
+        valid_end = 0
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            valid_end += len(line)
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(result, dict) or result.get('id') is None:
+                continue
+            seen.add(result['id'])
+            if 'error' not in result:
+                done.add(result['id'])
+        f.truncate(valid_end)
+    return done, seen
+
+
+def request_messages(record):
+    if 'messages' in record:
+        return [{'role': m['role'], 'content': m['content']} for m in record['messages']]
+    messages = [{'role': 'system', 'content': record['system']}] if 'system' in record else []
+    return messages + [{'role': 'user', 'content': record['prompt']}]
+
+
+async def answer_request(conf, request_id, record, limiters, token_counter, chat=None) -> dict:
+    model = find_model(conf.models_dict, record.get('model', conf.model))
+    if model is None:
+        return {'id': request_id, 'error': f"Unknown model {record.get('model')}"}
+    try:
+        messages = request_messages(record)
+    except (KeyError, TypeError) as e:
+        return {'id': request_id, 'error': f"The request needs 'messages' or 'prompt': {e}"}
+    limiter = limiters.setdefault(model['name'], RateLimiter(model.get('rpm'), model.get('tpm')))
+    n_prompt_tokens = token_counter.count_chat(messages)
+    reserved = n_prompt_tokens + model.get('completion_reserve', 0)
+    await limiter.acquire(reserved)
+    start = time.perf_counter()
+    chunks = []
+    stats = {}
+    try:
+        async for content in conf.client.stream_chat(model['name'], messages, stats):
+            chunks.append(content)
+    except APIError as e:
+        limiter.refund(reserved - n_prompt_tokens)
+        conf.ledger.record('batch', model['name'], n_prompt_tokens, 0, time.perf_counter() - start,
+                           retries=stats['retries'], chat=chat, error=e)
+        return {'id': request_id, 'model': model['name'], 'error': str(e)}
+    content = ''.join(chunks)
+    n_completion_tokens = token_counter.count_text(content)
+    conf.ledger.record('batch', model['name'], n_prompt_tokens, n_completion_tokens, time.perf_counter() - start,
+                       ttft=stats['ttft'], retries=stats['retries'], chat=chat)
+    limiter.refund(reserved - n_prompt_tokens - n_completion_tokens)
+    return {'id': request_id, 'model': model['name'], 'content': content, 'prompt_tokens': n_prompt_tokens,
+            'completion_tokens': n_completion_tokens, 'seconds': round(time.perf_counter() - start, 3)}
+
+
+async def run_batch(conf, in_path, out_path, concurrency=8) -> Tuple[int, int, int]:
+    """Answer every request in the JSONL file in_path and append the results to the JSONL file out_path.
+
+    A request is a json object with 'messages', or with 'prompt' and an optional 'system' prompt, and optionally
+    an 'id' (the line number by default) and a 'model'. Results are written as soon as they are complete, in the
+    order they complete. Requests that already have a result in out_path are skipped, so an interrupted
+    batch can be resumed. Failed requests are tried again then, so out_path can have several results with the
+    id of a request, of which the last one counts. A line of in_path that is not valid json is only reported once,
+    and is tried again once it was fixed. At most `concurrency` requests are read from in_path and in flight at a
+    time.
+    @return: a touple of (number of answered, failed and skipped requests)
+    """
+    done, seen = read_done(out_path)
+    # Only few different texts are counted at a time, so the cache can be small
+    token_counter = TokenCounter(conf.enc, max_entries=concurrency * 16)
+    limiters = {}
+    pending = asyncio.Queue(maxsize=concurrency)
+    counts = {'answered': 0, 'failed': 0, 'skipped': 0}
+    with Path(out_path).open('a') as out:
+        def write(result):
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+            counts['failed' if 'error' in result else 'answered'] += 1
+
+        async def worker():
+            while (item := await pending.get()) is not None:
+                try:
+                    result = await answer_request(conf, *item, limiters, token_counter, chat=Path(in_path).name)
+                except Exception as e:
+                    result = {'id': item[0], 'error': f'{type(e).__name__}: {e}'}
+                write(result)
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            with Path(in_path).open() as f:
+                for line_number, line in enumerate(f, 1):
+                    if line.strip() == '':
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError as e:
+                        if str(line_number) in seen:
+                            counts['skipped'] += 1
+                        else:
+                            write({'id': str(line_number), 'error': f'Invalid json: {e}'})
+                        continue
+                    request_id = str(record.get('id', line_number))
+                    if request_id in done:
+                        counts['skipped'] += 1
+                        continue
+                    await pending.put((request_id, record))
+            for _ in workers:
+                await pending.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for w in workers:
+                w.cancel()
+            out.flush()
+            os.fsync(out.fileno())
+    return counts['answered'], counts['failed'], counts['skipped']
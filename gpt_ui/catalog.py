@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import textwrap
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from gpt_ui.compaction import SUMMARY_KEY
+from gpt_ui.journal import journal_path, load_chat
+
+
+def chat_files(chat_dir) -> Dict[str, Tuple[int, int]]:
+    """Find all chats in chat_dir.
+       @return: dict from the name of the json file of each chat, to the (mtime in ns, size) of the
+                chat. For a chat with a journal these are the newest mtime and the summed size of both files.
+    """
+    files = {}
+    with os.scandir(chat_dir) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            if ext not in ['.json', '.jsonl'] or not entry.is_file():
+                continue
+            stat = entry.stat()
+            name = stem + '.json'
+            mtime_ns, size = files.get(name, (0, 0))
+            files[name] = (max(mtime_ns, stat.st_mtime_ns), size + stat.st_size)
+    return files
+
+
+def chat_stat(path) -> Tuple[int, int]:
+    """Return the (mtime in ns, size) of one chat, the same way chat_files does."""
+    mtime_ns, size = 0, 0
+    for p in [Path(path), journal_path(path)]:
+        try:
+            stat = p.stat()
+        except FileNotFoundError:
+            continue
+        mtime_ns, size = max(mtime_ns, stat.st_mtime_ns), size + stat.st_size
+    return mtime_ns, size
+
+
+class ChatCatalog:
+    """Index of the chats in chat_dir, stored in an sqlite database in chat_dir.
+
+    Only chats whose mtime or size changed since the last refresh are read again.
+    """
+    def __init__(self, chat_dir, db_name='.catalog.sqlite'):
+        self.chat_dir = Path(chat_dir)
+        self.db_path = self.chat_dir / db_name
+        self._db = None
+        self._lock = Lock()
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute('''
+                CREATE TABLE IF NOT EXISTS chats (
+                    name TEXT PRIMARY KEY,
+                    mtime_ns INTEGER,
+                    size INTEGER,
+                    n_messages INTEGER,
+                    preview TEXT,
+                    model TEXT,
+                    summary TEXT
+                )''')
+        return self._db
+
+    def refresh(self) -> List[str]:
+        """Bring the catalog up to date with chat_dir.
+           @return: the names of the chats that were (re)indexed
+        """
+        with self._lock:
+            files = chat_files(self.chat_dir)
+            known = {name: (mtime_ns, size) for name, mtime_ns, size in self.db.execute('SELECT name, mtime_ns, size FROM chats')}
+            changed = [name for name, stat in files.items() if known.get(name) != stat]
+            for name in changed:
+                self.db.execute('INSERT OR REPLACE INTO chats VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                (name, *files[name], *self._describe(self.chat_dir / name)))
+            removed = [(name,) for name in known if name not in files]
+            self.db.executemany('DELETE FROM chats WHERE name = ?', removed)
+            self.db.commit()
+            return changed
+
+    def _describe(self, path) -> Tuple[int, str, str, str]:
+        try:
+            chat = load_chat(path)
+        except Exception as e:
+            return 0, f'Error: could not read chat: {e}', '', ''
+        if len(chat) == 0:
+            return 0, '', '', ''
+        preview = textwrap.shorten(chat[-1]['content'], width=100)
+        model = next((m.get('model', '') for m in reversed(chat) if m['role'] == 'assistant'), '')
+        summary = next((m[SUMMARY_KEY] for m in reversed(chat) if SUMMARY_KEY in m), '')
+        return len(chat), preview, model, summary
+
+    def chats(self, hide_backups=True) -> List[tuple]:
+        """Return the catalog entries sorted by name, refreshing the catalog first."""
+        self.refresh()
+        query = 'SELECT name, n_messages, preview, model, summary FROM chats'
+        if hide_backups:
+            query += " WHERE name NOT LIKE '.%'"
+        with self._lock:
+            return self.db.execute(query + ' ORDER BY name').fetchall()
+
+    def last_backup(self) -> Optional[Path]:
+        self.refresh()
+        with self._lock:
+            row = self.db.execute("SELECT name FROM chats WHERE name LIKE '.backup%' ORDER BY name DESC LIMIT 1").fetchone()
+        return self.chat_dir / row[0] if row else None
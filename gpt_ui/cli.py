@@ -0,0 +1,92 @@
+import os
+import subprocess
+import textwrap
+
+from rich import print as print_markup
+from rich.markup import escape
+
+from gpt_ui.ledger import aggregate, format_stats
+
+# The commands below run without starting a chat. This module is imported before anything the chat needs, so it
+# only imports what they need, and imports that inside of the command.
+
+role_colors = {'system': 'blue', 'user': 'green'}
+
+
+def color_by_role(role, text=None) -> str:
+    color = role_colors.get(role, 'red')
+    return f"[bold {color}]{escape(text if text else role)}[/bold {color}]"
+
+
+def list_chats(conf, hide_backups=True):
+    for name, n_messages, preview, model, summary in conf.catalog.chats(hide_backups=hide_backups):
+        color = 'magenta' if name.startswith('.backup') else 'green'
+        print_markup(f"[{color}]{escape(name)}[/{color}]")
+        print(preview)
+        print()
+
+
+def print_stats(conf, by='model'):
+    try:
+        rows = aggregate(conf.ledger.entries(), by)
+    except ValueError as e:
+        print_markup(f"[red]{escape(str(e))}[/red]")
+        return
+    print(format_stats(rows, by))
+
+
+def search_chats(conf, query, hide_backups=True):
+    results = conf.search_index.search(query, hide_backups=hide_backups)
+    if len(results) == 0:
+        print('No matches.')
+    for chat, idx, role, model, date, snippet in results:
+        name = model if role == 'assistant' else role
+        print_markup(f"[green]{escape(chat)}[/green] {color_by_role(role, name)} {escape(date)}")
+        print(textwrap.indent(snippet, '    '))
+
+
+def list_models(full=False):
+    import openai
+    if not full:
+        print('available models:')
+    for m in sorted(openai.Model.list()['data'], key=lambda x: x['id']):
+        print(m if full else m['id'])
+
+
+def run_command(conf) -> bool:
+    """Run the command given on the command line, if it is one that does not start a chat.
+       @return: whether a command was run
+    """
+    args = conf.args
+    if args.list_models_full or args.list_models:
+        list_models(full=args.list_models_full)
+    elif args.list_chats or args.list_all_chats:
+        list_chats(conf, hide_backups=not args.list_all_chats)
+    elif args.search or args.search_all:
+        search_chats(conf, args.search or args.search_all, hide_backups=not args.search_all)
+    elif args.gc:
+        from gpt_ui.store import gc
+        n_backups, n_objects = gc(conf.chat_dir, keep_backups=conf.config.get('keep_backups', 100),
+                                  keep_backups_days=conf.config.get('keep_backups_days', 30))
+        print(f"Deleted {n_backups} old backup files and {n_objects} unreferenced messages.")
+    elif args.config:
+        subprocess.run([os.environ['EDITOR'], conf.config_file])
+    elif args.stats:
+        print_stats(conf, args.stats)
+    elif args.batch:
+        from gpt_ui.batch import run_batch
+        answered, failed, skipped = conf.client.run(run_batch(conf, *args.batch, concurrency=conf.config.get('batch_concurrency', 8)))
+        print(f"Answered {answered}, failed {failed}, skipped {skipped} already answered requests.")
+    elif args.export_chats_to_markdown:
+        from gpt_ui.export import export_chats_to_markdown
+        export_chats_to_markdown(conf.chat_dir)
+    elif args.daemon:
+        from gpt_ui.daemon import Daemon, socket_path
+        from gpt_ui.setup import Conf
+        print(f"Serving at {socket_path()}. Stop with gpt-ui --stop-daemon.")
+        Daemon(Conf, socket_path()).serve()
+    elif args.stop_daemon:
+        print('No daemon is running.')
+    else:
+        return False
+    return True
@@ -0,0 +1,235 @@
+import asyncio
+import json
+import queue
+import random
+import time
+from threading import Lock, Thread
+from typing import Any, AsyncIterator, Iterator, Optional, Tuple
+
+# Status codes worth retrying: rate limits, timeouts and server errors
+retry_status = {408, 409, 429, 500, 502, 503, 504}
+
+
+class APIError(Exception):
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.status is None or self.status in retry_status
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    for key, scale in [('retry-after-ms', 1 / 1000), ('retry-after', 1)]:
+        try:
+            return float(headers[key]) * scale
+        except (KeyError, ValueError):
+            pass
+    return None
+
+
+class ChatClient:
+    """Streaming client for the chat completions API, on asyncio and one pooled, kept-alive aiohttp session.
+
+    Failed requests are retried with exponential backoff and full jitter, waiting at least as long as the
+    Retry-After header asks for. A request is only retried until its first token arrived, as the answer was
+    already shown after that. The synchronous stream() runs the requests on an event loop in a background
+    thread, so that the session outlives a single turn, and closing its iterator (e.g. on Ctrl+C) cancels
+    the request.
+    """
+    def __init__(self, api_key, base_url='https://api.openai.com/v1', max_retries=5, connect_timeout=10,
+                 first_token_timeout=60, chunk_timeout=60, backoff_base=0.5, backoff_max=30, on_retry=None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.connect_timeout = connect_timeout
+        self.first_token_timeout = first_token_timeout
+        self.chunk_timeout = chunk_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Called with (number of the retry, exception, seconds until the retry)
+        self.on_retry = on_retry
+        self._session = None
+        self._loop = None
+        self._loop_lock = Lock()
+
+    def _backoff(self, attempt, retry_after=None) -> float:
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    async def session(self) -> 'aiohttp.ClientSession':
+        # Imported here, as it takes long to import and most commands never call the API
+        import aiohttp
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=32, keepalive_timeout=120),
+                timeout=aiohttp.ClientTimeout(total=None, connect=self.connect_timeout, sock_connect=self.connect_timeout),
+                headers={'Authorization': f'Bearer {self.api_key}'},
+            )
+        return self._session
+
+    async def _lines(self, response, first_token_timeout) -> AsyncIterator[str]:
+        timeout = first_token_timeout
+        while True:
+            line = await asyncio.wait_for(response.content.readline(), timeout)
+            if line == b'':
+                return
+            timeout = self.chunk_timeout
+            yield line.decode().strip()
+
+    async def stream_chat(self, model, messages, stats=None, **params) -> AsyncIterator[str]:
+        """Yield the content of the answer as it arrives.
+           @param stats: a dict that gets the number of 'retries' and the seconds to the first token ('ttft')
+        """
+        import aiohttp
+        body = {'model': model, 'messages': messages, 'stream': True, **params}
+        stats = {} if stats is None else stats
+        stats.update(retries=0, ttft=None)
+        start = time.perf_counter()
+        session = await self.session()
+        for attempt in range(self.max_retries + 1):
+            started = False
+            try:
+                # The first token timeout also covers the wait for the headers, which a stalled proxy never sends
+                deadline = time.perf_counter() + self.first_token_timeout
+                response = await asyncio.wait_for(session.post(f'{self.base_url}/chat/completions', json=body),
+                                                  self.first_token_timeout)
+                async with response:
+                    if response.status != 200:
+                        text = await response.text()
+                        try:
+                            text = json.loads(text)['error']['message']
+                        except (ValueError, KeyError, TypeError):
+                            pass
+                        raise APIError(f'{response.status}: {text}', response.status,
+                                       retry_after_seconds(response.headers))
+                    async for line in self._lines(response, max(0.0, deadline - time.perf_counter())):
+                        if not line.startswith('data:'):
+                            continue
+                        data = line[len('data:'):].strip()
+                        if data == '[DONE]':
+                            return
+                        try:
+                            chunk = json.loads(data)
+                            if 'error' in chunk:
+                                raise APIError(chunk['error'].get('message', str(chunk['error'])))
+                            if not chunk.get('choices'):
+                                continue
+                            content = chunk['choices'][0].get('delta', {}).get('content')
+                        except (ValueError, KeyError, TypeError, AttributeError, IndexError) as e:
+                            raise APIError(f'Malformed answer: {data[:200]}') from e
+                        if content:
+                            if not started:
+                                started = True
+                                stats['ttft'] = time.perf_counter() - start
+                            yield content
+                    return
+            except (APIError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    e = APIError('Timed out' + (' waiting for the first token' if not started else ''))
+                elif isinstance(e, aiohttp.ClientError):
+                    e = APIError(f'Connection error: {e}')
+                if started or not e.retryable or attempt == self.max_retries:
+                    raise e
+                delay = self._backoff(attempt, e.retry_after)
+                stats['retries'] += 1
+                if self.on_retry is not None:
+                    self.on_retry(attempt + 1, e, delay)
+                await asyncio.sleep(delay)
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                Thread(target=self._loop.run_forever, name='gpt-ui-client', daemon=True).start()
+            return self._loop
+
+    def run(self, coroutine):
+        """Run a coroutine that uses this client on its event loop, and wait for its result."""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._event_loop())
+        try:
+            return future.result()
+        finally:
+            future.cancel()
+
+    def stream(self, model, messages, stats=None, **params) -> Iterator[str]:
+        """Blocking version of stream_chat."""
+        for _, kind, value in self.stream_many([(model, messages)], None if stats is None else [stats], **params):
+            if kind == 'error':
+                raise value
+            if kind == 'content':
+                yield value
+
+    def stream_many(self, requests, stats=None, **params) -> Iterator[Tuple[int, str, Any]]:
+        """Stream the answers to several (model, messages) requests concurrently.
+           @param stats: a list of one dict per request, see stream_chat
+           @return: an iterator over (index of the request, kind, value), where kind is 'content', 'done' or
+                    'error'. An error only ends the answer it belongs to.
+        """
+        events = queue.Queue()
+
+        async def produce(i, model, messages):
+            try:
+                async for content in self.stream_chat(model, messages, None if stats is None else stats[i], **params):
+                    events.put((i, 'content', content))
+                events.put((i, 'done', None))
+            except APIError as e:
+                events.put((i, 'error', e))
+            except Exception as e:
+                # Callers only handle APIError, anything else would end the chat
+                events.put((i, 'error', APIError(f'{type(e).__name__}: {e}')))
+
+        async def produce_all():
+            await asyncio.gather(*[produce(i, model, messages) for i, (model, messages) in enumerate(requests)])
+        future = asyncio.run_coroutine_threadsafe(produce_all(), self._event_loop())
+        n_running = len(requests)
+        try:
+            while n_running > 0:
+                event = events.get()
+                if event[1] != 'content':
+                    n_running -= 1
+                yield event
+        finally:
+            future.cancel()
+
+    def close(self):
+        if self._loop is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+
+
+class DaemonChatClient(ChatClient):
+    """A ChatClient that streams answers through the connections of a running daemon, see gpt_ui/daemon.py.
+       If the daemon does not run anymore, it connects to the API itself.
+    """
+    def __init__(self, socket_path, api_key, **kwargs):
+        super().__init__(api_key, **kwargs)
+        self.socket_path = socket_path
+
+    def stream(self, model, messages, stats=None, **params) -> Iterator[str]:
+        from gpt_ui.daemon import connect
+        s = None if params else connect(self.socket_path)
+        if s is None:
+            return super().stream(model, messages, stats, **params)
+        return self._stream_daemon(s, model, messages, {} if stats is None else stats)
+
+    def _stream_daemon(self, s, model, messages, stats) -> Iterator[str]:
+        from gpt_ui.daemon import messages as read_messages, send
+        with s, s.makefile('rwb') as f:
+            send(f, {'op': 'chat', 'model': model, 'messages': messages})
+            for message in read_messages(f):
+                if 'content' in message:
+                    yield message['content']
+                elif 'error' in message:
+                    raise APIError(message['error'], message.get('status'))
+                elif message.get('done'):
+                    stats.update(message['stats'])
+                    return
+        raise APIError('The daemon stopped')
@@ -0,0 +1,84 @@
+from typing import Tuple
+
+import time
+
+from gpt_ui.client import APIError
+
+# The summary of the messages 1..i (the system prompt is never summarized) is stored
+# under this key on message i of the chat, such that it is saved along with the chat.
+SUMMARY_KEY = 'summary'
+
+summarize_instructions = (
+    'You compress the beginning of a conversation between a user and an AI assistant, such that the conversation '
+    'can be continued without it. Write a dense summary of the facts, decisions, open questions, code and '
+    'preferences of the user that came up. Leave out pleasantries. If a previous summary is given, integrate the new '
+    'messages into it and return the complete updated summary. Write at most {n_words} words.')
+
+
+def last_summary_index(chat) -> int:
+    """Return the index of the last message that carries a summary, or 0 if there is none."""
+    for i in range(len(chat) - 1, 0, -1):
+        if SUMMARY_KEY in chat[i]:
+            return i
+    return 0
+
+
+def summary_message(text) -> dict:
+    return {'role': 'system', 'content': f'Summary of the earlier conversation:\n{text}'}
+
+
+def summarize(conf, previous_summary, messages) -> str:
+    """Summarize the messages through the client of the chat, into at most summary_reserve tokens once wrapped
+       into the summary message.
+    """
+    transcript = '\n\n'.join(f"{m['role']}: {m['content']}" for m in messages)
+    if previous_summary:
+        transcript = f"Previous summary:\n{previous_summary}\n\nNew messages:\n{transcript}"
+    max_tokens = max(1, conf.summary_reserve - conf.token_counter.count_message(summary_message('')))
+    messages = [
+        {'role': 'system', 'content': summarize_instructions.format(n_words=int(max_tokens * 0.6))},
+        {'role': 'user', 'content': transcript}]
+    n_prompt_tokens = conf.token_counter.count_chat(messages)
+    start = time.perf_counter()
+    stats = {}
+    chunks = []
+    try:
+        for content in conf.client.stream(conf.model, messages, stats, max_tokens=max_tokens):
+            chunks.append(content)
+    except APIError as e:
+        conf.ledger.record('compaction', conf.model, n_prompt_tokens, conf.token_counter.count_text(''.join(chunks)),
+                           time.perf_counter() - start, ttft=stats.get('ttft'), retries=stats.get('retries', 0), error=e)
+        raise
+    summary = ''.join(chunks)
+    conf.ledger.record('compaction', conf.model, n_prompt_tokens, conf.token_counter.count_text(summary),
+                       time.perf_counter() - start, ttft=stats.get('ttft'), retries=stats.get('retries', 0))
+    return summary.strip()
+
+
+def compact_chat(conf, chat, exploded_chat, counts, start) -> Tuple[dict, int]:
+    """Summarize the messages 1..start-1, that do not fit into the context window anymore.
+
+    Summaries already stored in the chat are reused. Only the messages that fell out of the window
+    since the last summary are sent to the model, in batches that fit into its context window. If the model can not
+    be reached, the messages that are not summarized yet are dropped, and the last stored summary is sent, if any.
+    @return: a touple of (summary message to send or None, index of the first message to send after it)
+    """
+    j = last_summary_index(chat)
+    if j >= start - 1:
+        return summary_message(chat[j][SUMMARY_KEY]), max(start, j + 1)
+    previous = chat[j][SUMMARY_KEY] if j > 0 else None
+    batch_budget = conf.max_tokens - conf.completion_reserve - 2 * conf.summary_reserve
+    i = j + 1
+    while i < start:
+        batch_end, batch_tokens = i, 0
+        while batch_end < start and (batch_end == i or batch_tokens + counts[batch_end] <= batch_budget):
+            batch_tokens += counts[batch_end]
+            batch_end += 1
+        try:
+            previous = summarize(conf, previous, exploded_chat[i:batch_end])
+        except APIError as e:
+            print(f"WARNING: Could not summarize the oldest messages, sending the chat without them: {e}")
+            break
+        chat[batch_end - 1][SUMMARY_KEY] = previous
+        i = batch_end
+    return (summary_message(previous) if previous is not None else None), start
@@ -0,0 +1,94 @@
+import re
+import time
+from typing import List, Optional, Tuple
+
+
+def find_model(models_dict, name) -> Optional[dict]:
+    for model in models_dict.values():
+        if name == model['name'] or name in model.get('aliases', []):
+            return model
+    return None
+
+
+def parse_compare(models_dict, text) -> Tuple[List[dict], str]:
+    """Parse 'g4o g4t: prompt' into the models and the prompt.
+       @return: a touple of (models, prompt). Raises ValueError if a model is unknown or no model is given.
+    """
+    match = re.match(r'\s*([^:]*):(.*)', text, re.DOTALL)
+    if match is None:
+        raise ValueError("Usage: compare MODEL MODEL...: PROMPT")
+    models = []
+    for name in match.group(1).split():
+        model = find_model(models_dict, name)
+        if model is None:
+            raise ValueError(f"Unknown model {name}")
+        models.append(model)
+    if len(models) == 0:
+        raise ValueError("Usage: compare MODEL MODEL...: PROMPT")
+    return models, match.group(2).strip()
+
+
+class ModelAnswer:
+    """The answer of one model, and the time it took."""
+    def __init__(self, model, start):
+        self.model = model
+        self.start = start
+        self.first_token = None
+        self.end = None
+        self.chunks = []
+        self.error = None
+        # Filled by the client, see ChatClient.stream_chat
+        self.stats = {}
+        # Complete lines are printed, the rest is kept here
+        self.line_buffer = ''
+
+    @property
+    def text(self):
+        return ''.join(self.chunks)
+
+    def add(self, content):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.chunks.append(content)
+
+    def ttft(self) -> Optional[float]:
+        return None if self.first_token is None else self.first_token - self.start
+
+    def tokens_per_s(self, n_output_tokens) -> Optional[float]:
+        if self.first_token is None or self.end is None or self.end <= self.first_token:
+            return None
+        return n_output_tokens / (self.end - self.first_token)
+
+    def cost(self, n_input_tokens, n_output_tokens) -> float:
+        return n_input_tokens * self.model['cost_per_input_token'] + n_output_tokens * self.model['cost_per_output_token']
+
+
+def compare_models(client, models, messages, print_line) -> List[ModelAnswer]:
+    """Stream the answers of all models concurrently, model i answering messages[i], as the chat is trimmed to the
+       context window of each model. Each complete line of an answer is passed to print_line(index of the model, line)
+       as it arrives.
+    """
+    start = time.perf_counter()
+    answers = [ModelAnswer(model, start) for model in models]
+    try:
+        for i, kind, value in client.stream_many([(model['name'], m) for model, m in zip(models, messages)],
+                                                 [answer.stats for answer in answers]):
+            answer = answers[i]
+            if kind == 'content':
+                answer.add(value)
+                *lines, answer.line_buffer = (answer.line_buffer + value).split('\n')
+                for line in lines:
+                    print_line(i, line)
+                continue
+            answer.end = time.perf_counter()
+            if kind == 'error':
+                answer.error = value
+            if answer.line_buffer:
+                print_line(i, answer.line_buffer)
+                answer.line_buffer = ''
+    except KeyboardInterrupt:
+        for answer in answers:
+            if answer.end is None:
+                answer.end = time.perf_counter()
+                answer.error = answer.error or 'Interrupted'
+    return answers
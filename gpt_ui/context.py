@@ -0,0 +1,24 @@
+from bisect import bisect_left
+from itertools import accumulate
+from typing import List
+
+
+def cut_index(counts: List[int], budget: int, overhead: int = 0) -> int:
+    """Find where to cut a chat such that it fits into the token budget.
+
+    The first message (the system prompt) is always kept, as is the last one.
+    @param counts: token count of each message
+    @param budget: number of tokens the kept messages may use
+    @param overhead: tokens that are spent regardless of the messages kept
+    @return: the index i, such that counts[:1] + counts[i:] is the longest suffix that fits.
+             Messages 1 to i-1 are dropped.
+    """
+    n = len(counts)
+    if n <= 2:
+        return 1
+    prefix = list(accumulate(counts, initial=0))
+    # Keeping messages i.. costs counts[0] + prefix[n] - prefix[i]. As prefix is sorted,
+    # the smallest i that fits can be found with a binary search.
+    needed = prefix[n] + counts[0] + overhead - budget
+    i = bisect_left(prefix, needed, lo=1, hi=n)
+    return min(max(i, 1), n - 1)
@@ -0,0 +1,257 @@
+import json
+import os
+import socket
+import sys
+import tempfile
+from pathlib import Path
+from typing import Iterator, Optional
+
+# A daemon started with `gpt-ui --daemon` keeps one Conf, with its tokenizer, indexes and pooled API client, and
+# answers later gpt-ui calls over a Unix socket. The protocol is one JSON object per line: a request from the client,
+# then the answers of the daemon.
+#
+#   {"op": "run", "argv": [...], "tty": bool, "columns": int}
+#       Run a command that does not start a chat. Answers {"out": text} and {"err": text} as the command prints,
+#       then {"exit": code}, or {"local": true} if the command has to run in the process of the client: when it needs
+#       its terminal, or its working directory (--batch, whose long run would also block all other commands).
+#   {"op": "chat", "model": ..., "messages": [...]}
+#       Stream an answer with the API client of the daemon. Answers {"content": text} per chunk, then
+#       {"done": true, "stats": {...}} or {"error": message, "status": code}.
+#
+# Only the client side is imported by gpt-ui before it knows whether a daemon runs, so this module only imports what
+# that needs.
+
+
+def socket_path() -> Path:
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(tempfile.gettempdir(), f'gpt-ui-{os.getuid()}')
+    return Path(runtime_dir) / 'gpt-ui' / 'daemon.sock'
+
+
+def is_private(directory) -> bool:
+    """Whether only the current user can use the directory and replace it, such that a socket in it can not be one
+       of another user. Matters when XDG_RUNTIME_DIR is not set, as then the directory is in the shared tmp directory.
+    """
+    directory = Path(directory)
+    for d, mask in [(directory, 0o077), (directory.parent, 0o022)]:
+        try:
+            st = os.lstat(d)
+        except OSError:
+            return False
+        if st.st_uid != os.getuid() or st.st_mode & mask or not os.path.isdir(d) or os.path.islink(d):
+            return False
+    return True
+
+
+def connect(path, timeout=None) -> Optional[socket.socket]:
+    """@return: a socket connected to the daemon, or None if none runs or its directory is not private"""
+    if not is_private(Path(path).parent):
+        return None
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(str(path))
+    except OSError:
+        s.close()
+        return None
+    s.settimeout(timeout)
+    return s
+
+
+def daemon_running(path) -> bool:
+    s = connect(path)
+    if s is None:
+        return False
+    s.close()
+    return True
+
+
+def send(f, message):
+    f.write(json.dumps(message).encode() + b'\n')
+    f.flush()
+
+
+def messages(f) -> Iterator[dict]:
+    for line in f:
+        yield json.loads(line)
+
+
+def run_remote(argv, path=None) -> Optional[int]:
+    """Let the daemon run the command in argv, and print what it prints.
+       @return: the exit code, or None if no daemon runs or the command has to run in this process
+    """
+    if '--no-daemon' in argv:
+        return None
+    s = connect(path or socket_path())
+    if s is None:
+        return None
+    try:
+        columns = os.get_terminal_size().columns
+    except OSError:
+        columns = None
+    answered = False
+    try:
+        with s, s.makefile('rwb') as f:
+            send(f, {'op': 'run', 'argv': argv, 'tty': sys.stdout.isatty(), 'columns': columns})
+            for message in messages(f):
+                answered = True
+                if 'out' in message:
+                    sys.stdout.write(message['out'])
+                    sys.stdout.flush()
+                elif 'err' in message:
+                    sys.stderr.write(message['err'])
+                elif 'exit' in message:
+                    return message['exit']
+                elif message.get('local'):
+                    return None
+    except ConnectionError:
+        pass
+    # The daemon stopped, before it started the command or while it ran it
+    return 1 if answered else None
+
+
+class RemoteOutput:
+    """A file that sends what is written to it to the client, as {key: text}."""
+    def __init__(self, f, key, tty=False):
+        self.f = f
+        self.key = key
+        self.tty = tty
+
+    def write(self, text):
+        if text:
+            send(self.f, {self.key: text})
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return self.tty
+
+
+class Daemon:
+    """Answers the requests of gpt-ui calls with one Conf that is kept warm.
+
+    When a config file changes, the Conf is created again. Commands print to stdout, which is replaced by the
+    connection while they run, so they run one at a time. Chats run concurrently.
+    """
+    def __init__(self, make_conf, path):
+        from threading import Lock
+        self.make_conf = make_conf
+        self.path = Path(path)
+        self._conf_lock = Lock()
+        self._command_lock = Lock()
+        self.conf = None
+        self._config_mtimes = None
+        self.server = None
+
+    def _config_files(self, conf):
+        return [conf.config_file, conf.config_file_local, conf.config_dir / 'api_key.yaml',
+                conf.project_dir / 'models_metadata.yaml']
+
+    def _mtimes(self, conf):
+        mtimes = []
+        for path in self._config_files(conf):
+            try:
+                mtimes.append(path.stat().st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def current_conf(self):
+        """The Conf, created again if a config file changed."""
+        with self._conf_lock:
+            if self.conf is not None and self._mtimes(self.conf) == self._config_mtimes:
+                return self.conf
+            old_conf, self.conf = self.conf, self.make_conf()
+            self._config_mtimes = self._mtimes(self.conf)
+            self.conf.scheduler.submit('warm_up', self.conf.warm_up, priority=0, lane='slow')
+            self.conf.scheduler.submit('catalog', self.conf.catalog.refresh, priority=20, lane='slow')
+        if old_conf is not None:
+            old_conf.cleanup()
+        return self.conf
+
+    def run(self, f, request):
+        import copy
+        from contextlib import redirect_stderr, redirect_stdout
+        import rich
+        from gpt_ui.cli import run_command
+        tty = request.get('tty', False)
+        with self._command_lock:
+            conf = copy.copy(self.current_conf())
+            out, err = RemoteOutput(f, 'out', tty), RemoteOutput(f, 'err')
+            exit_code = 0
+            rich.reconfigure(file=out, force_terminal=tty, color_system='standard' if tty else None,
+                             width=request.get('columns'))
+            try:
+                with redirect_stdout(out), redirect_stderr(err):
+                    conf.args = conf.parse_args(request['argv'])
+                    if conf.args.daemon:
+                        print('A daemon is running already.', file=sys.stderr)
+                        exit_code = 1
+                    elif conf.args.stop_daemon:
+                        print('Stopped the daemon.')
+                        # shutdown waits for the request to end, so it can not be called by the request
+                        from threading import Thread
+                        Thread(target=self.server.shutdown).start()
+                    elif conf.args.config or conf.args.batch or not run_command(conf):
+                        send(f, {'local': True})
+                        return
+            except SystemExit as e:
+                # By argparse, for --help and invalid arguments
+                exit_code = e.code if isinstance(e.code, int) else 1
+            except Exception as e:
+                err.write(f"Error: {e}\n")
+                exit_code = 1
+            finally:
+                rich.reconfigure()
+        send(f, {'exit': exit_code})
+
+    def chat(self, f, request):
+        from gpt_ui.client import APIError
+        conf = self.current_conf()
+        stats = {}
+        response = conf.client.stream(request['model'], request['messages'], stats)
+        try:
+            for content in response:
+                send(f, {'content': content})
+            send(f, {'done': True, 'stats': stats})
+        except APIError as e:
+            send(f, {'error': str(e), 'status': e.status})
+        finally:
+            # Stops the request to the API when the client went away
+            response.close()
+
+    def serve(self):
+        import socketserver
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    request = json.loads(self.rfile.readline())
+                    if request.get('op') == 'run':
+                        daemon.run(self.wfile, request)
+                    elif request.get('op') == 'chat':
+                        daemon.chat(self.wfile, request)
+                except (OSError, ValueError):
+                    # The client went away, or did not send a request
+                    pass
+
+        self.path.parent.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self.path.parent.mkdir(mode=0o700, exist_ok=True)
+        if not is_private(self.path.parent):
+            raise RuntimeError(f"{self.path.parent} or its parent can be used by other users, so the daemon does not "
+                               f"serve there. Set XDG_RUNTIME_DIR or remove it.")
+        if daemon_running(self.path):
+            raise RuntimeError(f"A daemon is running already at {self.path}.")
+        # Left by a daemon that did not stop cleanly
+        self.path.unlink(missing_ok=True)
+        self.current_conf()
+        self.server = socketserver.ThreadingUnixStreamServer(str(self.path), Handler)
+        self.server.daemon_threads = True
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.path.unlink(missing_ok=True)
+            if self.conf is not None:
+                self.conf.cleanup()
@@ -0,0 +1,120 @@
+import mmap
+import os
+import re
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Optional, Tuple
+
+file_link = re.compile(':file:(.*):')
+
+
+def file_error(path):
+    return f"Error: The file {path} does not exist. Tell this to the user very briefly, telling them the path that does not exsist, ignoring the rest of the prompt."
+
+
+def read_windows(path, size, head_bytes, tail_bytes) -> Tuple[str, str]:
+    """Read only the beginning and the end of a large file."""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        head = m[:head_bytes].decode(errors='ignore')
+        tail = m[size - tail_bytes:].decode(errors='ignore')
+    return head, tail
+
+
+class FileExpander:
+    """Replaces :file:PATH: links with the content of PATH.
+
+    File contents are cached by (path, mtime, size) in an LRU cache bounded by total size. Files with more
+    than token_cap tokens are cut down to their beginning and end. Files so large that this cut is certain
+    are never read completely, only the needed windows are read through mmap.
+    Expanded messages are memoized, and stay valid as long as the files they link to are unchanged.
+    """
+    # The ratio of the head and the tail of a file that is kept when it is cut
+    head_ratio = 2 / 3
+    # No tokenizer produces fewer tokens per byte than this for text
+    min_bytes_per_token = 16
+
+    def __init__(self, enc, token_cap, max_bytes=64 * 2**20, max_messages=1000):
+        self.enc = enc
+        self.token_cap = token_cap
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self._files = OrderedDict()
+        self._files_bytes = 0
+        self._messages = OrderedDict()
+        self._lock = Lock()
+
+    def _stat(self, path) -> Optional[Tuple[str, int, int]]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return str(path), stat.st_mtime_ns, stat.st_size
+
+    def _cut(self, head, tail=None) -> str:
+        """Cut a text to token_cap tokens, keeping its beginning and end.
+           If the tail is given, the head and the tail are the windows read from a file too large to read.
+        """
+        head_tokens = self.enc.encode(head)
+        if tail is None:
+            if len(head_tokens) <= self.token_cap:
+                return head
+            tail_tokens = head_tokens
+            omitted = f"{len(head_tokens) - self.token_cap} tokens omitted"
+        else:
+            tail_tokens = self.enc.encode(tail)
+            omitted = "the middle of the file is omitted"
+        n_head = int(self.token_cap * self.head_ratio)
+        n_tail = self.token_cap - n_head
+        return f"{self.enc.decode(head_tokens[:n_head])}\n[... {omitted} ...]\n{self.enc.decode(tail_tokens[-n_tail:])}"
+
+    def _read(self, key) -> str:
+        path, _, size = key
+        window = self.token_cap * self.min_bytes_per_token
+        if size > window:
+            head_bytes = int(window * self.head_ratio)
+            return self._cut(*read_windows(path, size, head_bytes, window - head_bytes))
+        with open(path) as f:
+            return self._cut(f.read())
+
+    def embedding(self, path) -> Tuple[str, Optional[Tuple[str, int, int]]]:
+        """Return the text that replaces a link to path, and the (path, mtime, size) it depends on."""
+        key = self._stat(path)
+        if key is None:
+            return file_error(path), None
+        with self._lock:
+            text = self._files.get(key)
+            if text is not None:
+                self._files.move_to_end(key)
+        if text is None:
+            text = f"\n{path}>>>\n{self._read(key)}\n<<<{path}\n"
+            with self._lock:
+                if key not in self._files:
+                    self._files[key] = text
+                    self._files_bytes += len(text)
+                while self._files_bytes > self.max_bytes and len(self._files) > 1:
+                    _, evicted = self._files.popitem(last=False)
+                    self._files_bytes -= len(evicted)
+        return text, key
+
+    def expand(self, content) -> str:
+        with self._lock:
+            memo = self._messages.get(content)
+        if memo is not None:
+            deps, expanded = memo
+            if all(self._stat(path) == key for path, key in deps):
+                return expanded
+        deps = []
+
+        def replace(match):
+            path = Path(match.group(1))
+            text, key = self.embedding(path)
+            deps.append((path, key))
+            return text
+        expanded = file_link.sub(replace, content)
+        with self._lock:
+            self._messages[content] = (deps, expanded)
+            self._messages.move_to_end(content)
+            if len(self._messages) > self.max_messages:
+                self._messages.popitem(last=False)
+        return expanded
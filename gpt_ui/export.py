@@ -0,0 +1,106 @@
+import hashlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Tuple
+
+from gpt_ui.journal import load_chat
+from gpt_ui.util import write_json
+
+# Remembers for each exported chat the (mtime, size, sha256) of the json file it was exported from.
+# It has no .json extension, as all .json files in the chat directory are chats.
+manifest_name = '.export_manifest'
+
+
+def write_chat_markdown(chat, f):
+    f.write('%% Auto geneterated file, do not edit %%\n\n')
+    for m in chat:
+        if m['role'] == 'assistant':
+            speaker = m.get('model', 'assistant')
+        elif m['role'] == 'user':
+            speaker = m.get('user', 'user')
+        else:
+            speaker = m['role']
+        f.write(f"**{speaker}:** {m['content']}\n")
+
+
+def chat_to_markdown(chat):
+    f = io.StringIO()
+    write_chat_markdown(chat, f)
+    return f.getvalue()
+
+
+def save_markdown(chat, path):
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with tmp_path.open('w') as f:
+        write_chat_markdown(chat, f)
+    os.replace(tmp_path, path)
+
+
+def file_hash(path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def export_chat(path) -> Tuple[str, str, float]:
+    """Export the chat at path to a markdown file next to it. Runs in a worker process.
+       @return: a touple of (name of the chat, sha256 of the chat file, seconds it took)
+    """
+    start = time.perf_counter()
+    path = Path(path)
+    save_markdown(load_chat(path), path.with_suffix('.md'))
+    return path.name, file_hash(path), time.perf_counter() - start
+
+
+def export_chats_to_markdown(chat_dir, max_workers=None):
+    """Export all named chats in chat_dir whose json file changed since the last export."""
+    start = time.perf_counter()
+    chat_dir = Path(chat_dir)
+    manifest_path = chat_dir / manifest_name
+    manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    todo = []
+    skipped = 0
+    with os.scandir(chat_dir) as it:
+        for entry in it:
+            if entry.name.startswith('.') or not entry.name.endswith('.json') or not entry.is_file():
+                continue
+            stat = entry.stat()
+            known = manifest.get(entry.name)
+            if known and Path(entry.path).with_suffix('.md').exists():
+                if known['mtime_ns'] == stat.st_mtime_ns and known['size'] == stat.st_size:
+                    skipped += 1
+                    continue
+                # Touched, but not changed
+                if known['size'] == stat.st_size and known['sha256'] == file_hash(entry.path):
+                    known['mtime_ns'] = stat.st_mtime_ns
+                    skipped += 1
+                    continue
+            todo.append((entry.path, stat))
+
+    exported, failed = [], []
+    if len(todo) > 0:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [(path, stat, pool.submit(export_chat, path)) for path, stat in todo]
+            for path, stat, future in futures:
+                try:
+                    name, sha256, seconds = future.result()
+                except Exception as e:
+                    failed.append(path)
+                    print(f"Error while exporting chat {path}: {e}")
+                    continue
+                manifest[name] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': sha256}
+                exported.append((name, seconds))
+    write_json(manifest_path, manifest)
+
+    for name, seconds in sorted(exported, key=lambda x: -x[1])[:5]:
+        print(f"{seconds * 1000:8.1f} ms {name}")
+    print(f"Exported {len(exported)}, skipped {skipped} unchanged, failed {len(failed)} "
+          f"in {time.perf_counter() - start:.2f} s")
+    return exported, skipped, failed
@@ -1,32 +1,43 @@
 from glob import glob
-import itertools
 import platform
 import re
-import subprocess
 from pathlib import Path
 import json
-import textwrap
 import time
 import os
-from copy import deepcopy
 from typing import List, Optional, Tuple, Union, Any
 import html
-from threading import Thread
+import copy
+import threading
+from contextlib import nullcontext
 import sys
-from gsay.gsay import speak
 
 import yaml
-import openai
-from openai.error import TryAgain
 import prompt_toolkit as pt
 from prompt_toolkit import HTML, PromptSession
+from prompt_toolkit.formatted_text import FormattedText, to_formatted_text
 from prompt_toolkit.history import FileHistory
 from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
 from prompt_toolkit.completion import WordCompleter
 from xdg_base_dirs import xdg_config_home
-from rich import print
+from rich import print, get_console
 
 from gpt_ui.util import timestamp
+from gpt_ui.tts import Speaker
+from gpt_ui.context import cut_index
+from gpt_ui.compaction import compact_chat, SUMMARY_KEY
+from gpt_ui.journal import load_chat
+from gpt_ui.store import write_manifest
+from gpt_ui.vault import ObsidianCompleter
+from gpt_ui.expand import file_link
+from gpt_ui.retrieval import retrieval_embedding
+from gpt_ui.export import save_markdown
+from gpt_ui.client import APIError
+from gpt_ui.compare import compare_models, parse_compare
+from gpt_ui.ledger import tokens_per_s
+from gpt_ui.sentences import SentenceSegmenter
+from gpt_ui.cli import list_chats, print_stats, search_chats
+from gpt_ui.trace import mark, span, turn
 
 # Basic helper functions
 def set_terminal_title(title):
@@ -68,12 +79,16 @@ class Commands:
     regenerate = Command(['regenerate'], 'Regenerate the chat')
     speak = Command(['speak', 's'], 'Speak the messages')
     speak_last = Command(['speak last', 'sl'], 'Speak the last messages')
+    speed = Command(['speed'], 'Set the speed of the speech, e.g. "speed 1.4"')
+    search = Command(['search'], 'Search all saved chats, e.g. "search [all] [role:user] [model:gpt-4] [since:2024-01] [until:2024-02] [chat:NAME] words"')
+    stats = Command(['stats'], 'Show the tokens, latency and cost of all API calls, e.g. "stats [model|day|chat|kind]"')
+    compare = Command(['compare'], 'Send the prompt to several models at once and keep one answer, e.g. "compare g4o g4t: PROMPT"')
     help = Command(['help', 'h'], 'Show this help message')
     def __str__(self) -> str:
         return '\n'.join([str(x) for x in [Commands.exit, Commands.pass_, Commands.restart, Commands.restart_hard, Commands.list, \
                                             Commands.list_all, Commands.load, Commands.save, Commands.edit, \
-                                            Commands.regenerate, Commands.speak, Commands.speak_last, \
-                                            Commands.help]])
+                                            Commands.regenerate, Commands.speak, Commands.speak_last, Commands.speed, \
+                                            Commands.search, Commands.compare, Commands.stats, Commands.help]])
 
 commands = Commands()
 
@@ -102,57 +117,93 @@ def next_role(chat):
         return "user"
 
 def print_chat(conf, chat):
+    # Printed with one call, as every call of print_formatted_text sets up its styles again, which takes milliseconds.
+    # There are only a few different prompts, so each is parsed once.
+    fragments = []
+    prompts = {}
     for m in chat:
         name = m['model'] if m['role'] == 'assistant' \
                           else (m['user'] if m['role'] == 'user' else 'system')
         prompt = f'{name}:'
         prompt += conf.config['prompt_postfix']
-        pt.print_formatted_text(HTML(f"{color_by_role(m['role'], prompt)}"))
-        pt.print_formatted_text(f"{m['content']}")
+        if (m['role'], prompt) not in prompts:
+            prompts[m['role'], prompt] = to_formatted_text(HTML(f"{color_by_role(m['role'], html.escape(prompt))}"))
+        fragments += prompts[m['role'], prompt]
+        fragments.append(('', f"\n{m['content']}\n"))
+    pt.print_formatted_text(FormattedText(fragments), end='')
+
+def new_message(conf, role, content, l_date=None, l_model=None, l_user=None):
+    return {"role": role, "model": l_model if l_model else conf.model, 'user': l_user if l_user else conf.user, 'date': l_date if l_date else timestamp(), "content": content}
 
 def append_to_chat(conf, chat, role, content, l_date=None, l_model=None, l_user=None):
-    date = timestamp()
-    chat.append({"role": role, "model": l_model if l_model else conf.model, 'user': l_user if l_user else conf.user, 'date': l_date if l_date else date, "content": content})
+    chat.append(new_message(conf, role, content, l_date=l_date, l_model=l_model, l_user=l_user))
+    # Count the new message right away, such that later counts of the chat only hit the cache
+    conf.token_counter.count_message(chat[-1])
     backup_chat(conf, chat)
 
 def number_of_tokens(conf, chat):
-    length = 0
-    for c in chat:
-        length += len(conf.enc.encode(c['content']))
-    return length
+    return conf.token_counter.count_chat(chat)
 
 def trim_chat(conf, chat):
-    num_tokens = len(conf.enc.encode(chat[0]['content']))
-    new_chat = []
-    for i, e in enumerate(reversed(chat[1:])):
-        num_tokens += len(conf.enc.encode(e['content']))
-        if num_tokens > conf.max_tokens:
-            break
-        new_chat.append(e)
-    new_chat = list(reversed(new_chat))
-    return [chat[0]] + new_chat, num_tokens
+    """Trim the chat to the context window of the model, leaving room for the completion.
+       The token counts are taken after exploding the file links, as that is what gets sent.
+       With --compact the dropped messages are replaced by a summary, see gpt_ui.compaction.
+       @return: a touple of (exploded chat to send, number of tokens, indices of the dropped messages)
+    """
+    with span('trim_chat', messages=len(chat)):
+        exploded_chat = explode_chat(conf, chat)
+        if len(exploded_chat) == 0:
+            return exploded_chat, 0, []
+        with span('count tokens'):
+            counts = conf.token_counter.message_counts(exploded_chat)
+        overhead = conf.token_counter.tokens_reply_priming
+        budget = conf.max_tokens - conf.completion_reserve
+        if conf.args.compact:
+            budget -= conf.summary_reserve
+        start = cut_index(counts, budget, overhead)
+        trimmed_chat = exploded_chat[:1]
+        if conf.args.compact and start > 1:
+            with span('compact_chat'):
+                summary, start = compact_chat(conf, chat, exploded_chat, counts, start)
+            if summary is not None:
+                # A summary stored with a larger reserve can be longer than it, then more messages are left out
+                excess = conf.token_counter.count_message(summary) - conf.summary_reserve
+                while excess > 0 and start < len(exploded_chat) - 1:
+                    excess -= counts[start]
+                    start += 1
+                trimmed_chat.append(summary)
+        trimmed_chat += exploded_chat[start:]
+        num_tokens = conf.token_counter.count_chat(trimmed_chat)
+        return trimmed_chat, num_tokens, list(range(1, start))
 
 def backup_chat(conf, chat, name=None, prompt_name=None):
     if len(chat) == 0:
         return
-    # Always backup chat first, even if we are prompting for a name
-    with ensure_extension(conf.chat_backup_file, ".json").open("w") as f:
-        json.dump(chat, f, indent=4)
+    # Always backup chat first, even if we are prompting for a name.
+    # Only the messages that changed since the last backup are appended to the journal.
+    with span('backup_chat', messages=len(chat)):
+        n_unchanged, changed = conf.journal.sync(chat)
+        conf.search_index.update(conf.chat_backup_file.name, n_unchanged, changed)
     if prompt_name:
         try:
             user_input_name = pt.prompt("Save name: ")
-            with (conf.chat_dir / ensure_extension(user_input_name, "json")).open("w") as f:
-                json.dump(chat, f, indent=4)
+            save_chat(conf, chat, user_input_name)
             return user_input_name
         except EOFError as e:
             pass
     elif name:
-        with (conf.chat_dir / ensure_extension(name, '.json')).open("w") as f:
-            json.dump(chat, f, indent=4)
+        save_chat(conf, chat, name)
         return name
     else:
         return conf.chat_backup_file
 
+def save_chat(conf, chat, name):
+    with span('save_chat', messages=len(chat)):
+        conf.journal.compact(chat)
+        path = conf.chat_dir / ensure_extension(name, '.json')
+        write_manifest(path, chat)
+        conf.search_index.update(path.name, 0, chat)
+
 def edit_chat(conf, chat, user_input):
     backup_chat(conf, chat)
     meta_data_prefix = f"###>>>"
@@ -160,45 +211,35 @@ def edit_chat(conf, chat, user_input):
         for m in chat:
             meta_data = json.dumps({k: v for k, v in m.items() if k != 'content'})
             f.write(f"{meta_data_prefix}{meta_data}\n{m['content']}\n\n")
-        meta_data = json.dumps({'role': next_role(chat), 'model': model, 'user': conf.user, 'date': timestamp()})
+        meta_data = json.dumps({'role': next_role(chat), 'model': conf.model, 'user': conf.user, 'date': timestamp()})
         f.write(f"{meta_data_prefix}{meta_data}\n\n")
     os.system(f"{user_input} {conf.chat_dir / 'temp'}")
+    old_chat = chat
     with (conf.chat_dir / 'temp').open() as f:
         chat = []
-        role = None
+        meta_data = None
         text = ""
-        last_r = None
         for line in f:
-            r = None
             if line.startswith(meta_data_prefix):
-                r = json.loads(line[len(meta_data_prefix):])
-                last_r = r
-            if r:
-                if role:
-                    append_to_chat(
-                        conf,
-                        chat, 
-                        role, 
-                        text.strip(), 
-                        l_date=r['date'] if r and 'date' in r else None, 
-                        l_user=r['user'] if r and 'user' in r else None,
-                        l_model=r['model'] if r and 'model' in r else None)
-                backup_chat(conf, chat)
+                if meta_data is not None:
+                    chat.append({**new_message(conf, meta_data['role'], ''), **meta_data, 'content': text.strip()})
+                meta_data = json.loads(line[len(meta_data_prefix):])
                 text = ""
-                role = r['role']
             else:
                 text += line
-        if text.strip() != "":
-            append_to_chat(
-                conf,
-                chat, 
-                role, 
-                text.strip(), 
-                l_date=last_r['date'] if 'date' in last_r else None, 
-                l_user=last_r['user'] if 'user' in last_r else None,
-                l_model=last_r['model'] if 'model' in last_r else None)
-        backup_chat(conf, chat)
+        if meta_data is not None and text.strip() != "":
+            chat.append({**new_message(conf, meta_data['role'], ''), **meta_data, 'content': text.strip()})
     (conf.chat_dir / 'temp').unlink()
+    # Summaries of messages at or after the first edited message are stale
+    n_unchanged = 0
+    for old, new in zip(old_chat, chat):
+        if old['content'] != new['content']:
+            break
+        n_unchanged += 1
+    for m in chat[n_unchanged:]:
+        m.pop(SUMMARY_KEY, None)
+    conf.token_counter.discard_changed(old_chat, chat)
+    backup_chat(conf, chat)
     print('\n\n')
     print_chat(conf, chat)
     return chat
@@ -212,28 +253,6 @@ def edit_chat(conf, chat, user_input):
 #         hash = hashlib.md5(text.encode('utf-8')).hexdigest()
 #     speak(text)
 
-def list_chats(conf, hide_backups=True):
-    for chats in sorted(conf.chat_dir.iterdir()):
-        if chats.is_dir() or chats.name.endswith('.md'):
-            continue
-        color = 'green'
-        if hide_backups and chats.name.startswith('.'):
-            continue
-        if chats.name.startswith('.backup'):
-            color = 'magenta'
-        pt.print_formatted_text(HTML(HTML_color(html.escape(chats.name), color)))
-        with chats.open() as f:
-            chat = json.load(f)
-            print(textwrap.shorten(chat[-1]['content'], width=100))
-        print()
-
-def get_file_content_embeding(path):
-    if not path.exists():
-        return f"Error: The file {path} does not exist. Tell this to the user very briefly, telling them the path that does not exsist, ignoring the rest of the prompt."
-    with path.open() as f:
-        text = f.read()
-    return f"\n{path}>>>\n{text}\n<<<{path}\n"
-
 def search_file(start_path: Path, target_file: str) -> Optional[List[Path]]:
     matches = list(start_path.rglob(target_file))  # Search for target file
     if matches:
@@ -241,24 +260,23 @@ def search_file(start_path: Path, target_file: str) -> Optional[List[Path]]:
     else:
         return None
 
-def search_single_file(start_path: Path, target_file: str) -> Path:
-    matches = list(start_path.rglob(target_file))  # Search for target file
-    if matches:
-        if len(matches) == 1:
-            return matches[0] # Returns list of all matches file paths
-        else:
-            completer = WordCompleter([str(x) for x in matches])
-            result = pt.prompt('Please enter your choice:', completer=completer)
-            return Path(result)
-    else:
-        return None
-
-def explode_file_links(chat):
-    for c in chat:
-          c.update({'content': re.sub(':file:(.*):',
-                 lambda match: get_file_content_embeding(Path(match.group(1))), 
-                 c['content'])})
-    return chat
+def choose_obsidian_note(conf, m, name) -> str:
+    """Find the path of the obsidian note `name`. If there are several notes with that name, the user is asked
+       which one to use, and the choice is stored on the message m, such that they are only asked once per chat.
+    """
+    chosen = m.get('obsidian_links', {}).get(name)
+    if chosen is not None and Path(chosen).exists():
+        return chosen
+    matches = conf.vault_index.lookup(name)
+    if len(matches) == 0:
+        return name
+    # Never prompt from a background thread, e.g. while the toolbar is updated
+    if len(matches) == 1 or threading.current_thread() is not threading.main_thread():
+        return str(matches[0])
+    completer = WordCompleter([str(x) for x in matches])
+    chosen = pt.prompt(f'There are several notes named {name}. Please enter your choice: ', completer=completer)
+    m.setdefault('obsidian_links', {})[name] = chosen
+    return chosen
 
 def ensure_extension(string: str, ext: str) -> str:
     """Ensure that the text ends with a particular extension."""
@@ -276,165 +294,149 @@ def ensure_extension(string: str, ext: str) -> str:
     return return_value
 
 
-def resolve_obsidian_links(conf, chat):
-    for c in chat:
-          c.update({'content': re.sub(':obsidian:(.*):',
-                 lambda match: f":file:{search_single_file(conf.obsidian_vault_dir, ensure_extension(match.group(1), '.md'))}:",
-                 c['content'])})
-    return chat
+def resolve_obsidian_links(conf, m):
+    return re.sub(':obsidian:(.*):',
+                  lambda match: f":file:{choose_obsidian_note(conf, m, ensure_extension(match.group(1), '.md'))}:",
+                  m['content'])
+
+def retrieve_links(conf, m, content, passages):
+    """Replace :obsidian?:QUERY: with the passages of the vault most relevant to QUERY. With --retrieve, also
+       replace :file: links with the passages of the file most relevant to the rest of the message.
+       The passages are appended to passages and only a placeholder is put into the content, see explode_message.
+    """
+    def retrieve(query, paths=None):
+        by_file = conf.chunk_index.retrieve(query, conf.token_counter, conf.retrieve_token_budget,
+                                            paths=paths, top_k=conf.retrieve_top_k)
+        passages.append(retrieval_embedding(by_file, query, paths[0] if paths else None))
+        return f"\0{len(passages) - 1}\0"
+    content = re.sub(r':obsidian\?:(.*):', lambda match: retrieve(match.group(1)), content)
+    if conf.args.retrieve:
+        query = re.sub(r':(file|obsidian\??):(.*):', '', m['content'])
+        if query.strip() != '':
+            content = file_link.sub(lambda match: retrieve(query, [Path(match.group(1))]) if Path(match.group(1)).is_file() else match.group(0),
+                                    content)
+    return content
+
+def explode_message(conf, m):
+    if ':obsidian' not in m['content'] and ':file:' not in m['content']:
+        return m
+    passages = []
+    content = retrieve_links(conf, m, resolve_obsidian_links(conf, m), passages)
+    content = conf.file_expander.expand(content)
+    # The retrieved passages are put in after the links were expanded, as a :file: link quoted in a note is text
+    return {**m, 'content': re.sub('\0(\\d+)\0', lambda match: passages[int(match.group(1))], content)}
 
 def explode_chat(conf, chat):
-    chat = deepcopy(chat)
-    chat = resolve_obsidian_links(conf, chat)
-    chat = explode_file_links(chat)
-    return chat
+    """Replace the :obsidian: and :file: links in the chat with the contents of the files.
+       Messages without links are not copied, so the returned chat must not be modified.
+    """
+    with span('explode_chat', messages=len(chat)):
+        return [explode_message(conf, m) for m in chat]
 
 def get_summary(conf, chat):
-    try:
-        exploded_chat = explode_chat(conf, chat)
-        summarize_instuctions = (
-            'Please give a summary of the conversation so far in 5 words or less. You do not need to make a complete sentence. '
-            'Be as brief and descriptive as possible. Ideally do not leave out any topics discussed. If there are too many '
-            'topics (and only then) it is ok to write a longer than 5 words summary, but still keep it as brief as possible. '
-            'Do not use the following characters in your output: "*", ":", "!", "?", "/", "\\"')
-        summary_response = openai.ChatCompletion.create(
-            model=conf.model,
-            messages=[{k: v for k, v in y.items() if k in ['role', 'content']} for y in exploded_chat] + [{'role': 'user', 'content': summarize_instuctions}],
-        )
-        summary = summary_response["choices"][0].message["content"]
-    # TODO make this exception more specific
-    except Exception as e:
-        summary = ''
-        print('Error: ', e)
-    return summary
+    return conf.summary_service.get(chat)
 
 class Toolbar:
     def __init__(self, conf):
         self.conf = conf
         self.n_tokens = 0
         self.summary = ''
-        self.worker = None
+        self.summary_error = None
 
     def __str__(self):
-        return f'{self.conf.model} | {int(self.n_tokens/self.conf.max_tokens*100)}% {self.n_tokens}/{self.conf.max_tokens} | {self.conf.args.personality} | {self.summary}'
+        return f'{self.conf.model} | {int(self.n_tokens/self.conf.max_tokens*100)}% {self.n_tokens}/{self.conf.max_tokens} | {self.conf.args.personality} | {self._telemetry()}{self.summary}{self._summary_error()}'
+
+    def _summary_error(self):
+        if self.summary_error is None:
+            return ''
+        error = self.summary_error if len(self.summary_error) <= 60 else self.summary_error[:57] + '...'
+        return f" (summary failed: {error})"
+
+    def _telemetry(self):
+        last = self.conf.ledger.last.get('chat')
+        if last is None:
+            return ''
+        ttft = f"{last['ttft']:.1f}s" if last['ttft'] is not None else '-'
+        speed = tokens_per_s(last)
+        speed = f" {speed:.0f} tok/s" if speed is not None else ''
+        return f"TTFT {ttft}{speed} ${last['cost']:.3f} (session ${self.conf.ledger.session_cost:.2f}) | "
 
     def background_update(self, chat):
-        if self.worker is None or not self.worker.is_alive():
-            t = Thread(target=self._update, args=[chat])
-            self.worker = t
-            t.start()
+        # A copy, as the chat keeps changing while the jobs run. The summary calls the API, so it runs in the slow lane,
+        # and the cheap token count is never held up by it.
+        chat = list(chat)
+        self.conf.scheduler.submit('toolbar_tokens', self._num_tokens, chat, priority=0, on_done=self._set_num_tokens)
+        self.conf.scheduler.submit('toolbar_summary', get_summary, self.conf, chat, priority=10, lane='slow', on_done=self._set_summary)
 
-    def _update(self, chat):
-        self._update_num_tokens(chat)
-        self._update_summary(chat)
+    def _num_tokens(self, chat):
+        return number_of_tokens(self.conf, explode_chat(self.conf, chat))
 
-    def _update_num_tokens(self, chat):
-        self.n_tokens = number_of_tokens(self.conf, explode_chat(self.conf, chat))
+    def _set_num_tokens(self, n_tokens):
+        self.n_tokens = n_tokens
 
-    def _update_summary(self, chat):
-        self.summary = get_summary(self.conf, chat)
+    def _set_summary(self, summary):
+        self.summary = summary
+        self.summary_error = self.conf.summary_service.error
         set_terminal_title(f"GPT {self.summary}")
 
 
-class Speaker:
-    def __init__(self, conf):
-        self.conf = conf
-        self.arg_queue = []
-        self.queue_processor = None
-        self.stop_flag = False
-        self.speak_subprocess = None
-
-    def stop(self):
-        self.stop_flag = True
-        if self.speak_subprocess is not None:
-            self.speak_subprocess.kill()
-        self.arg_queue = []
-
-    def speak(self, cmd, text) -> None:
-        text = self._prepare_text(text)
-        text = text.strip()
-        if text == "":
-            return
-        speak_touple = self._precompute_speech(cmd, text)
-        self.arg_queue.append(speak_touple)
-        if self.queue_processor is None or not self.queue_processor.is_alive():
-            tp = Thread(target=self._process_queue)
-            self.queue_processor = tp
-            tp.start()
-
-    def _process_queue(self):
-        while len(self.arg_queue) > 0 and not self.stop_flag:
-            t = Thread(target=self._speak)
-            t.start()
-            t.join()
-
-    def _precompute_speech(self, cmd, text) -> Tuple[subprocess.Popen, Path]:
-        if cmd == "say" and platform.system() == "Darwin":
-            extension = ".aiff"
-        else:
-            extension = ".mp3"
-        cache_file = self.conf.voice_precache_dir / f"{timestamp()}{extension}"
-        debug_notify(self.conf, text)
-        proc = subprocess.Popen([cmd, "--output-file", cache_file, "--speed", str(1), "--", text], stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-        return proc, Path(cache_file), text
-
-    def _prepare_text(self, reading_buffer):
-        reading_buffer = re.sub('`', '', reading_buffer)
-        reading_buffer = re.sub('"', '', reading_buffer)
-        # Filter out python interpreter prompt
-        reading_buffer = re.sub('>>> ', '', reading_buffer)
-        # Filter out underscores
-        reading_buffer = re.sub('_', ' ', reading_buffer)
-        reading_buffer = reading_buffer.strip()
-        return reading_buffer
-
-    def _speak(self):
-        proc, cache_file, text = self.arg_queue.pop(0)
-        proc.wait()
-        mpv_speed = 1.4 #min(sum([len(s[2]) for s in self.arg_queue]) * 0.0001  + 1, 1.1)
-        if cache_file.exists():
-            self.speak_subprocess = subprocess.Popen(["mpv", "--really-quiet", f"--speed={mpv_speed}", cache_file], stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-            self.speak_subprocess.wait()
-            if cache_file.exists():
-                cache_file.unlink()
-
-
-def get_first_sentence(text: str) -> Tuple[str, str]:
-    """Split the first sentence out of a text blob.
-       @return: Rutrns a touple of (first sentence, rest of text)
+def compare_answers(conf, chat, text):
+    """Stream the answers of several models to the chat and the prompt in text, and keep the answer the user picks.
+       If no answer is kept, the prompt is removed from the chat again.
     """
-    end_chars = ['.', '?', '!', ':', '。', '？', '！']
-    end_markers = []
-    for c in end_chars:
-        end_markers.append(c + ' ')
-        end_markers.append(c + '\n')
-        end_markers.append(c + '"')
-        end_markers.append(c + "'")
-
-    first_sentence = ''
-    remaining_text = text
-    for i in range(len(text)):
-        if text[i] == '\n' or (len(text) >= 2 and text[i:i+2] in end_markers):
-            first_sentence = text[:i+1]
-            remaining_text = text[i+1:]
-            break
-    return first_sentence, remaining_text
+    try:
+        models, prompt = parse_compare(conf.models_dict, text)
+    except ValueError as e:
+        pt.print_formatted_text(HTML(HTML_color(html.escape(str(e)), 'red')))
+        return
+    if prompt:
+        append_to_chat(conf, chat, 'user', prompt)
+    # Trimmed to the context window of each model, once per window size
+    trimmed = {}
+    messages, num_tokens = [], []
+    for model in models:
+        window = (model['max_tokens'], model.get('completion_reserve', 0))
+        if window not in trimmed:
+            model_conf = copy.copy(conf)
+            model_conf.max_tokens, model_conf.completion_reserve = window
+            exploded_chat, n_tokens, dropped = trim_chat(model_conf, chat)
+            trimmed[window] = [{k: v for k, v in y.items() if k in ['role', 'content']} for y in exploded_chat], n_tokens
+        messages.append(trimmed[window][0])
+        num_tokens.append(trimmed[window][1])
+    colors = ['red', 'magenta', 'cyan', 'yellow', 'blue', 'green']
+    width = max(len(m['name']) for m in models)
+
+    def print_line(i, line):
+        header = HTML_bold(HTML_color(html.escape(f"{models[i]['name']:<{width}} |"), colors[i % len(colors)]))
+        pt.print_formatted_text(HTML(f"{header} {html.escape(line)}"))
+    start = time.perf_counter()
+    answers = compare_models(conf.client, models, messages, print_line)
+    print(f"\nAll answers in {time.perf_counter() - start:.1f} s")
+    for i, (answer, n_input_tokens) in enumerate(zip(answers, num_tokens), 1):
+        n_output_tokens = conf.token_counter.count_text(answer.text)
+        conf.ledger.record('compare', answer.model['name'], n_input_tokens, n_output_tokens, answer.end - answer.start,
+                           ttft=answer.stats.get('ttft'), retries=answer.stats.get('retries', 0), error=answer.error)
+        ttft = answer.ttft()
+        tokens_per_s = answer.tokens_per_s(n_output_tokens)
+        stats = (f"first token {ttft:.2f} s" if ttft is not None else "no answer") + \
+                (f", {tokens_per_s:.0f} tokens/s" if tokens_per_s is not None else '') + \
+                f", {n_output_tokens} tokens, ${answer.cost(n_input_tokens, n_output_tokens):.4f}" + \
+                (f", error: {answer.error}" if answer.error else '')
+        print(f"{i}. {answer.model['name']}: {stats}")
 
-def chat_to_markdown(chat):
-    markdown = '%% Auto geneterated file, do not edit %%\n\n'
-    for m in chat:
-        if m['role'] == 'assistant':
-            speaker = m.get('model', 'assistant')
-        elif m['role'] == 'user':
-            speaker = m.get('user', 'user')
-        else:
-            speaker = m['role']
-        markdown += f"**{speaker}:** {m['content']}\n"
-    return markdown
+    try:
+        choice = pt.prompt(f'Keep which answer? [1-{len(answers)}, 0 for none] ', default='1').strip()
+    except (EOFError, KeyboardInterrupt):
+        choice = '0'
+    if choice.isdigit() and 1 <= int(choice) <= len(answers):
+        answer = answers[int(choice) - 1]
+        append_to_chat(conf, chat, 'assistant', answer.text, l_model=answer.model['name'])
+    elif prompt:
+        chat.pop()
+        backup_chat(conf, chat)
 
 def save_chat_as_markdown(conf, chat, name):
-    with (conf.chat_dir / f"{name}.md").open("w") as f:
-        f.write(chat_to_markdown(chat))
+    save_markdown(chat, conf.chat_dir / f"{name}.md")
 
 def sanetize_filename(filename):
     """Sanetize a filename to be safe to use on most filesystems, as well as work with the Obsidian sync plugin."""
@@ -445,61 +447,35 @@ def sanetize_filename(filename):
     
 def converse(conf):
     bottom_toolbar_session = Toolbar(conf)
-    speak_cmd = 'gsay'
+    speaker = Speaker(conf)
     # save_name_session = PromptSession(history=FileHistory(conf.prompt_history_dir /'saveing.txt'), auto_suggest=AutoSuggestFromHistory())
     # user_prompt_session = PromptSession(history=FileHistory(conf.project_dir /'user_prompt.txt'), auto_suggest=AutoSuggestFromHistory())
     save_name_session = PromptSession(auto_suggest=AutoSuggestFromHistory())
-    user_prompt_session = PromptSession(auto_suggest=AutoSuggestFromHistory())
+    # The vault index is loaded in the background, see Conf.warm_up
+    user_prompt_session = PromptSession(auto_suggest=AutoSuggestFromHistory(), completer=ObsidianCompleter(lambda: conf.vault_index))
     def bottom_toolbar():
         return str(bottom_toolbar_session)
-    
-    if conf.args.list_models_full:
-        for m in sorted(openai.Model.list()['data'], key=lambda x: x['id']): 
-            print(m)
-        exit(0)
-
-    if conf.args.list_models:
-        print('available models:')
-        for m in sorted(openai.Model.list()['data'], key=lambda x: x['id']): 
-            print(m['id'])
-        exit(0)
 
     chat_name = conf.args.chat_name
-
-    if conf.args.list_chats:
-        list_chats(conf)
-        exit(0)
-    if conf.args.list_all_chats:
-        list_chats(conf, hide_backups=False)
-        exit(0)
-    elif conf.args.config:
-        subprocess.run([os.environ['EDITOR'], conf.config_file])
-        exit(0)
-    if conf.args.export_chats_to_markdown:
-        for chat_file in conf.chat_dir.iterdir():
-            if chat_file.is_file() and not chat_file.name.startswith('.'):
-                with chat_file.open() as f:
-                    try:
-                        chat = json.load(f)
-                        save_chat_as_markdown(conf, chat, chat_file.stem)
-                    except Exception as e:
-                        print(f"Error while exporting chat {chat_file}: {e}")
-        exit(0)
+    if chat_name:
+        conf.ledger.chat = chat_name
 
     if conf.args.user_input:
         chat = get_inital_chat()
         chat.append({'role': 'user', 'content': conf.args.user_input, 'user': conf.config['user']})
     elif conf.args.load_chat:
-        with (conf.chat_dir / ensure_extension(conf.args.load_chat, ".json")).open() as f:
-            chat = json.load(f)
+        chat = load_chat(conf.chat_dir / ensure_extension(conf.args.load_chat, ".json"))
     elif conf.args.load_last_chat:
-        chat_path = [x for x in sorted(conf.chat_dir.iterdir()) if x.is_file() and x.name.startswith('.backup')][-1]
-        with chat_path.open() as f:
-            chat = json.load(f)
+        path = conf.catalog.last_backup()
+        if path is None:
+            print("INFO: There is no earlier chat to load, starting a new one.")
+        chat = load_chat(path) if path is not None else get_inital_chat(conf)
     else:
         chat = get_inital_chat(conf)
 
     print_chat(conf, chat)
+    # Prefetch what later commands need, while the user types
+    conf.scheduler.submit('catalog', conf.catalog.refresh, priority=20, lane='slow')
 
     print("INFO: To send a message you need to press ALT+ENTER. This is to enable multiline input.")
 
@@ -514,11 +490,12 @@ def converse(conf):
                 try:
                     prompt = f'{user_name}:{prompt_postfix}'
                     prompt = color_by_role(active_role, prompt)
-                    user_input = user_prompt_session.prompt(
-                        HTML(prompt), 
-                        bottom_toolbar=bottom_toolbar, 
-                        auto_suggest=AutoSuggestFromHistory(),
-                        multiline=True)
+                    with span('prompt'):
+                        user_input = user_prompt_session.prompt(
+                            HTML(prompt), 
+                            bottom_toolbar=bottom_toolbar, 
+                            auto_suggest=AutoSuggestFromHistory(),
+                            multiline=True)
                 except EOFError as e:
                     ctrl_d += 1
                 if ctrl_d > 0 or user_input in commands.exit.str_matches:
@@ -532,6 +509,7 @@ def converse(conf):
                         except KeyboardInterrupt as e:
                             abort = True
                         if abort or ctrl_d > 1 or chat_name in commands.exit.str_matches:
+                            conf.journal.compact(chat)
                             pt.print_formatted_text(f"Chat saved as: {backup_chat_name}")
                             exit(0)
                         if (conf.chat_dir / chat_name).exists() and pt.prompt('Chat already exists. Overwrite? ', bottom_toolbar=bottom_toolbar).lower() != 'y':
@@ -539,6 +517,7 @@ def converse(conf):
                                 continue
                         time.sleep(0.1)
                     chat_name = sanetize_filename(chat_name)
+                    conf.ledger.chat = chat_name
                     chat_save_name = backup_chat(conf, chat, chat_name)
                     save_chat_as_markdown(conf, chat, chat_name)
                     pt.print_formatted_text(f"Chat saved as: {chat_save_name}")
@@ -566,15 +545,15 @@ def converse(conf):
                     list_chats(conf, hide_backups=False)
                     continue
                 elif user_input in commands.load.str_matches:
-                    for chars in conf.chat_dir.iterdir():
-                        if not chars.name.startswith('.'):
-                            print(f"{chars.name}")
+                    for name, *_ in conf.catalog.chats():
+                        print(name)
                     chat_name = pt.prompt('Name of chat to load: ')
                     if chat_name == 'exit':
                         continue
-                    with conf.chat_dir.joinpath(ensure_extension(chat_name, ".json")).open() as f:
-                        backup_chat(conf, chat)
-                        chat = json.load(f)
+                    chat_path = conf.chat_dir.joinpath(ensure_extension(chat_name, ".json"))
+                    backup_chat(conf, chat)
+                    chat = load_chat(chat_path)
+                    conf.ledger.chat = chat_name
                     print('\n\n')
                     print_chat(conf, chat)
                     continue 
@@ -584,8 +563,8 @@ def converse(conf):
                         if chat_name == 'exit':
                             continue
                         time.sleep(0.1)
-                    with (conf.chat_dir / ensure_extension(chat_name, ".json")).open("w") as f:
-                        json.dump(chat, f, indent=4)
+                    conf.ledger.chat = chat_name
+                    backup_chat(conf, chat, chat_name)
                     continue
                 elif user_input in commands.edit.str_matches:
                     chat = edit_chat(conf, chat, user_input)
@@ -604,8 +583,34 @@ def converse(conf):
                 elif user_input in commands.help.str_matches:
                     print(commands)
                     continue
+                elif user_input.split(' ', 1)[0] in commands.search.str_matches:
+                    query = user_input.split(' ', 1)[1] if ' ' in user_input else ''
+                    hide_backups = not query.startswith('all ')
+                    search_chats(conf, query if hide_backups else query[len('all '):], hide_backups=hide_backups)
+                    continue
+                elif user_input.split(' ', 1)[0] in commands.speed.str_matches:
+                    try:
+                        speaker.set_speed(float(user_input.split(' ', 1)[1]))
+                    except (IndexError, ValueError):
+                        print(Commands.speed)
+                        continue
+                    print(f"Speech speed: {speaker.speed}")
+                    continue
+                elif user_input.split(' ', 1)[0] in commands.stats.str_matches:
+                    print_stats(conf, user_input.split(' ', 1)[1].strip() if ' ' in user_input else 'model')
+                    continue
+                elif user_input.split(' ', 1)[0] in commands.compare.str_matches:
+                    compare_answers(conf, chat, user_input.split(' ', 1)[1] if ' ' in user_input else '')
+                    conf.journal.fsync()
+                    # Also when no answer was kept, which must not send the chat to the current model
+                    active_role = 'user'
+                    bottom_toolbar_session.background_update(chat)
+                    continue
                 elif user_input in commands.speak_last.str_matches:
-                    Speaker(conf).speak(speak_cmd, chat[-1]['content'])
+                    speaker.stop()
+                    sentences = SentenceSegmenter()
+                    for sentence in sentences.feed(chat[-1]['content']) + [sentences.flush()]:
+                        speaker.speak(sentence)
                     continue
 
                 # Check if the user input starts with a model identifier, and if so,
@@ -618,73 +623,80 @@ def converse(conf):
                             user_input = user_input[len(name):].strip()
                         continue
 
-                append_to_chat(conf, chat, active_role, user_input)
-                backup_chat(conf, chat)
+                with span('append user message'):
+                    append_to_chat(conf, chat, active_role, user_input)
+                    conf.journal.fsync()
                 active_role = next_role(chat)
             elif active_role == 'assistant':
-                # Get the content iterator
-                chat, num_tokens = trim_chat(conf, chat)
-                max_retries = 5
-                for try_idx in itertools.count(1):
+                # One turn of --trace and --profile, from sending the chat until the answer is saved
+                with turn('answer', model=conf.model):
+                    # Get the content iterator
+                    exploded_chat, num_tokens, dropped = trim_chat(conf, chat)
+                    if dropped:
+                        action = 'sending a summary of' if conf.args.compact else 'not sending'
+                        pt.print_formatted_text(HTML(HTML_color(
+                            f"Context full: {action} the {len(dropped)} oldest messages "
+                            f"({num_tokens}/{conf.max_tokens - conf.completion_reserve} tokens).", 'yellow')))
+                    def on_retry(try_idx, e, delay):
+                        pt.print_formatted_text(HTML(HTML_color(html.escape(
+                            f"Error. Retrying {try_idx}/{conf.client.max_retries} in {delay:.1f} s: {e}"), 'red')))
+                    conf.client.on_retry = on_retry
+                    stats = {}
+                    start = time.perf_counter()
+                    response = conf.client.stream(
+                        conf.model, [{k: v for k, v in y.items() if k in ['role', 'content']} for y in exploded_chat], stats)
+                    complete_response = []
+                    pt.print_formatted_text(HTML(color_by_role(f'{conf.model}:{prompt_postfix}')), end='', flush=True)
+
+                    # Process the content
+                    segmenter = SentenceSegmenter()
+                    # Render markdown when asked to and printing to a terminal, the raw text otherwise
+                    renderer = None
+                    if conf.args.markdown and get_console().is_terminal:
+                        from gpt_ui.markdown import StreamingMarkdown
+                        print()
+                        renderer = StreamingMarkdown(get_console())
                     try:
-                        exploded_chat = explode_chat(conf, chat)
-                        response = openai.ChatCompletion.create(
-                            model=conf.model,
-                            messages=[{k: v for k, v in y.items() if k in ['role', 'content']} for y in exploded_chat],
-                            stream = True,
-                        )
-                        break
-                    except TryAgain as e:
-                        if try_idx > max_retries:
+                        with span('stream'), renderer if renderer is not None else nullcontext():
+                            for c in response:
+                                if not complete_response:
+                                    mark('first token')
+                                complete_response.append(c)
+                                with span('render'):
+                                    if renderer is None:
+                                        print(c, end='', flush=True)
+                                    else:
+                                        renderer.feed(c)
+                                for sentence in segmenter.feed(c):
+                                    if conf.args.speak:
+                                        speaker.speak(sentence)
+                    except KeyboardInterrupt as e:
+                        response.close()
+                        speaker.stop()
+                    except APIError as e:
+                        pt.print_formatted_text(HTML(HTML_color(html.escape(f"\nError: {e}"), 'red')))
+                        stats['error'] = e
+                        conf.ledger.record('chat', conf.model, num_tokens, conf.token_counter.count_text(''.join(complete_response)),
+                                           time.perf_counter() - start, ttft=stats.get('ttft'), retries=stats.get('retries', 0), error=e)
+                        if len(complete_response) == 0:
                             backup_chat(conf, chat)
-                            raise e
-                        pt.print_formatted_text(HTML(HTML_color(f"Error. Retrying {try_idx}/{max_retries}", 'red')))
-                        if conf.args.debug:
-                            pt.print_formatted_text(HTML(HTML_color(f"Error: {e}", 'red')))
-                        time.sleep(1)
-                complete_response = []
-                pt.print_formatted_text(HTML(color_by_role(f'{conf.model}:{prompt_postfix}')), end='', flush=True)
-
-                # Process the content
-                speaker = Speaker(conf)
-                read_buffer = ''
-                try:
-                    for chunk in response:
-                        c = None
-                        try:
-                            c = chunk.choices[0].delta.content
-                            complete_response.append(c)
-                            read_buffer += c
-                        except AttributeError as e:
-                            pass
-                        except Exception as e:
-                            print("\nAn error occured.")
-                            backup_chat(conf, chat, prompt_name=True)
-                            raise e
-
-                        if c is None:
+                            pt.print_formatted_text(HTML(HTML_color("Enter 'pass' to try again.", 'red')))
+                            active_role = 'user'
                             continue
 
-                        print(c, end='', flush=True)
-
-                        # if speak_subproc is None or speak_subproc.poll() is not None:
-                        first_sentence, read_buffer = get_first_sentence(read_buffer)
-                        if first_sentence != '':
-                            speaker.speak(speak_cmd, first_sentence)
-                except KeyboardInterrupt as e:
-                    speaker.stop()
-
-                # Speak the remaning buffer
-                speaker.speak(speak_cmd, read_buffer)
-                complete_response = ''.join(complete_response)
-                append_to_chat(conf, chat, 'assistant', complete_response)
-                active_role = next_role(chat)
-                print()
+                    # Speak the remaning buffer
+                    if conf.args.speak:
+                        speaker.speak(segmenter.flush())
+                    complete_response = ''.join(complete_response)
+                    with span('append answer'):
+                        append_to_chat(conf, chat, 'assistant', complete_response)
+                        conf.journal.fsync()
+                    if stats.get('error') is None:
+                        conf.ledger.record('chat', conf.model, num_tokens, conf.token_counter.count_text(complete_response),
+                                           time.perf_counter() - start, ttft=stats.get('ttft'), retries=stats.get('retries', 0))
+                    active_role = next_role(chat)
+                    print()
         except KeyboardInterrupt:
             speaker.stop()
 
         bottom_toolbar_session.background_update(chat)
-    
-def debug_notify(conf, msg):
-    if conf.args.debug:
-        os.system(f"notify-send '{msg}'")
\ No newline at end of file
@@ -0,0 +1,103 @@
+import json
+import os
+from pathlib import Path
+from typing import List, Tuple
+
+from gpt_ui.store import is_manifest, read_manifest, write_manifest
+
+# A chat is stored as a json file (a manifest, see gpt_ui.store, or a plain list of messages in older chats)
+# plus an optional journal next to it (same name, .jsonl extension).
+# Each line of the journal is one record:
+#   {"op": "set", "index": i, "message": {...}}   set (or append, if i == len(chat)) message i
+#   {"op": "truncate", "length": n}                 drop all messages from index n on
+# Both are idempotent, so replaying a journal over a json file it was already compacted into is harmless.
+
+
+def journal_path(path) -> Path:
+    return Path(path).with_suffix('.jsonl')
+
+
+def apply_record(chat, record):
+    if record['op'] == 'set':
+        i = record['index']
+        if i < len(chat):
+            chat[i] = record['message']
+        else:
+            chat.append(record['message'])
+    elif record['op'] == 'truncate':
+        del chat[record['length']:]
+
+
+def load_chat(path) -> List[dict]:
+    """Load the chat stored at path (json file and/or journal)."""
+    path = Path(path)
+    chat = []
+    if path.exists():
+        with path.open() as f:
+            chat = json.load(f)
+        if is_manifest(chat):
+            chat = read_manifest(chat, path.parent)
+    if journal_path(path).exists():
+        with journal_path(path).open() as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line can be cut off if we crashed while writing it
+                    break
+                apply_record(chat, record)
+    return chat
+
+
+class ChatJournal:
+    """Persist a chat by appending the changes since the last sync to a journal.
+
+    The journal is compacted into the manifest at `path` (see gpt_ui.store) when the chat is saved or the program exits.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.journal_path = journal_path(path)
+        self._file = None
+        # Shallow copies of the messages as they are on disk
+        self._mirror = []
+
+    def sync(self, chat) -> Tuple[int, List[dict]]:
+        """Write the changes of chat since the last sync to the journal.
+           @return: a touple of (number of unchanged leading messages, changed messages after those)
+        """
+        n_common = 0
+        for old, new in zip(self._mirror, chat):
+            if old != new:
+                break
+            n_common += 1
+        if n_common == len(self._mirror) == len(chat):
+            return n_common, []
+        if self._file is None:
+            self._file = self.journal_path.open('a')
+        records = [{'op': 'set', 'index': i, 'message': chat[i]} for i in range(n_common, len(chat))]
+        if len(chat) < len(self._mirror):
+            records.append({'op': 'truncate', 'length': len(chat)})
+        self._file.write(''.join(json.dumps(r) + '\n' for r in records))
+        self._file.flush()
+        self._mirror[n_common:] = [dict(m) for m in chat[n_common:]]
+        return n_common, chat[n_common:]
+
+    def fsync(self):
+        """Make sure everything written so far survives a crash. Called at the end of each turn."""
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+
+    def compact(self, chat):
+        """Write the whole chat to the manifest file and remove the journal."""
+        if len(chat) == 0 and not self.path.exists() and not self.journal_path.exists():
+            return
+        self.sync(chat)
+        write_manifest(self.path, chat)
+        self.close()
+        if self.journal_path.exists():
+            self.journal_path.unlink()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
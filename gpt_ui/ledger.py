@@ -0,0 +1,118 @@
+import json
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from typing import Iterator, List, Optional
+
+# The ways the entries of the ledger can be grouped by
+stats_keys = ['model', 'day', 'chat', 'kind']
+
+
+class Ledger:
+    """Append-only JSONL record of every API call: tokens, latency, retries and cost.
+
+    kind is what the call was for: 'chat', 'compare', 'batch', 'summary' or 'compaction'.
+    """
+    def __init__(self, path, models_dict):
+        self.path = Path(path)
+        self.models_dict = models_dict
+        # Name of the chat calls are recorded for, unless they name another one
+        self.chat = None
+        # The last entry of each kind, and the totals of this session
+        self.last = {}
+        self.session_cost = 0.0
+        self.session_calls = 0
+        self._lock = Lock()
+
+    def cost(self, model, prompt_tokens, completion_tokens) -> float:
+        metadata = self.models_dict.get(model)
+        if metadata is None:
+            return 0.0
+        return prompt_tokens * metadata['cost_per_input_token'] + completion_tokens * metadata['cost_per_output_token']
+
+    def record(self, kind, model, prompt_tokens, completion_tokens, seconds, ttft=None, retries=0, chat=None,
+               error=None) -> dict:
+        entry = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'kind': kind,
+            'model': model,
+            'chat': chat if chat is not None else self.chat,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'ttft': None if ttft is None else round(ttft, 3),
+            'seconds': round(seconds, 3),
+            'retries': retries,
+            'cost': self.cost(model, prompt_tokens, completion_tokens),
+        }
+        if error is not None:
+            entry['error'] = str(error)
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open('a') as f:
+                f.write(json.dumps(entry) + '\n')
+            self.last[kind] = entry
+            self.session_cost += entry['cost']
+            self.session_calls += 1
+        return entry
+
+    def record_response(self, kind, model, response, start, chat=None) -> dict:
+        """Record a call that returned a complete (not streamed) response, which includes the token usage."""
+        usage = response.get('usage') or {}
+        return self.record(kind, model, usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0),
+                           time.perf_counter() - start, chat=chat)
+
+    def entries(self) -> Iterator[dict]:
+        if not self.path.exists():
+            return
+        with self.path.open() as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def tokens_per_s(entry) -> Optional[float]:
+    if entry.get('ttft') is None or entry['seconds'] <= entry['ttft'] or entry['completion_tokens'] == 0:
+        return None
+    return entry['completion_tokens'] / (entry['seconds'] - entry['ttft'])
+
+
+def aggregate(entries, by='model') -> List[dict]:
+    """Sum up the ledger entries grouped by model, day, chat or kind, sorted by the group."""
+    if by not in stats_keys:
+        raise ValueError(f"Can only group by {', '.join(stats_keys)}")
+    groups = defaultdict(lambda: {'calls': 0, 'errors': 0, 'retries': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                                  'cost': 0.0, 'ttft_sum': 0.0, 'ttft_n': 0})
+    for e in entries:
+        key = e['time'][:10] if by == 'day' else e.get(by) or '-'
+        g = groups[key]
+        g['calls'] += 1
+        g['errors'] += 'error' in e
+        g['retries'] += e.get('retries', 0)
+        g['prompt_tokens'] += e['prompt_tokens']
+        g['completion_tokens'] += e['completion_tokens']
+        g['cost'] += e['cost']
+        if e.get('ttft') is not None:
+            g['ttft_sum'] += e['ttft']
+            g['ttft_n'] += 1
+    rows = []
+    for key, g in sorted(groups.items()):
+        ttft_n = g.pop('ttft_n')
+        ttft_sum = g.pop('ttft_sum')
+        rows.append({by: key, **g, 'mean_ttft': ttft_sum / ttft_n if ttft_n else None})
+    return rows
+
+
+def format_stats(rows, by) -> str:
+    lines = [f"{by:<30} {'calls':>6} {'errors':>6} {'retries':>7} {'prompt':>10} {'completion':>10} {'ttft':>6} {'cost':>9}"]
+    for r in rows:
+        ttft = f"{r['mean_ttft']:.2f}" if r['mean_ttft'] is not None else '-'
+        lines.append(f"{str(r[by])[:30]:<30} {r['calls']:>6} {r['errors']:>6} {r['retries']:>7} {r['prompt_tokens']:>10} "
+                     f"{r['completion_tokens']:>10} {ttft:>6} {r['cost']:>9.4f}")
+    total = sum(r['cost'] for r in rows)
+    lines.append(f"{'total':<30} {sum(r['calls'] for r in rows):>6} {'':>6} {'':>7} "
+                 f"{sum(r['prompt_tokens'] for r in rows):>10} {sum(r['completion_tokens'] for r in rows):>10} {'':>6} {total:>9.4f}")
+    return '\n'.join(lines)
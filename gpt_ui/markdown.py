@@ -0,0 +1,127 @@
+import re
+import time
+from typing import List
+
+from rich.console import Console
+from rich.live import Live
+from rich.markdown import Markdown
+
+# A fence is closed by a line of at least as many of its characters, so a code block can show ``` with ````
+fence = re.compile(r'`{3,}|~{3,}')
+heading = re.compile(r'#{1,6}(\s|$)')
+
+
+class BlockSplitter:
+    """Splits streamed markdown into blocks, as soon as they are finished.
+
+    A block is finished by a blank line (paragraphs, lists), by the line closing a code fence, or, for a
+    heading, by the end of its line. Blank lines inside code fences do not end the block.
+    """
+    def __init__(self):
+        self._lines = []
+        self._partial = ''
+        self._fence = None
+
+    def _take(self) -> str:
+        block = '\n'.join(self._lines)
+        self._lines = []
+        return block
+
+    def feed(self, chunk) -> List[str]:
+        """@return: the blocks finished by chunk"""
+        if '\n' not in chunk:
+            self._partial += chunk
+            return []
+        blocks = []
+        *lines, self._partial = (self._partial + chunk).split('\n')
+        for line in lines:
+            stripped = line.strip()
+            if self._fence is not None:
+                self._lines.append(line)
+                if stripped.startswith(self._fence) and stripped.strip(self._fence[0]) == '':
+                    self._fence = None
+                    blocks.append(self._take())
+            elif (match := fence.match(stripped)):
+                if self._lines:
+                    blocks.append(self._take())
+                self._fence = match.group(0)
+                self._lines.append(line)
+            elif stripped == '':
+                if self._lines:
+                    blocks.append(self._take())
+            elif heading.match(stripped):
+                if self._lines:
+                    blocks.append(self._take())
+                blocks.append(line)
+            else:
+                self._lines.append(line)
+        return blocks
+
+    @property
+    def tail(self) -> str:
+        """The block that is not finished yet."""
+        return '\n'.join(self._lines + [self._partial])
+
+    def flush(self) -> str:
+        tail = self.tail
+        self.__init__()
+        return tail
+
+
+class StreamingMarkdown:
+    """Renders a streamed answer as markdown.
+
+    Finished blocks are printed once. Only the unfinished last block is shown in a rich Live region,
+    and re-rendered at most max_fps times per second, so the cost of a chunk does not grow with the answer.
+    """
+    def __init__(self, console: Console, max_fps=15, code_theme='monokai'):
+        self.console = console
+        self.min_interval = 1 / max_fps
+        self.code_theme = code_theme
+        self.splitter = BlockSplitter()
+        self.live = Live(console=console, auto_refresh=False, transient=True)
+        self._n_blocks = 0
+        self._last_render = 0.0
+
+    def __enter__(self):
+        self.live.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _markdown(self, text) -> Markdown:
+        return Markdown(text, code_theme=self.code_theme)
+
+    def _print_block(self, block):
+        if self._n_blocks > 0:
+            self.console.print()
+        self.console.print(self._markdown(block))
+        self._n_blocks += 1
+
+    def _visible_tail(self) -> str:
+        # Only what fits on the screen, keeping the opening line of a code fence
+        lines = self.splitter.tail.split('\n')
+        height = max(self.console.height - 2, 3)
+        if len(lines) <= height:
+            return '\n'.join(lines)
+        head = lines[:1] if fence.match(lines[0].strip()) else []
+        return '\n'.join(head + lines[-(height - len(head)):])
+
+    def feed(self, chunk):
+        blocks = self.splitter.feed(chunk)
+        for block in blocks:
+            self._print_block(block)
+        now = time.monotonic()
+        if blocks or now - self._last_render >= self.min_interval:
+            self.live.update(self._markdown(self._visible_tail()), refresh=True)
+            self._last_render = now
+
+    def close(self):
+        if not self.live.is_started:
+            return
+        self.live.update('', refresh=True)
+        self.live.stop()
+        tail = self.splitter.flush()
+        if tail.strip():
+            self._print_block(tail)
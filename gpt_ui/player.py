@@ -0,0 +1,247 @@
+import itertools
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from threading import Condition, Thread
+from typing import Optional
+
+
+class ProcessPlayer:
+    """Plays each file with its own mpv process, one after the other. Used when MpvPlayer can not be started."""
+    def __init__(self, speed=1.0, cmd='mpv', args=()):
+        self.speed = speed
+        self.cmd = cmd
+        self.args = list(args)
+        self._queue = []
+        self._process = None
+        self._cv = Condition()
+        self._closed = False
+        self._thread = Thread(target=self._run, name='gpt-ui-player', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, path):
+        with self._cv:
+            self._queue.append(path)
+            self._cv.notify_all()
+
+    def pending(self) -> int:
+        """Number of files queued or playing."""
+        with self._cv:
+            return len(self._queue) + (self._process is not None)
+
+    def wait(self, max_pending=0, timeout=None) -> bool:
+        """Wait until at most max_pending files are queued or playing."""
+        with self._cv:
+            return self._cv.wait_for(lambda: len(self._queue) + (self._process is not None) <= max_pending, timeout)
+
+    def set_speed(self, speed):
+        # Applies from the next file on
+        self.speed = speed
+
+    def skip(self):
+        process = self._process
+        if process is not None:
+            process.kill()
+
+    def stop(self):
+        with self._cv:
+            self._queue.clear()
+        self.skip()
+
+    def close(self):
+        self._closed = True
+        self.stop()
+        with self._cv:
+            self._cv.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cv:
+                self._cv.wait_for(lambda: self._queue or self._closed)
+                if self._closed:
+                    return
+                path = self._queue.pop(0)
+                try:
+                    self._process = subprocess.Popen([self.cmd, "--really-quiet", "--no-video", f"--speed={self.speed}", *self.args, path],
+                                                     stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+                except OSError:
+                    self._cv.notify_all()
+                    continue
+            self._process.wait()
+            with self._cv:
+                self._process = None
+                self._cv.notify_all()
+
+
+class MpvPlayer:
+    """One long-lived, idle mpv process, controlled through its JSON IPC socket.
+
+    Files are appended to the playlist of mpv, so the next sentence starts without starting a process or opening
+    the audio device again. Pass spawn=False to connect to an mpv that is already listening on socket_path.
+    """
+    def __init__(self, speed=1.0, cmd='mpv', args=(), socket_path=None, spawn=True, connect_timeout=5):
+        self.speed = speed
+        self._tmp_dir = None
+        if socket_path is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix='gpt-ui-mpv-')
+            socket_path = os.path.join(self._tmp_dir, 'socket')
+        self.socket_path = str(socket_path)
+        self._process = None
+        if spawn:
+            self._process = subprocess.Popen(
+                [cmd, '--idle=yes', '--no-video', '--really-quiet', '--no-terminal', f'--speed={speed}',
+                 f'--input-ipc-server={self.socket_path}', *args],
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self._socket = self._connect(connect_timeout)
+        self._request_ids = itertools.count(1)
+        self._responses = {}
+        # Playlist entries that were added and did not end yet, and those that ended before loadfile returned. mpv
+        # numbers the entries in order, so an entry up to the last one added that is not playing ended already.
+        self._playing = set()
+        self._ended = set()
+        self._last_entry_id = 0
+        # mpv before 0.33 does not number the entries, then only the number of entries that did not end is known
+        self._unnumbered = 0
+        self._cv = Condition()
+        self._closed = False
+        self._reader = Thread(target=self._read, name='gpt-ui-mpv-ipc', daemon=True)
+        self._reader.start()
+
+    def _connect(self, timeout) -> socket.socket:
+        deadline = time.monotonic() + timeout
+        while True:
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                s.connect(self.socket_path)
+                return s
+            except OSError:
+                s.close()
+                if time.monotonic() > deadline or (self._process is not None and self._process.poll() is not None):
+                    self._kill()
+                    raise
+                time.sleep(0.01)
+
+    def _read(self):
+        buffer = b''
+        while True:
+            try:
+                data = self._socket.recv(65536)
+            except OSError:
+                data = b''
+            if data == b'':
+                with self._cv:
+                    self._closed = True
+                    self._playing.clear()
+                    self._unnumbered = 0
+                    self._cv.notify_all()
+                return
+            *lines, buffer = (buffer + data).split(b'\n')
+            with self._cv:
+                for line in lines:
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        continue
+                    if 'request_id' in message:
+                        self._responses[message['request_id']] = message
+                    elif message.get('event') == 'end-file':
+                        entry_id = message.get('playlist_entry_id')
+                        if entry_id is None:
+                            self._unnumbered = max(0, self._unnumbered - 1)
+                        elif entry_id in self._playing:
+                            self._playing.discard(entry_id)
+                        elif entry_id > self._last_entry_id:
+                            self._ended.add(entry_id)
+                self._cv.notify_all()
+
+    def command(self, *args, timeout=5) -> Optional[dict]:
+        """Send a command to mpv and return its response."""
+        request_id = next(self._request_ids)
+        data = json.dumps({'command': list(args), 'request_id': request_id}).encode() + b'\n'
+        with self._cv:
+            if self._closed:
+                raise ConnectionError('mpv is not running')
+            self._socket.sendall(data)
+            if not self._cv.wait_for(lambda: request_id in self._responses or self._closed, timeout):
+                raise TimeoutError(f'mpv did not answer {args[0]}')
+            response = self._responses.pop(request_id, None)
+        if response is None:
+            raise ConnectionError('mpv is not running')
+        if response.get('error') != 'success':
+            raise RuntimeError(f"mpv {args[0]}: {response.get('error')}")
+        return response.get('data')
+
+    def enqueue(self, path):
+        data = self.command('loadfile', str(Path(path)), 'append-play')
+        entry_id = (data or {}).get('playlist_entry_id')
+        with self._cv:
+            if entry_id is None:
+                self._unnumbered += 1
+                return
+            self._last_entry_id = max(self._last_entry_id, entry_id)
+            if entry_id in self._ended:
+                self._ended.discard(entry_id)
+            else:
+                self._playing.add(entry_id)
+            self._ended = {e for e in self._ended if e > self._last_entry_id}
+
+    def _pending(self) -> int:
+        return len(self._playing) + self._unnumbered
+
+    def pending(self) -> int:
+        with self._cv:
+            return self._pending()
+
+    def wait(self, max_pending=0, timeout=None) -> bool:
+        with self._cv:
+            return self._cv.wait_for(lambda: self._pending() <= max_pending, timeout)
+
+    def set_speed(self, speed):
+        self.speed = speed
+        self.command('set_property', 'speed', speed)
+
+    def skip(self):
+        with self._cv:
+            if self._pending() == 0:
+                return
+        self.command('playlist-next', 'force')
+
+    def stop(self):
+        self.command('stop')
+        with self._cv:
+            self._playing.clear()
+            self._ended.clear()
+            self._unnumbered = 0
+            self._cv.notify_all()
+
+    def _kill(self):
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def close(self):
+        try:
+            if not self._closed:
+                self.command('quit', timeout=1)
+        except (OSError, RuntimeError):
+            pass
+        self._socket.close()
+        self._kill()
+
+
+def make_player(speed=1.0, cmd='mpv'):
+    """Return an MpvPlayer, or a ProcessPlayer if mpv can not be controlled over IPC."""
+    try:
+        return MpvPlayer(speed=speed, cmd=cmd)
+    except OSError:
+        return ProcessPlayer(speed=speed, cmd=cmd)
@@ -0,0 +1,173 @@
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Tuple
+
+from gpt_ui.search import fts_query
+
+
+def chunk_text(text, chunk_words=200) -> List[str]:
+    """Split a text into chunks of about chunk_words words, preferably at paragraph boundaries."""
+    chunks = []
+    current = []
+    n_words = 0
+    for paragraph in re.split(r'\n\s*\n', text):
+        words = paragraph.split()
+        if len(words) == 0:
+            continue
+        if n_words + len(words) > chunk_words and current:
+            chunks.append('\n\n'.join(current))
+            current, n_words = [], 0
+        while len(words) > chunk_words:
+            chunks.append(' '.join(words[:chunk_words]))
+            words = words[chunk_words:]
+            paragraph = ' '.join(words)
+        if words:
+            current.append(paragraph.strip())
+            n_words += len(words)
+    if current:
+        chunks.append('\n\n'.join(current))
+    return chunks
+
+
+class ChunkIndex:
+    """BM25 index (sqlite fts5) over chunks of local files, for inserting only the relevant parts of large files.
+
+    Files are chunked and indexed when they are first queried, and again when their mtime or size changed.
+    """
+    def __init__(self, db_path, vault_index=None, min_refresh_interval=30):
+        self.db_path = Path(db_path)
+        self.vault_index = vault_index
+        self.min_refresh_interval = min_refresh_interval
+        self._db = None
+        self._lock = Lock()
+        self._last_vault_refresh = 0
+        # Query results, valid until the index changes
+        self._memo = {}
+
+    @property
+    def db(self):
+        if self._db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.executescript('''
+                CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, path TEXT, idx INTEGER, text TEXT);
+                CREATE INDEX IF NOT EXISTS chunks_path ON chunks (path);
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(text, content='chunks', content_rowid='id');
+                CREATE TRIGGER IF NOT EXISTS chunks_insert AFTER INSERT ON chunks BEGIN
+                    INSERT INTO chunks_fts(rowid, text) VALUES (new.id, new.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS chunks_delete AFTER DELETE ON chunks BEGIN
+                    INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                END;
+                CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER);
+            ''')
+            self._db = db
+        return self._db
+
+    def _index_files(self, paths) -> bool:
+        """(Re)index the files that changed. Has to be called with the lock held.
+           @return: whether anything changed
+        """
+        paths = [str(p) for p in paths]
+        known = {}
+        for i in range(0, len(paths), 500):
+            batch = paths[i:i + 500]
+            known.update({p: (m, s) for p, m, s in self.db.execute(
+                f"SELECT path, mtime_ns, size FROM files WHERE path IN ({','.join('?' * len(batch))})", batch)})
+        changed = False
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                continue
+            try:
+                with open(path) as f:
+                    chunks = chunk_text(f.read())
+            except (OSError, UnicodeDecodeError):
+                chunks = []
+            self.db.execute('DELETE FROM chunks WHERE path = ?', (path,))
+            self.db.executemany('INSERT INTO chunks (path, idx, text) VALUES (?, ?, ?)',
+                                [(path, i, c) for i, c in enumerate(chunks)])
+            self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?)', (path, stat.st_mtime_ns, stat.st_size))
+            changed = True
+        if changed:
+            self.db.commit()
+            self._memo.clear()
+        return changed
+
+    def refresh_vault(self):
+        if self.vault_index is None or time.monotonic() - self._last_vault_refresh < self.min_refresh_interval:
+            return
+        paths = self.vault_index.paths()
+        with self._lock:
+            self._index_files(paths)
+            vault_dir = str(self.vault_index.vault_dir) + os.sep
+            indexed = [p for p, in self.db.execute('SELECT path FROM files WHERE path LIKE ?', (vault_dir + '%',))]
+            deleted = set(indexed) - {str(p) for p in paths}
+            for path in deleted:
+                self.db.execute('DELETE FROM chunks WHERE path = ?', (path,))
+                self.db.execute('DELETE FROM files WHERE path = ?', (path,))
+            if deleted:
+                self.db.commit()
+                self._memo.clear()
+            self._last_vault_refresh = time.monotonic()
+
+    def query(self, query, paths=None, limit=8) -> List[Tuple[str, int, str]]:
+        """Return the chunks most relevant to query, as (path, index of the chunk in the file, text).
+           @param paths: only search these files, instead of the whole vault
+        """
+        # Any of the words may match, bm25 ranks chunks that match more and rarer words higher
+        match = ' OR '.join(fts_query(query).split(' '))
+        if match == '':
+            return []
+        if paths is None:
+            self.refresh_vault()
+        key = (match, None if paths is None else tuple(str(p) for p in paths), limit)
+        with self._lock:
+            if paths is not None:
+                self._index_files(paths)
+            if key in self._memo:
+                return self._memo[key]
+            sql = '''
+                SELECT c.path, c.idx, c.text FROM chunks_fts JOIN chunks c ON c.id = chunks_fts.rowid
+                WHERE chunks_fts MATCH ?'''
+            params = [match]
+            if paths is not None:
+                sql += f" AND c.path IN ({','.join('?' * len(paths))})"
+                params += [str(p) for p in paths]
+            sql += ' ORDER BY bm25(chunks_fts) LIMIT ?'
+            result = self.db.execute(sql, params + [limit]).fetchall()
+            if len(self._memo) > 1000:
+                self._memo.clear()
+            self._memo[key] = result
+            return result
+
+    def retrieve(self, query, token_counter, token_budget, paths=None, top_k=8) -> Dict[str, List[str]]:
+        """Return the most relevant chunks that fit into token_budget, grouped by file in document order."""
+        selected = []
+        n_tokens = 0
+        for path, idx, text in self.query(query, paths=paths, limit=top_k):
+            n = token_counter.count_text(text)
+            if n_tokens + n > token_budget:
+                continue
+            selected.append((path, idx, text))
+            n_tokens += n
+        by_file = {}
+        for path, idx, text in sorted(selected):
+            by_file.setdefault(path, []).append(text)
+        return by_file
+
+
+def retrieval_embedding(by_file, query, path=None) -> str:
+    if len(by_file) == 0:
+        return f"\n(No passages relevant to '{query}' were found in {path if path else 'the notes'}.)\n"
+    return ''.join(f"\n{p} (relevant excerpts)>>>\n" + '\n[...]\n'.join(texts) + f"\n<<<{p}\n"
+                   for p, texts in by_file.items())
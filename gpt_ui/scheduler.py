@@ -0,0 +1,147 @@
+import heapq
+import itertools
+import time
+from threading import Condition, Event, Thread
+from typing import Callable, Dict, Optional
+
+from gpt_ui.trace import span
+
+
+class Job:
+    def __init__(self, key, fn, args, priority, on_done):
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.priority = priority
+        self.on_done = on_done
+        self.cancelled = Event()
+        self.done = Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class JobStats:
+    def __init__(self):
+        self.runs = 0
+        self.superseded = 0
+        self.failed = 0
+        self.total_s = 0.0
+        self.last_s = 0.0
+        self.max_s = 0.0
+
+    def __str__(self):
+        mean = self.total_s / self.runs if self.runs else 0
+        return (f"{self.runs} runs, {self.superseded} superseded, {self.failed} failed, "
+                f"last {self.last_s * 1000:.1f} ms, mean {mean * 1000:.1f} ms, max {self.max_s * 1000:.1f} ms")
+
+
+class Lane:
+    def __init__(self):
+        self.heap = []
+        self.running: Optional[Job] = None
+        self.worker = None
+
+
+class Scheduler:
+    """Runs background jobs one at a time per lane, each lane on its own persistent worker thread.
+
+    Jobs are identified by a key. Submitting a job replaces the pending job with the same key (the latest wins),
+    and cancels it if it is already running: its result is then not passed to on_done. Jobs with a lower
+    priority number run first. A running job can not be interrupted, so slow jobs (network calls, cold indexes)
+    are submitted to the 'slow' lane, such that the quick jobs of the default lane never wait for them. A key
+    always has to be submitted to the same lane.
+    """
+    def __init__(self, name='gpt-ui-scheduler'):
+        self.name = name
+        self._lanes: Dict[str, Lane] = {}
+        self._pending: Dict[str, Job] = {}
+        self._seq = itertools.count()
+        self._cv = Condition()
+        self._stopped = False
+        self.stats: Dict[str, JobStats] = {}
+
+    def submit(self, key, fn: Callable, *args, priority=0, lane='fast', on_done: Optional[Callable] = None) -> Job:
+        job = Job(key, fn, args, priority, on_done)
+        with self._cv:
+            stats = self.stats.setdefault(key, JobStats())
+            for old in [self._pending.get(key)] + [l.running for l in self._lanes.values()]:
+                if old is not None and old.key == key and not old.cancelled.is_set():
+                    old.cancel()
+                    stats.superseded += 1
+            self._pending[key] = job
+            if lane not in self._lanes:
+                self._lanes[lane] = Lane()
+            heapq.heappush(self._lanes[lane].heap, (priority, next(self._seq), job))
+            if self._lanes[lane].worker is None:
+                self._lanes[lane].worker = Thread(target=self._run, args=(self._lanes[lane],),
+                                                  name=f"{self.name}-{lane}", daemon=True)
+                self._lanes[lane].worker.start()
+            self._cv.notify_all()
+        return job
+
+    def cancel(self, key):
+        with self._cv:
+            for job in [self._pending.pop(key, None)] + [l.running for l in self._lanes.values()]:
+                if job is not None and job.key == key:
+                    job.cancel()
+
+    def _next_job(self, lane) -> Optional[Job]:
+        with self._cv:
+            while True:
+                while lane.heap:
+                    _, _, job = heapq.heappop(lane.heap)
+                    if self._pending.get(job.key) is job:
+                        del self._pending[job.key]
+                    if job.cancelled.is_set():
+                        job.done.set()
+                        continue
+                    lane.running = job
+                    return job
+                lane.running = None
+                self._cv.notify_all()
+                if self._stopped:
+                    return None
+                self._cv.wait()
+
+    def _run(self, lane):
+        while (job := self._next_job(lane)) is not None:
+            stats = self.stats[job.key]
+            start = time.perf_counter()
+            try:
+                with span(job.key):
+                    result = job.fn(*job.args)
+                    if job.on_done is not None and not job.cancelled.is_set():
+                        job.on_done(result)
+            except Exception as e:
+                stats.failed += 1
+                print(f"Error in background job {job.key}: {e}")
+            seconds = time.perf_counter() - start
+            stats.runs += 1
+            stats.total_s += seconds
+            stats.last_s = seconds
+            stats.max_s = max(stats.max_s, seconds)
+            job.done.set()
+
+    def _busy(self) -> bool:
+        return any(lane.heap or lane.running is not None for lane in self._lanes.values())
+
+    def wait_idle(self, timeout=None) -> bool:
+        """Wait until all submitted jobs ran.
+           @return: whether the scheduler is idle
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cv:
+            while self._busy():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cv.wait(remaining)
+        return True
+
+    def shutdown(self):
+        with self._cv:
+            self._stopped = True
+            for job in self._pending.values():
+                job.cancel()
+            self._cv.notify_all()
@@ -0,0 +1,128 @@
+import re
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from typing import List, Tuple
+
+from gpt_ui.catalog import chat_files, chat_stat
+from gpt_ui.journal import load_chat
+
+filter_keys = ['role', 'model', 'since', 'until', 'chat']
+
+
+def parse_query(query) -> Tuple[str, dict]:
+    """Split filters like role:user, model:gpt-4, since:2024-01, until:2024-02-15 or chat:NAME from the search terms."""
+    filters = {}
+    terms = []
+    for word in query.split():
+        key, _, value = word.partition(':')
+        if key in filter_keys and value:
+            filters[key] = value
+        else:
+            terms.append(word)
+    return ' '.join(terms), filters
+
+
+def fts_query(terms) -> str:
+    # Quote every word, such that characters like - or : are not interpreted as fts5 syntax
+    return ' '.join('"' + w.replace('"', '""') + '"' for w in re.findall(r'\w+', terms))
+
+
+class SearchIndex:
+    """Full text index (sqlite fts5) over the messages of all chats in chat_dir."""
+    def __init__(self, chat_dir, db_name='.search.sqlite'):
+        self.chat_dir = Path(chat_dir)
+        self.db_path = self.chat_dir / db_name
+        self._db = None
+        self._lock = Lock()
+
+    @property
+    def db(self):
+        if self._db is None:
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            # The index can always be rebuilt from the chats, so we don't need to sync on every commit
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.executescript('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY, chat TEXT, idx INTEGER, role TEXT, model TEXT, date TEXT, content TEXT);
+                CREATE INDEX IF NOT EXISTS messages_chat ON messages (chat, idx);
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, content='messages', content_rowid='id');
+                CREATE TRIGGER IF NOT EXISTS messages_insert AFTER INSERT ON messages BEGIN
+                    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+                END;
+                CREATE TRIGGER IF NOT EXISTS messages_delete AFTER DELETE ON messages BEGIN
+                    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                END;
+                CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER);
+            ''')
+            self._db = db
+        return self._db
+
+    def _update(self, name, start, messages, stat):
+        self.db.execute('DELETE FROM messages WHERE chat = ? AND idx >= ?', (name, start))
+        self.db.executemany(
+            'INSERT INTO messages (chat, idx, role, model, date, content) VALUES (?, ?, ?, ?, ?, ?)',
+            [(name, start + i, m['role'], m.get('model', ''), m.get('date', ''), m['content']) for i, m in enumerate(messages)])
+        self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?)', (name, *stat))
+
+    def update(self, name, start, messages):
+        """Replace the messages from index start on of the chat with the json file `name`.
+           Called whenever a chat is written, with the changes that were written.
+        """
+        with self._lock:
+            self._update(name, start, messages, chat_stat(self.chat_dir / name))
+            self.db.commit()
+
+    def refresh(self):
+        """Index the chats that changed on disk without going through update."""
+        with self._lock:
+            files = chat_files(self.chat_dir)
+            known = {name: (mtime_ns, size) for name, mtime_ns, size in self.db.execute('SELECT name, mtime_ns, size FROM files')}
+            for name, stat in files.items():
+                if known.get(name) != stat:
+                    try:
+                        chat = load_chat(self.chat_dir / name)
+                    except Exception:
+                        chat = []
+                    self._update(name, 0, chat, stat)
+            for name in known:
+                if name not in files:
+                    self.db.execute('DELETE FROM messages WHERE chat = ?', (name,))
+                    self.db.execute('DELETE FROM files WHERE name = ?', (name,))
+            self.db.commit()
+
+    def search(self, query, hide_backups=True, limit=20) -> List[tuple]:
+        """Search all chats, best matches first.
+           @return: list of (chat, message index, role, model, date, snippet)
+        """
+        terms, filters = parse_query(query)
+        sql = '''
+            SELECT m.chat, m.idx, m.role, m.model, m.date, snippet(messages_fts, 0, '[', ']', '...', 16)
+            FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+            WHERE messages_fts MATCH ?'''
+        params = [fts_query(terms)]
+        if params[0] == '':
+            return []
+        if hide_backups:
+            sql += " AND m.chat NOT LIKE '.%'"
+        if 'role' in filters:
+            sql += ' AND m.role = ?'
+            params.append(filters['role'])
+        if 'model' in filters:
+            sql += ' AND m.model = ?'
+            params.append(filters['model'])
+        if 'chat' in filters:
+            sql += ' AND m.chat LIKE ?'
+            params.append(filters['chat'] + '%')
+        if 'since' in filters:
+            sql += ' AND m.date >= ?'
+            params.append(filters['since'])
+        if 'until' in filters:
+            sql += ' AND substr(m.date, 1, ?) <= ?'
+            params += [len(filters['until']), filters['until']]
+        sql += ' ORDER BY bm25(messages_fts) LIMIT ?'
+        params.append(limit)
+        self.refresh()
+        with self._lock:
+            return self.db.execute(sql, params).fetchall()
@@ -0,0 +1,109 @@
+from typing import List
+
+
+class SentenceSegmenter:
+    """Splits streamed text into sentences as soon as they are complete.
+
+    Text is fed in chunks of any size, and every character is looked at once. A sentence ends at a newline, or
+    at one of .?!: followed by whitespace (closing quotes and brackets stay with the sentence). CJK sentence
+    endings need no whitespace after them. A period after an abbreviation, an initial or a list number does not
+    end a sentence. A fenced code block is returned as one piece, from its opening to its closing fence line.
+    Joining all returned pieces and the flushed rest gives back the fed text.
+    """
+    end_chars = frozenset('.?!:…')
+    cjk_end_chars = frozenset('。？！')
+    closing_chars = frozenset('"\')]’”」』）')
+    abbreviations = frozenset(['mr', 'mrs', 'ms', 'dr', 'prof', 'st', 'vs', 'etc', 'no', 'fig', 'cf', 'approx',
+                               'jr', 'sr', 'inc', 'ltd', 'co', 'dept', 'est', 'min', 'max', 'vol', 'bzw', 'usw',
+                               'ca'])
+    # Words longer than this are no abbreviation, so only their beginning is kept
+    max_word = 8
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        # The pieces of the current sentence from earlier chunks
+        self._pending = []
+        self._end_pending = False
+        self._cjk_end = False
+        self._word = ''
+        self._words_in_sentence = 0
+        self._in_fence = False
+        # State of the current line: still only indentation and backticks, and whether it opened or closed a fence
+        self._line_prefix = True
+        self._ticks = 0
+        self._fence_line = False
+
+    def _is_abbreviation(self) -> bool:
+        word = self._word.lower()
+        if '.' in word or len(word) == 1 and word.isalpha():
+            return True
+        if word.isdigit() and self._words_in_sentence == 0:
+            return True
+        return word in self.abbreviations
+
+    def _cut(self, chunk, start, end) -> str:
+        sentence = ''.join(self._pending) + chunk[start:end]
+        self._pending = []
+        self._words_in_sentence = 0
+        return sentence
+
+    def feed(self, chunk) -> List[str]:
+        """@return: the sentences completed by chunk"""
+        sentences = []
+        start = 0
+        for i, c in enumerate(chunk):
+            if self._end_pending and c not in self.closing_chars and c not in self.end_chars:
+                self._end_pending = False
+                # A newline ends the sentence below, together with the newline
+                if c != '\n' and (c.isspace() or self._cjk_end):
+                    sentences.append(self._cut(chunk, start, i))
+                    start = i
+
+            if c == '\n':
+                # Inside a code block, including the line that opened it, newlines end nothing
+                if not self._in_fence:
+                    sentences.append(self._cut(chunk, start, i + 1))
+                    start = i + 1
+                self._line_prefix, self._ticks, self._fence_line = True, 0, False
+                self._word = ''
+                continue
+
+            if self._line_prefix:
+                if c == '`':
+                    self._ticks += 1
+                    if self._ticks == 3:
+                        self._in_fence = not self._in_fence
+                        self._fence_line = True
+                        self._end_pending = False
+                    continue
+                if not (c == ' ' or c == '\t'):
+                    self._line_prefix = False
+            if self._in_fence or self._fence_line:
+                continue
+
+            if c.isspace():
+                if self._word:
+                    self._words_in_sentence += 1
+                    self._word = ''
+            elif c in self.end_chars:
+                if not (c == '.' and self._is_abbreviation()):
+                    self._end_pending = True
+                    self._cjk_end = False
+                if c == '.' and len(self._word) < self.max_word:
+                    self._word += c
+            elif c in self.cjk_end_chars:
+                self._end_pending = True
+                self._cjk_end = True
+            elif len(self._word) < self.max_word:
+                self._word += c
+        if start < len(chunk):
+            self._pending.append(chunk[start:])
+        return sentences
+
+    def flush(self) -> str:
+        """Return the rest of the text, which did not form a complete sentence yet, and start over."""
+        rest = ''.join(self._pending)
+        self._reset()
+        return rest
@@ -1,19 +1,27 @@
 #!/usr/bin/env python
 
 from pathlib import Path
+import os
+import shutil
 import tempfile
 
-from xdg_base_dirs import xdg_config_home
-import openai
+from xdg_base_dirs import xdg_cache_home, xdg_config_home, xdg_data_home
 import yaml
 import argparse
-import tiktoken
 
-from gpt_ui.util import timestamp
-from gpt_ui.gpt_ui import converse
+from gpt_ui.util import lazy_property, timestamp
+from gpt_ui.journal import ChatJournal
+from gpt_ui.catalog import ChatCatalog
+from gpt_ui.search import SearchIndex
+from gpt_ui.ledger import Ledger, stats_keys
+from gpt_ui import trace
+
+# Everything that takes long to import or set up (openai, tiktoken, aiohttp, prompt_toolkit, the tokenizer, the
+# vault index) is only imported or created when first needed, such that commands like --list-chats and --help
+# start fast. When a chat starts, warm_up loads it in the background while the user types.
 
 class Conf:
-    def __init__(self):
+    def __init__(self, argv=None):
         self.project_dir = Path(__file__).parent.absolute()
 
         self.config_dir = xdg_config_home() / 'gpt-ui'
@@ -24,14 +32,22 @@ class Conf:
         # Load local config file and overwrite default config
         if self.config_file_local.exists():
             self.config.update(yaml.load(self.config_file_local.open(), yaml.FullLoader))
-        openai.api_key = yaml.load((self.config_dir / 'api_key.yaml').open(), yaml.FullLoader).get('api_key')
+        self.api_key = yaml.load((self.config_dir / 'api_key.yaml').open(), yaml.FullLoader).get('api_key')
+        if self.api_key:
+            # openai reads it when it is imported
+            os.environ['OPENAI_API_KEY'] = self.api_key
 
         # Loading config
         self.model = self.config['default_model']
         self.user = self.config['user']
         self.models_dict = yaml.load((self.project_dir / 'models_metadata.yaml').open(), yaml.FullLoader)
         self.max_tokens = self.models_dict[self.model]['max_tokens']
+        # Tokens of the context window that are kept free for the completion
+        self.completion_reserve = self.models_dict[self.model].get('completion_reserve', 0)
         self.speak_default = self.config['speak']
+        self.compact_default = self.config.get('compact', False)
+        # Tokens of the context window reserved for the summary of compacted messages
+        self.summary_reserve = self.config.get('summary_reserve', 512)
 
         # Setting up paths 2/2
         if self.config["chat_dir"] is not None:
@@ -49,27 +65,32 @@ class Conf:
 
 
         self.chat_backup_file = chat_dir / f".backup_{timestamp()}.json"
-
-        prompt_history_dir =  Path(tempfile.mkdtemp())
-        self.prompt_history_dir = prompt_history_dir
+        self.journal = ChatJournal(self.chat_backup_file)
+        self.catalog = ChatCatalog(chat_dir)
+        self.search_index = SearchIndex(chat_dir)
 
         self.prompt_dir = self.project_dir / 'prompts'
 
-        voice_precache_dir = Path(tempfile.mkdtemp())
-        self.voice_precache_dir = voice_precache_dir
+        # Synthesized speech, kept across sessions such that repeated texts are not synthesized again
+        self.voice_precache_dir = xdg_cache_home() / 'gpt-ui' / 'voice'
 
-        obsidian_vault_dir = Path(self.config['obsidian_vault_dir']).expanduser()
-        if not obsidian_vault_dir.exists():
-            raise FileNotFoundError(f"Obsidian vault directory {obsidian_vault_dir} does not exist.")
-        self.obsidian_vault_dir = obsidian_vault_dir
+        # Checked by warm_up, as a missing vault only matters when a note is linked
+        self.obsidian_vault_dir = Path(self.config['obsidian_vault_dir']).expanduser()
+        self.retrieve_default = self.config.get('retrieve', False)
+        self.markdown_default = self.config.get('markdown', False)
+        self.retrieve_token_budget = self.config.get('retrieve_token_budget', 2000)
+        self.retrieve_top_k = self.config.get('retrieve_top_k', 8)
 
-        try:
-            self.enc = tiktoken.encoding_for_model(self.model)
-        except KeyError as e:
-            print(f"WARNING: Could not determine encoder for {self.model}. Falling back to gpt-4 encoder.")
-            self.enc = tiktoken.encoding_for_model('gpt-4')
+        self.ledger = Ledger(xdg_data_home() / 'gpt-ui' / 'ledger.jsonl', self.models_dict)
+        self.ledger.chat = self.chat_backup_file.name
+        # Set by main when a daemon is running, see gpt_ui/daemon.py
+        self.daemon_socket = None
+
+        self.args = self.parse_args(argv)
 
+        self.assistant_name = 'assistant'
 
+    def parse_args(self, argv=None):
         # Parsing Arguments
         parser = argparse.ArgumentParser(description=
             "Press CTRL+C to stop generating the message. "
@@ -81,37 +102,151 @@ class Conf:
             "\n\n"
             "You can use :file:FILENAME: to show the contents of FILENAME to GPT, while in the UI the text will "
             "not be expanded. Similarly you can use :obsidian:FILENAME: in order to search the obsidian vault "
-            "(needs to be configured in config.yaml) for the file FILENAME and show the contents to GPT.")
+            "(needs to be configured in config.yaml) for the file FILENAME and show the contents to GPT. "
+            ":obsidian?:QUERY: shows GPT only the passages of the vault most relevant to QUERY.")
         parser.add_argument('--chat-name', type=str, help='Name of the chat')
         parser.add_argument('--load-chat', type=str, help='Name of the chat to load')
         parser.add_argument('--load-last-chat', action='store_true', help='Name of the chat to load')
         parser.add_argument('--list-chats', action='store_true', help='List all chats')
         parser.add_argument('--list-all-chats', action='store_true', help='List all chats including hidden backup chats')
+        parser.add_argument('--search', type=str, metavar='QUERY', help='Search all named chats. QUERY can contain the filters role:ROLE, model:MODEL, since:DATE, until:DATE and chat:NAME.')
+        parser.add_argument('--search-all', type=str, metavar='QUERY', help='Like --search, but also search hidden backup chats')
+        parser.add_argument('--gc', action='store_true', help='Delete old backup chats (see keep_backups and keep_backups_days in config.yaml) and stored messages no chat refers to anymore.')
         parser.add_argument('--list-models', action='store_true', help='List all models')
         parser.add_argument('--list-models-full', action='store_true', help='List all models and their details')
         parser.add_argument('--speak', default=self.speak_default, action='store_true', help='Speak the messages.')
+        parser.add_argument('--compact', default=self.compact_default, action='store_true', help='When the chat does not fit into the context window anymore, replace the oldest messages with a summary instead of dropping them.')
+        parser.add_argument('--retrieve', default=self.retrieve_default, action='store_true', help='Instead of the whole file, show GPT only the passages of :file: and :obsidian: links most relevant to the message.')
+        parser.add_argument('--markdown', default=self.markdown_default, action='store_true', help='Render the answers as markdown while they stream in.')
         parser.add_argument('-p', '--personality', default='default', type=str, choices=[x.stem for x in self.prompt_dir.iterdir()], help='Set the system prompt based on predefined file.')
         parser.add_argument('--config', action='store_true', help='Open the config file.')
         parser.add_argument('--debug', action='store_true', help='Run with debug settings. Includes notifications.')
         parser.add_argument('--export-chats-to-markdown', action='store_true', help='Re export all named chats as markdown files into the chat directory.')
+        parser.add_argument('--stats', type=str, nargs='?', const='model', choices=stats_keys, help='Show the tokens, latency and cost of all API calls so far, grouped by model (default), day, chat or kind.')
+        parser.add_argument('--batch', type=str, nargs=2, metavar=('IN', 'OUT'), help='Answer each request in the JSONL file IN (with "prompt" or "messages", and optionally "id", "system" and "model") and append the results to the JSONL file OUT. Requests already answered in OUT are skipped, failed ones are tried again.')
+        parser.add_argument('--daemon', action='store_true', help='Keep running and answer the commands of later gpt-ui calls, with the tokenizer, indexes and API connections kept warm. Later calls use it when it runs, and run by themselves otherwise. A chat still starts in its own process, only its API calls go through the daemon.')
+        parser.add_argument('--stop-daemon', action='store_true', help='Stop the running daemon.')
+        parser.add_argument('--no-daemon', action='store_true', help='Do not use the daemon, even if it runs.')
+        parser.add_argument('--trace', type=str, metavar='FILE', help='Record where the time of the chat goes (file expansion, tokenization, the API, speech, backups, background jobs) and write it to FILE as Chrome trace events, for chrome://tracing or https://ui.perfetto.dev.')
+        parser.add_argument('--profile', type=str, nargs='?', metavar='DIR', const=str(xdg_cache_home() / 'gpt-ui' / 'profiles' / timestamp()), help='Profile each answer of the assistant with cProfile, and write one file per answer into DIR (by default a new directory in the cache), for python -m pstats or snakeviz.')
         parser.add_argument('user_input',  type=str, nargs='*', help='Initial input the user gives to the chat bot.')
-        args = parser.parse_args()
+        args = parser.parse_args(argv)
         if args.user_input == []:
             args.user_input = None
         else:
             args.user_input = " ".join(args.user_input)
             if args.user_input == "":
                 args.user_input = None
+        return args
 
-        self.args = args
+    @lazy_property
+    def prompt_history_dir(self):
+        return Path(tempfile.mkdtemp())
 
-        self.assistant_name = 'assistant'
+    @lazy_property
+    def enc(self):
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(self.model)
+        except KeyError as e:
+            print(f"WARNING: Could not determine encoder for {self.model}. Falling back to gpt-4 encoder.")
+            return tiktoken.encoding_for_model('gpt-4')
+
+    @lazy_property
+    def token_counter(self):
+        from gpt_ui.tokens import TokenCounter
+        return TokenCounter(self.enc)
+
+    @lazy_property
+    def file_expander(self):
+        from gpt_ui.expand import FileExpander
+        return FileExpander(self.enc, self.config.get('file_token_cap', self.max_tokens // 4))
+
+    @lazy_property
+    def vault_index(self):
+        from gpt_ui.vault import VaultIndex
+        return VaultIndex(self.obsidian_vault_dir, xdg_cache_home() / 'gpt-ui' / 'vault_index.json')
+
+    @lazy_property
+    def chunk_index(self):
+        from gpt_ui.retrieval import ChunkIndex
+        return ChunkIndex(xdg_cache_home() / 'gpt-ui' / 'retrieval.sqlite', self.vault_index)
+
+    @lazy_property
+    def scheduler(self):
+        from gpt_ui.scheduler import Scheduler
+        return Scheduler()
+
+    @lazy_property
+    def client(self):
+        from gpt_ui.client import ChatClient, DaemonChatClient
+        kwargs = dict(
+            base_url=self.config.get('api_base', 'https://api.openai.com/v1'),
+            max_retries=self.config.get('max_retries', 5),
+            connect_timeout=self.config.get('connect_timeout', 10),
+            first_token_timeout=self.config.get('first_token_timeout', 60))
+        if self.daemon_socket is not None:
+            return DaemonChatClient(self.daemon_socket, self.api_key, **kwargs)
+        return ChatClient(self.api_key, **kwargs)
+
+    @lazy_property
+    def summary_service(self):
+        from gpt_ui.summary import SummaryService, cheapest_model
+        return SummaryService(
+            self, self.config.get('summary_model') or cheapest_model(self.models_dict),
+            min_new_tokens=self.config.get('summary_min_new_tokens', 300),
+            window_tokens=self.config.get('summary_window_tokens', 1500))
+
+    def warm_up(self):
+        """Load what the first message needs, while the user types it."""
+        if not self.obsidian_vault_dir.exists():
+            print(f"WARNING: Obsidian vault directory {self.obsidian_vault_dir} does not exist.")
+        else:
+            self.vault_index.refresh()
+            # Otherwise the first :obsidian?: of a chat would index the whole vault while the user waits
+            self.scheduler.submit('chunk_index', self.chunk_index.refresh_vault, priority=30, lane='slow')
+        self.token_counter
+        self.file_expander
+        self.summary_service
+        self.client
+        import aiohttp
+        import openai
+        if self.args.markdown:
+            import gpt_ui.markdown
 
     def cleanup(self):
-        self.prompt_history_dir.cleanup()
-        self.voice_precache_dir.cleanup()
+        # Only what was used was created
+        created = vars(self)
+        if 'scheduler' in created:
+            self.scheduler.shutdown()
+            if self.args.debug:
+                for key, stats in self.scheduler.stats.items():
+                    print(f"{key}: {stats}")
+        if 'client' in created:
+            self.client.close()
+        if 'prompt_history_dir' in created:
+            shutil.rmtree(self.prompt_history_dir, ignore_errors=True)
 
 def main():
     conf = Conf()
-    converse(conf)
-    conf.cleanup()
\ No newline at end of file
+    from gpt_ui.cli import run_command
+    from gpt_ui.daemon import daemon_running, socket_path
+    try:
+        if run_command(conf):
+            return
+        # Commands are sent to a running daemon by gpt-ui before this, a chat only sends its API calls to it
+        if not conf.args.no_daemon and daemon_running(socket_path()):
+            conf.daemon_socket = socket_path()
+        if conf.args.trace or conf.args.profile:
+            trace.start(conf.args.trace, conf.args.profile)
+        conf.scheduler.submit('warm_up', conf.warm_up, priority=0, lane='slow')
+        from gpt_ui.gpt_ui import converse
+        converse(conf)
+    finally:
+        conf.cleanup()
+        tracer = trace.stop()
+        if tracer is not None:
+            if tracer.path is not None:
+                print(f"Wrote the trace to {tracer.path}")
+            if tracer.profiles:
+                print(f"Wrote {len(tracer.profiles)} profiles to {tracer.profile_dir}")
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import List
+
+from gpt_ui.util import write_json
+
+# Every message is stored once in chat_dir/.objects, under the sha256 of its json. Chats and backups are
+# manifests that list the hashes of their messages, so continuing a chat doesn't copy its history again.
+objects_dir_name = '.objects'
+manifest_format = 'gpt-ui-manifest'
+
+
+def message_hash(message) -> str:
+    return hashlib.sha256(json.dumps(message, sort_keys=True).encode()).hexdigest()
+
+
+def object_path(objects_dir, h) -> Path:
+    return objects_dir / h[:2] / f"{h}.json"
+
+
+def is_manifest(data) -> bool:
+    return isinstance(data, dict) and data.get('format') == manifest_format
+
+
+def write_manifest(path, chat):
+    """Store the messages of chat that are not stored yet, and write the manifest of chat to path."""
+    path = Path(path)
+    objects_dir = path.parent / objects_dir_name
+    hashes = []
+    for m in chat:
+        h = message_hash(m)
+        hashes.append(h)
+        blob_path = object_path(objects_dir, h)
+        try:
+            # Checked on disk every time, as gc in another process can have deleted it. Touching it makes it young,
+            # such that gc keeps it until the manifest that refers to it is written.
+            os.utime(blob_path)
+        except FileNotFoundError:
+            blob_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = blob_path.with_name(blob_path.name + '.tmp')
+            tmp_path.write_text(json.dumps(m))
+            os.replace(tmp_path, blob_path)
+    write_json(path, {'format': manifest_format, 'messages': hashes})
+
+
+def read_manifest(manifest, chat_dir) -> List[dict]:
+    objects_dir = Path(chat_dir) / objects_dir_name
+    chat = []
+    for h in manifest['messages']:
+        with object_path(objects_dir, h).open() as f:
+            chat.append(json.load(f))
+    return chat
+
+
+def gc(chat_dir, keep_backups=100, keep_backups_days=30, min_object_age_s=3600):
+    """Delete old backups and the stored messages no chat refers to anymore.
+
+    The newest keep_backups backups and all backups younger than keep_backups_days are kept.
+    Stored messages younger than min_object_age_s are never deleted, as a running session
+    might be about to write a manifest that refers to them.
+    @return: a touple of (number of deleted backups, number of deleted messages)
+    """
+    chat_dir = Path(chat_dir)
+    now = time.time()
+    backups = sorted(p for p in chat_dir.iterdir() if p.name.startswith('.backup') and p.suffix in ['.json', '.jsonl'])
+    backup_names = sorted({p.stem for p in backups}, reverse=True)
+    doomed = set(backup_names[keep_backups:])
+    n_backups = 0
+    for p in backups:
+        if p.stem in doomed and now - p.stat().st_mtime > keep_backups_days * 24 * 3600:
+            p.unlink()
+            n_backups += 1
+
+    # Named chats and backups
+    referenced = set()
+    for p in chat_dir.glob('*.json'):
+        try:
+            with p.open() as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if is_manifest(data):
+            referenced.update(data['messages'])
+
+    objects_dir = chat_dir / objects_dir_name
+    n_objects = 0
+    if objects_dir.exists():
+        for p in objects_dir.glob('*/*.json'):
+            if p.stem not in referenced and now - p.stat().st_mtime > min_object_age_s:
+                p.unlink()
+                n_objects += 1
+    return n_backups, n_objects
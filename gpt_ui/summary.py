@@ -0,0 +1,111 @@
+import hashlib
+import json
+import time
+from threading import Lock
+
+summarize_instuctions = (
+    'Please give a summary of the conversation so far in 5 words or less. You do not need to make a complete sentence. '
+    'Be as brief and descriptive as possible. Ideally do not leave out any topics discussed. If there are too many '
+    'topics (and only then) it is ok to write a longer than 5 words summary, but still keep it as brief as possible. '
+    'Do not use the following characters in your output: "*", ":", "!", "?", "/", "\\"')
+
+
+def cheapest_model(models_dict) -> str:
+    return min(models_dict.values(), key=lambda m: m['cost_per_input_token'])['name']
+
+
+class SummaryService:
+    """Short titles of a chat, for the toolbar, the terminal title and the default save name.
+
+    Titles are cached by a hash of the chat. A new title is only requested once min_new_tokens tokens were
+    added since the last one, and only the last window_tokens tokens of the chat are sent, together with
+    the previous title. If the last request failed, error is its message, for the toolbar.
+    """
+    def __init__(self, conf, model, min_new_tokens=300, window_tokens=1500, max_cached=1000):
+        self.conf = conf
+        self.model = model
+        self.min_new_tokens = min_new_tokens
+        self.window_tokens = window_tokens
+        self.max_cached = max_cached
+        self.title = ''
+        self.error = None
+        self._cache = {}
+        # Copies of the messages of the chat last seen, and the hash of the chat up to each of them
+        self._messages = []
+        self._hashes = []
+        # Number of messages and hash of the chat when the title was made
+        self._titled_len = 0
+        self._titled_hash = None
+        self._lock = Lock()
+
+    def _prefix_hashes(self, chat):
+        n_common = 0
+        for old, new in zip(self._messages, chat):
+            if old != new:
+                break
+            n_common += 1
+        del self._messages[n_common:], self._hashes[n_common:]
+        h = self._hashes[-1] if self._hashes else ''
+        for m in chat[n_common:]:
+            h = hashlib.sha256((h + json.dumps([m['role'], m['content']])).encode()).hexdigest()
+            self._messages.append(dict(m))
+            self._hashes.append(h)
+        return self._hashes
+
+    def _truncated(self, m) -> dict:
+        """The end of the message m, as much of it as fits into the window."""
+        counter = self.conf.token_counter
+        n_content = self.window_tokens - (counter.count_message(m) - counter.count_text(m['content']))
+        tokens = self.conf.enc.encode(m['content'])
+        return {**m, 'content': self.conf.enc.decode(tokens[-n_content:]) if n_content > 0 else ''}
+
+    def get(self, chat) -> str:
+        with self._lock:
+            if len(chat) == 0:
+                return self.title
+            hashes = self._prefix_hashes(chat)
+            if hashes[-1] in self._cache:
+                self.title = self._cache[hashes[-1]]
+                return self.title
+            counter = self.conf.token_counter
+            continues_titled_chat = self._titled_hash is not None and self._titled_len <= len(chat) \
+                and hashes[self._titled_len - 1] == self._titled_hash
+            if continues_titled_chat and counter.count_chat(chat[self._titled_len:]) < self.min_new_tokens:
+                return self.title
+            if not continues_titled_chat:
+                self.title = ''
+
+            # The system prompt, and as many of the last messages as fit into the window
+            window = []
+            n_tokens = 0
+            for m in reversed(chat[1:]):
+                n_tokens += counter.count_message(m)
+                if n_tokens > self.window_tokens:
+                    if window:
+                        break
+                    # The last message alone does not fit
+                    m = self._truncated(m)
+                window.append(m)
+            window = chat[:1] + list(reversed(window))
+            instructions = summarize_instuctions
+            if self.title:
+                instructions += f' The summary of an earlier part of this conversation was: "{self.title}". Keep it, if it still fits.'
+            import openai
+            messages = [{'role': m['role'], 'content': m['content']} for m in window] + [{'role': 'user', 'content': instructions}]
+            start = time.perf_counter()
+            try:
+                response = openai.ChatCompletion.create(model=self.model, messages=messages)
+                self.conf.ledger.record_response('summary', self.model, response, start)
+                self.title = response['choices'][0]['message']['content'].strip()
+            except (openai.error.OpenAIError, OSError) as e:
+                self.conf.ledger.record('summary', self.model, counter.count_chat(messages), 0,
+                                        time.perf_counter() - start, error=e)
+                self.error = str(e)
+                return self.title
+            self.error = None
+            if len(self._cache) >= self.max_cached:
+                # Dicts keep insertion order, so this drops the oldest title
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[hashes[-1]] = self.title
+            self._titled_len, self._titled_hash = len(chat), hashes[-1]
+            return self.title
@@ -0,0 +1,72 @@
+from threading import Lock
+from typing import List
+
+
+class WhitespaceEncoder:
+    """Counts each word as a token. For tests and benchmarks, which run without downloading a tiktoken encoding."""
+    name = 'whitespace'
+
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return ' '.join(tokens)
+
+
+class TokenCounter:
+    """Count chat tokens the way the API bills them, caching per message content.
+
+    The cache is keyed by the content string itself. Python caches the hash of a str
+    object, so once a message was counted, counting it again is a dict lookup.
+    One counter belongs to one encoding, so switching the model switches the cache.
+    """
+    # Overhead of the chat format, see the openai-cookbook "How to count tokens with tiktoken".
+    tokens_per_message = 3
+    tokens_per_name = 1
+    tokens_reply_priming = 3
+
+    def __init__(self, enc, max_entries=1_000_000):
+        self.enc = enc
+        self.max_entries = max_entries
+        self._cache = {}
+        self._lock = Lock()
+
+    @property
+    def name(self):
+        return self.enc.name
+
+    def count_text(self, text: str) -> int:
+        n = self._cache.get(text)
+        if n is None:
+            n = len(self.enc.encode(text))
+            with self._lock:
+                if len(self._cache) >= self.max_entries:
+                    # Dicts keep insertion order, so this drops the oldest entry.
+                    self._cache.pop(next(iter(self._cache)), None)
+                self._cache[text] = n
+        return n
+
+    def count_message(self, message: dict) -> int:
+        n = self.tokens_per_message + self.count_text(message['role']) + self.count_text(message['content'])
+        if 'name' in message:
+            n += self.tokens_per_name + self.count_text(message['name'])
+        return n
+
+    def message_counts(self, chat) -> List[int]:
+        return [self.count_message(m) for m in chat]
+
+    def count_chat(self, chat) -> int:
+        if len(chat) == 0:
+            return 0
+        return sum(self.message_counts(chat)) + self.tokens_reply_priming
+
+    def discard(self, texts):
+        with self._lock:
+            for t in texts:
+                self._cache.pop(t, None)
+
+    def discard_changed(self, old_chat, new_chat):
+        """Drop the cache entries of messages that are in old_chat but no longer in new_chat."""
+        kept = {m['content'] for m in new_chat}
+        self.discard(m['content'] for m in old_chat if m['content'] not in kept)
+
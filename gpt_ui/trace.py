@@ -0,0 +1,139 @@
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+# Spans of where a turn spends its time (file expansion, tokenization, the API, speech synthesis, backups, background
+# jobs), recorded when gpt-ui runs with --trace FILE and written as Chrome trace events, which chrome://tracing and
+# https://ui.perfetto.dev show as a timeline per thread. With --profile, each answer of the assistant is also
+# profiled with cProfile, see turn.
+#
+# Tracing is off unless start is called. Then span returns one shared context manager that does nothing, so the
+# instrumented code only pays a function call per span.
+
+_null = nullcontext()
+_tracer = None
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.add(self.name, self.start, time.perf_counter_ns(), self.args)
+
+
+class Tracer:
+    def __init__(self, path=None, profile_dir=None):
+        self.path = Path(path) if path is not None else None
+        self.profile_dir = Path(profile_dir) if profile_dir is not None else None
+        self.start_ns = time.perf_counter_ns()
+        self.pid = os.getpid()
+        # Appended to from several threads, which a list allows without a lock
+        self.events = []
+        # Threads are numbered in the order they record, as the OS reuses the ident of a thread that ended
+        self.thread_names = {}
+        self._thread = threading.local()
+        self._thread_ids = itertools.count(1)
+        self.profiles = []
+
+    def add(self, name, start_ns, end_ns, args=None, phase='X'):
+        event = {'name': name, 'ph': phase, 'ts': (start_ns - self.start_ns) / 1000, 'pid': self.pid,
+                 'tid': self._thread_id()}
+        if phase == 'X':
+            event['dur'] = (end_ns - start_ns) / 1000
+        else:
+            # Instant events are drawn on their thread only
+            event['s'] = 't'
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def _thread_id(self) -> int:
+        tid = getattr(self._thread, 'id', None)
+        if tid is None:
+            tid = self._thread.id = next(self._thread_ids)
+            self.thread_names[tid] = threading.current_thread().name
+        return tid
+
+    def trace_events(self) -> list:
+        names = [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                 for tid, name in list(self.thread_names.items())]
+        return names + list(self.events)
+
+    def write(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open('w') as f:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, f)
+
+
+def start(path=None, profile_dir=None) -> Tracer:
+    """Record spans, to be written to path by stop, and profile each turn into profile_dir, if given."""
+    global _tracer
+    _tracer = Tracer(path, profile_dir)
+    return _tracer
+
+
+def stop() -> Tracer:
+    """Stop recording and write the trace.
+       @return: the tracer that was recording, or None
+    """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.write()
+    return tracer
+
+
+def span(name, **args):
+    """A context manager that records the time spent in it as a span, when tracing."""
+    if _tracer is None:
+        return _null
+    return Span(_tracer, name, args)
+
+
+def mark(name, **args):
+    """Record an instant event, e.g. the first token of an answer, when tracing."""
+    if _tracer is not None:
+        now = time.perf_counter_ns()
+        _tracer.add(name, now, now, args, phase='i')
+
+
+@contextmanager
+def _profiled_turn(tracer, name, args):
+    import cProfile
+    profile = cProfile.Profile()
+    with Span(tracer, name, args):
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+    tracer.profile_dir.mkdir(parents=True, exist_ok=True)
+    path = tracer.profile_dir / f"turn_{len(tracer.profiles) + 1:03d}.prof"
+    profile.dump_stats(path)
+    tracer.profiles.append(path)
+
+
+def turn(name, **args):
+    """Like span, and with --profile the turn is also profiled, into one file per turn in the profile directory.
+       Only the calling thread is profiled, the background threads show up in the trace.
+    """
+    if _tracer is None:
+        return _null
+    if _tracer.profile_dir is None:
+        return Span(_tracer, name, args)
+    return _profiled_turn(_tracer, name, args)
@@ -0,0 +1,197 @@
+import atexit
+import hashlib
+import os
+import platform
+import queue
+import re
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock, Thread, get_ident
+from typing import Optional
+
+from gpt_ui.player import ProcessPlayer, make_player
+from gpt_ui.trace import span
+from gpt_ui.util import debug_notify
+
+
+def prepare_text(text) -> str:
+    text = re.sub('`', '', text)
+    text = re.sub('"', '', text)
+    # Filter out python interpreter prompt
+    text = re.sub('>>> ', '', text)
+    # Filter out underscores
+    text = re.sub('_', ' ', text)
+    return text.strip()
+
+
+class AudioCache:
+    """Synthesized speech in a directory, named by the hash of what was synthesized.
+
+    When the files take more than max_bytes, the least recently used ones are deleted.
+    """
+    def __init__(self, directory, max_bytes=200 * 2**20):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._size = sum(p.stat().st_size for p in self.directory.iterdir() if p.is_file())
+
+    def path(self, extension, *key) -> Path:
+        digest = hashlib.sha256('\0'.join(str(k) for k in key).encode()).hexdigest()
+        return self.directory / f"{digest}{extension}"
+
+    def get(self, path) -> Optional[Path]:
+        try:
+            # Mark it as recently used
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def add(self, tmp_path, path) -> Path:
+        """Move the synthesized file at tmp_path into the cache as path."""
+        size = tmp_path.stat().st_size
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._size += size
+            if self._size > self.max_bytes:
+                self._evict(keep=path)
+        return path
+
+    def _evict(self, keep):
+        files = sorted((p.stat().st_mtime_ns, p) for p in self.directory.iterdir() if p.is_file() and p != keep)
+        self._size = sum(p.stat().st_size for _, p in files) + keep.stat().st_size
+        for _, p in files:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                size = p.stat().st_size
+                p.unlink()
+                self._size -= size
+            except OSError:
+                pass
+
+
+class Speaker:
+    """Speaks texts one after the other, without gaps.
+
+    Texts are queued, and a pool of `lookahead` workers synthesizes the next texts while the current one
+    plays, and is added to the playlist of the player before the one playing ends. The audio is cached, so
+    speaking a text again plays it right away. If mpv goes away (it crashed, was killed or lost the audio device),
+    the player is replaced by a ProcessPlayer, which starts mpv for each file.
+    """
+    def __init__(self, conf, cmd='gsay', lookahead=3, player=None):
+        self.conf = conf
+        self.cmd = cmd
+        self.lookahead = lookahead
+        self.extension = '.aiff' if cmd == 'say' and platform.system() == 'Darwin' else '.mp3'
+        self.cache = AudioCache(conf.voice_precache_dir, conf.config.get('voice_cache_max_mb', 200) * 2**20)
+        self.queue = queue.Queue()
+        self.pool = ThreadPoolExecutor(max_workers=lookahead, thread_name_prefix='gpt-ui-tts')
+        # stop() increases the generation, which makes the player skip everything queued before
+        self.generation = 0
+        self.speed = conf.config.get('speech_speed', 1.4)
+        # Started when something is spoken first
+        self.player = player
+        self._player_thread = None
+        self._player_lock = Lock()
+
+    def speak(self, text) -> None:
+        text = prepare_text(text)
+        if text == '':
+            return
+        self.queue.put((self.generation, text))
+        if self.player is None:
+            self.player = make_player(self.speed)
+            atexit.register(self.player.close)
+        if self._player_thread is None:
+            self._player_thread = Thread(target=self._play_queue, name='gpt-ui-speaker', daemon=True)
+            self._player_thread.start()
+
+    def set_speed(self, speed):
+        self.speed = speed
+        if self.player is not None:
+            self._use_player(lambda player: player.set_speed(speed))
+
+    def stop(self):
+        self.generation += 1
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        if self.player is not None:
+            try:
+                self._use_player(lambda player: player.stop())
+            except Exception as e:
+                # Called when the user presses CTRL+C, which must never end the chat
+                if self.conf.args.debug:
+                    print(f"Error while stopping speech: {e}")
+
+    def _use_player(self, action):
+        """Call action with the player, and once more with a new player if the old one went away."""
+        player = self.player
+        try:
+            return action(player)
+        except (ConnectionError, TimeoutError):
+            return action(self._replace_player(player))
+
+    def _replace_player(self, player):
+        with self._player_lock:
+            if self.player is player:
+                print("WARNING: mpv stopped, speech is played with one mpv process per sentence from now on.")
+                try:
+                    player.close()
+                except Exception:
+                    pass
+                self.player = ProcessPlayer(self.speed)
+                atexit.register(self.player.close)
+            return self.player
+
+    def synthesize(self, text) -> Path:
+        path = self.cache.path(self.extension, self.cmd, text)
+        if self.cache.get(path) is not None:
+            return path
+        debug_notify(self.conf, text)
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.{get_ident()}.tmp{self.extension}")
+        with span('tts synthesize', chars=len(text)):
+            self._run_tts(text, tmp_path)
+        return self.cache.add(tmp_path, path)
+
+    def _run_tts(self, text, path):
+        subprocess.run([self.cmd, "--output-file", path, "--speed", str(1), "--", text],
+                       stderr=subprocess.PIPE, stdout=subprocess.PIPE, check=True)
+
+    def _play_queue(self):
+        pending = deque()
+        while True:
+            # Keep up to lookahead texts synthesizing ahead of the one playing
+            while len(pending) < self.lookahead:
+                try:
+                    generation, text = self.queue.get(block=len(pending) == 0)
+                except queue.Empty:
+                    break
+                if generation == self.generation:
+                    pending.append((generation, self.pool.submit(self.synthesize, text)))
+            generation, future = pending.popleft()
+            if generation != self.generation:
+                continue
+            try:
+                with span('tts wait for synthesis'):
+                    path = future.result()
+            except Exception as e:
+                if self.conf.args.debug:
+                    print(f"Error while synthesizing speech: {e}")
+                continue
+            try:
+                # Add the file while the one before it still plays, such that there is no gap between them
+                with span('tts wait for player'):
+                    self.player.wait(max_pending=1)
+                if generation == self.generation:
+                    self._use_player(lambda player: player.enqueue(path))
+            except Exception as e:
+                # This thread is not started again, so it has to keep running
+                if self.conf.args.debug:
+                    print(f"Error while playing speech: {e}")
@@ -1,4 +1,40 @@
 import datetime
+import json
+import os
+from pathlib import Path
+from threading import Lock
 
 def timestamp():
     return datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S-%f')
+
+def write_json(path, data):
+    """Replace the file at path with data as json, such that a crash never leaves a half written file."""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with tmp_path.open('w') as f:
+        json.dump(data, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class lazy_property:
+    """Like functools.cached_property, computed on first access and then stored on the instance.
+       A lock makes sure it is computed only once, when a background thread warms it up while it is asked for.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+        self._lock = Lock()
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        with self._lock:
+            if self.name not in instance.__dict__:
+                instance.__dict__[self.name] = self.func(instance)
+        return instance.__dict__[self.name]
+
+def debug_notify(conf, msg):
+    if conf.args.debug:
+        os.system(f"notify-send '{msg}'")
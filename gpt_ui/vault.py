@@ -0,0 +1,123 @@
+import json
+import os
+import re
+import time
+from bisect import bisect_left
+from fnmatch import fnmatch
+from pathlib import Path
+from threading import Lock
+from typing import List
+
+from prompt_toolkit.completion import Completer, Completion
+
+from gpt_ui.util import write_json
+
+
+class VaultIndex:
+    """Index from file name to paths of the notes (.md files) in an Obsidian vault.
+
+    The index is stored in index_path. A refresh stats every directory of the vault, but only lists
+    the directories whose mtime changed, as adding, removing or renaming a note changes the mtime of
+    its directory. Hidden directories like .obsidian and .trash are skipped.
+    """
+    def __init__(self, vault_dir, index_path, min_refresh_interval=5):
+        self.vault_dir = Path(vault_dir)
+        self.index_path = Path(index_path)
+        self.min_refresh_interval = min_refresh_interval
+        self._dirs = {}
+        self._names = {}
+        self._stems = []
+        self._last_refresh = 0
+        self._lock = Lock()
+        if self.index_path.exists():
+            try:
+                with self.index_path.open() as f:
+                    index = json.load(f)
+                if index['vault_dir'] == str(self.vault_dir):
+                    self._dirs = index['dirs']
+                    self._rebuild()
+            except (ValueError, KeyError):
+                pass
+
+    def _rebuild(self):
+        names = {}
+        for rel_dir, entry in self._dirs.items():
+            for name in entry['files']:
+                names.setdefault(name, []).append(self.vault_dir / rel_dir / name)
+        self._names = names
+        self._stems = sorted({Path(name).stem for name in names})
+
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and time.monotonic() - self._last_refresh < self.min_refresh_interval:
+                return
+            dirs = {}
+            changed = False
+            stack = ['.']
+            while stack:
+                rel_dir = stack.pop()
+                path = self.vault_dir / rel_dir
+                try:
+                    mtime_ns = os.stat(path).st_mtime_ns
+                except OSError:
+                    continue
+                entry = self._dirs.get(rel_dir)
+                if entry is None or entry['mtime_ns'] != mtime_ns:
+                    changed = True
+                    entry = {'mtime_ns': mtime_ns, 'files': [], 'dirs': []}
+                    with os.scandir(path) as it:
+                        for e in it:
+                            if e.name.startswith('.'):
+                                continue
+                            if e.is_dir():
+                                entry['dirs'].append(e.name)
+                            elif e.name.endswith('.md'):
+                                entry['files'].append(e.name)
+                dirs[rel_dir] = entry
+                stack += [os.path.join(rel_dir, d) if rel_dir != '.' else d for d in entry['dirs']]
+            changed = changed or len(dirs) != len(self._dirs)
+            self._dirs = dirs
+            self._last_refresh = time.monotonic()
+            if changed:
+                self._rebuild()
+                self.index_path.parent.mkdir(parents=True, exist_ok=True)
+                write_json(self.index_path, {'vault_dir': str(self.vault_dir), 'dirs': dirs})
+
+    def lookup(self, name) -> List[Path]:
+        """Return the paths of all notes with the file name `name`, which may be a glob pattern."""
+        self.refresh()
+        if re.search(r'[*?\[]', name):
+            return [p for n, paths in self._names.items() if fnmatch(n, name) for p in paths]
+        return list(self._names.get(name, []))
+
+    def paths(self) -> List[Path]:
+        self.refresh()
+        return [p for paths in self._names.values() for p in paths]
+
+    def note_names(self, prefix='', limit=50) -> List[str]:
+        """Return the names of the notes starting with prefix, without the .md extension."""
+        self.refresh()
+        stems = self._stems
+        i = bisect_left(stems, prefix)
+        result = []
+        while i < len(stems) and stems[i].startswith(prefix) and len(result) < limit:
+            result.append(stems[i])
+            i += 1
+        return result
+
+
+class ObsidianCompleter(Completer):
+    """Complete note names after :obsidian: in the prompt.
+       vault_index can also be a function returning the index, such that the prompt can be shown before it is loaded.
+    """
+    def __init__(self, vault_index):
+        self.vault_index = vault_index
+
+    def get_completions(self, document, complete_event):
+        match = re.search(r':obsidian:([^:\n]*)$', document.text_before_cursor)
+        if match is None:
+            return
+        prefix = match.group(1)
+        vault_index = self.vault_index() if callable(self.vault_index) else self.vault_index
+        for name in vault_index.note_names(prefix):
+            yield Completion(f"{name}:", start_position=-len(prefix), display=name)
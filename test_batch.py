@@ -0,0 +1,41 @@
+import json
+
+from gpt_ui.batch import RateLimiter, run_batch
+from gpt_ui.client import ChatClient
+from tests.helpers import FakeServer, make_conf
+
+
+def test_batch_resumes_from_partial_output(tmp_path):
+    in_path, out_path = tmp_path / 'in.jsonl', tmp_path / 'out.jsonl'
+    in_path.write_text(''.join(json.dumps({'id': str(i), 'prompt': f'question {i}'}) + '\n' for i in range(5))
+                       + 'not json\n')
+    # Request 0 was answered, and the crash cut off the result of request 1
+    out_path.write_text(json.dumps({'id': '0', 'content': 'old'}) + '\n' + '{"id": "1", "cont')
+    server = FakeServer([['answer']] * 4)
+    models_dict = {'gpt-4': {'name': 'gpt-4', 'aliases': [], 'rpm': 1000, 'tpm': 100000}}
+    conf = make_conf(tmp_path, models_dict=models_dict, client=ChatClient('key', base_url=server.url))
+    answered, failed, skipped = conf.client.run(run_batch(conf, in_path, out_path, concurrency=2))
+    assert (answered, failed, skipped) == (4, 1, 1)
+    results = [json.loads(line) for line in out_path.read_text().splitlines()]
+    assert results[0] == {'id': '0', 'content': 'old'}
+    assert sorted(r['id'] for r in results if 'content' in r) == ['0', '1', '2', '3', '4']
+    assert all(r['content'] == 'answer' and r['prompt_tokens'] == 2 + 3 + 1 + 3 for r in results[1:] if 'content' in r)
+    assert len(server.requests) == 4
+    assert [e['chat'] for e in conf.ledger.entries()] == ['in.jsonl'] * 4
+
+    # Resuming again neither reports the invalid line again nor trips over a result without an id
+    with out_path.open('a') as f:
+        f.write('{"content": "no id"}\n')
+    assert conf.client.run(run_batch(conf, in_path, out_path)) == (0, 0, 6)
+    conf.client.close()
+    server.close()
+
+
+def test_rate_limiter_waits_for_requests_and_tokens():
+    limiter = RateLimiter(rpm=60, tpm=600)
+    limiter.requests = 0
+    assert abs(limiter._wait_time(0) - 1.0) < 0.01
+    limiter.requests, limiter.tokens = 10, 100
+    assert abs(limiter._wait_time(200) - 10.0) < 0.01
+    assert limiter._wait_time(50) == 0
+    assert RateLimiter(None, None)._wait_time(10 ** 9) == 0
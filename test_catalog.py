@@ -0,0 +1,29 @@
+import json
+
+from gpt_ui.catalog import ChatCatalog
+from gpt_ui.journal import ChatJournal
+
+
+def write_chat(path, contents):
+    path.write_text(json.dumps([{'role': 'user', 'model': 'gpt-4', 'content': c} for c in contents]))
+
+
+def test_catalog_refreshes_only_changed_chats(tmp_path):
+    write_chat(tmp_path / 'a.json', ['hello', 'world'])
+    write_chat(tmp_path / '.backup_2023.json', ['backup'])
+    catalog = ChatCatalog(tmp_path)
+    assert sorted(catalog.refresh()) == ['.backup_2023.json', 'a.json']
+    assert catalog.refresh() == []
+    assert catalog.chats() == [('a.json', 2, 'world', '', '')]
+    assert [name for name, *_ in catalog.chats(hide_backups=False)] == ['.backup_2023.json', 'a.json']
+
+    write_chat(tmp_path / 'a.json', ['hello', 'world', 'again'])
+    (tmp_path / '.backup_2023.json').unlink()
+    assert catalog.refresh() == ['a.json']
+    assert catalog.chats(hide_backups=False) == [('a.json', 3, 'again', '', '')]
+
+
+def test_last_backup_includes_journals(tmp_path):
+    write_chat(tmp_path / '.backup_2023.json', ['old'])
+    ChatJournal(tmp_path / '.backup_2024.json').sync([{'role': 'user', 'content': 'new'}])
+    assert ChatCatalog(tmp_path).last_backup() == tmp_path / '.backup_2024.json'
@@ -0,0 +1,69 @@
+import socket
+
+import pytest
+
+from gpt_ui.client import APIError, ChatClient
+from tests.helpers import FakeServer
+
+
+def test_stream_and_retry_on_rate_limit():
+    server = FakeServer([429, ['Hello', ' world']])
+    retries = []
+    client = ChatClient('key', base_url=server.url, backoff_base=0.01, on_retry=lambda *a: retries.append(a))
+    assert ''.join(client.stream('gpt-4', [{'role': 'user', 'content': 'hi'}])) == 'Hello world'
+    assert len(retries) == 1 and retries[0][1].status == 429
+    assert server.requests[-1]['stream'] is True
+    client.close()
+    server.close()
+
+
+def test_errors_are_raised_after_max_retries():
+    server = FakeServer([500, 500, 400])
+    client = ChatClient('key', base_url=server.url, max_retries=1, backoff_base=0.01)
+    with pytest.raises(APIError) as e:
+        list(client.stream('gpt-4', []))
+    assert e.value.status == 500
+    # Client errors are not retried
+    with pytest.raises(APIError) as e:
+        list(client.stream('gpt-4', []))
+    assert e.value.status == 400
+    client.close()
+    server.close()
+
+
+def test_first_token_timeout():
+    server = FakeServer([['late'], ['on time']], delay=0.5)
+    client = ChatClient('key', base_url=server.url, max_retries=0, first_token_timeout=0.1)
+    with pytest.raises(APIError, match='first token'):
+        list(client.stream('gpt-4', []))
+    client.first_token_timeout = 5
+    assert list(client.stream('gpt-4', [])) == ['on time']
+    client.close()
+    server.close()
+
+
+def test_first_token_timeout_covers_the_headers():
+    # Accepts the connection but never answers, not even the headers
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    client = ChatClient('key', base_url=f'http://127.0.0.1:{listener.getsockname()[1]}', max_retries=0,
+                        first_token_timeout=0.2)
+    with pytest.raises(APIError, match='first token'):
+        list(client.stream('gpt-4', []))
+    client.close()
+    listener.close()
+
+
+def test_malformed_events_raise_api_error():
+    server = FakeServer([['Hello', b'{"choices": [{"delta"'], [b'{"choices": "none"}']])
+    client = ChatClient('key', base_url=server.url, max_retries=0)
+    chunks = []
+    with pytest.raises(APIError) as e:
+        for chunk in client.stream('gpt-4', []):
+            chunks.append(chunk)
+    assert chunks == ['Hello'] and 'Malformed' in str(e.value)
+    events = list(client.stream_many([('gpt-4', [])]))
+    assert events[0][1] == 'error' and isinstance(events[0][2], APIError)
+    client.close()
+    server.close()
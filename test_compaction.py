@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+from gpt_ui.client import ChatClient
+from gpt_ui.compaction import summary_message
+from gpt_ui.gpt_ui import trim_chat
+from tests.helpers import FakeServer, make_conf as make_base_conf
+
+
+def make_conf(tmp_path, server):
+    return make_base_conf(tmp_path, max_tokens=200, completion_reserve=50, summary_reserve=20,
+                          client=ChatClient('key', base_url=server.url, max_retries=0),
+                          args=SimpleNamespace(compact=True, retrieve=False, debug=False))
+
+
+def message(role, n_words):
+    return {'role': role, 'content': ' '.join(['word'] * n_words)}
+
+
+def test_compaction_summarizes_once_and_extends_incrementally(tmp_path):
+    server = FakeServer([['summary ', '1'], ['summary 2']])
+    conf = make_conf(tmp_path, server)
+    chat = [message('system', 5)] + [message('user' if i % 2 == 0 else 'assistant', 30) for i in range(6)]
+    sent, num_tokens, dropped = trim_chat(conf, chat)
+    requests = [r['messages'] for r in server.requests]
+    assert len(requests) == 1
+    # The summary fits into the reserve together with its message
+    assert server.requests[0]['max_tokens'] == 20 - conf.token_counter.count_message(summary_message(''))
+    assert conf.token_counter.count_message(sent[1]) <= conf.summary_reserve
+    assert dropped == [1, 2, 3]
+    assert chat[3]['summary'] == 'summary 1'
+    assert sent[1]['content'].endswith('summary 1')
+    assert num_tokens <= conf.max_tokens - conf.completion_reserve
+
+    # The stored summary is reused without calling the model again
+    trim_chat(conf, chat)
+    assert len(server.requests) == 1
+
+    # Only the messages that newly fell out of the window are sent, together with the old summary
+    chat += [message('user', 30), message('assistant', 30)]
+    sent, _, dropped = trim_chat(conf, chat)
+    requests = [r['messages'] for r in server.requests]
+    assert len(requests) == 2
+    assert dropped == [1, 2, 3, 4, 5]
+    assert 'summary 1' in requests[1][1]['content']
+    assert requests[1][1]['content'].count(': word') == 2
+    assert chat[5]['summary'] == 'summary 2'
+    assert [e['completion_tokens'] for e in conf.ledger.entries()] == [2, 2]
+
+    # A stored summary longer than the reserve leaves room for itself
+    chat[5]['summary'] = ' '.join(['long'] * 40)
+    sent, num_tokens, dropped = trim_chat(conf, chat)
+    assert len(server.requests) == 2
+    assert dropped[-1] > 5 and num_tokens <= conf.max_tokens - conf.completion_reserve
+    conf.client.close()
+    server.close()
+
+
+def test_compaction_falls_back_to_dropping_when_the_api_fails(tmp_path):
+    server = FakeServer([429])
+    conf = make_conf(tmp_path, server)
+    chat = [message('system', 5)] + [message('user' if i % 2 == 0 else 'assistant', 30) for i in range(6)]
+    sent, num_tokens, dropped = trim_chat(conf, chat)
+    assert dropped == [1, 2, 3]
+    assert sent == [chat[0]] + chat[4:]
+    assert not any('summary' in m for m in chat)
+    failed, = conf.ledger.entries()
+    assert failed['kind'] == 'compaction' and failed['error'] == '429: slow down' and failed['prompt_tokens'] > 0
+
+    # The last stored summary is still sent
+    chat[1]['summary'] = 'summary 1'
+    sent, _, dropped = trim_chat(conf, chat)
+    assert dropped == [1, 2, 3]
+    assert sent[1]['content'].endswith('summary 1') and sent[2:] == chat[4:]
+    conf.client.close()
+    server.close()
@@ -0,0 +1,73 @@
+import contextlib
+import io
+
+import pytest
+from prompt_toolkit.application import create_app_session
+from prompt_toolkit.output import DummyOutput
+
+import gpt_ui.gpt_ui as gpt_ui
+from gpt_ui.client import ChatClient
+from gpt_ui.compare import compare_models, parse_compare
+from gpt_ui.journal import ChatJournal
+from gpt_ui.search import SearchIndex
+from tests.helpers import FakeServer, make_conf
+
+models_dict = {
+    'gpt-4o': {'name': 'gpt-4o', 'aliases': ['g4o'], 'cost_per_input_token': 1, 'cost_per_output_token': 2},
+    'gpt-4': {'name': 'gpt-4', 'aliases': ['g4'], 'cost_per_input_token': 3, 'cost_per_output_token': 6},
+}
+
+
+def test_parse_compare():
+    models, prompt = parse_compare(models_dict, 'g4o gpt-4: What is 1+1?')
+    assert [m['name'] for m in models] == ['gpt-4o', 'gpt-4']
+    assert prompt == 'What is 1+1?'
+    with pytest.raises(ValueError):
+        parse_compare(models_dict, 'g5: hi')
+    with pytest.raises(ValueError):
+        parse_compare(models_dict, 'no colon')
+
+
+def test_models_are_streamed_concurrently():
+    server = FakeServer([['a\n', 'b'], ['c']], delay=0.3)
+    client = ChatClient('key', base_url=server.url)
+    lines = []
+    # Each line is recorded with the number of requests the server got until then
+    answers = compare_models(client, list(models_dict.values()), [[], []],
+                             lambda i, line: lines.append((i, line, len(server.requests))))
+    assert sorted(a.text for a in answers) == ['a\nb', 'c']
+    assert sorted(line[:2] for line in lines) == sorted([(i, line) for i, a in enumerate(answers) for line in a.text.split('\n')])
+    # The second request was sent before the first answer arrived
+    assert lines[0][2] == 2
+    assert all(a.ttft() >= 0.3 and a.error is None for a in answers)
+    assert answers[0].cost(10, 1) == 12
+    client.close()
+    server.close()
+
+
+def compare_conf(tmp_path, server):
+    models = {
+        'small': {'name': 'small', 'aliases': [], 'max_tokens': 60, 'cost_per_input_token': 0, 'cost_per_output_token': 0},
+        'large': {'name': 'large', 'aliases': [], 'max_tokens': 8192, 'cost_per_input_token': 0, 'cost_per_output_token': 0},
+    }
+    backup_file = tmp_path / '.backup_1.json'
+    return make_conf(tmp_path, models_dict=models, client=ChatClient('key', base_url=server.url),
+                     chat_dir=tmp_path, chat_backup_file=backup_file, journal=ChatJournal(backup_file),
+                     search_index=SearchIndex(tmp_path))
+
+
+def test_compare_trims_per_model_and_removes_an_unkept_prompt(tmp_path, monkeypatch):
+    server = FakeServer([['one'], ['two']])
+    conf = compare_conf(tmp_path, server)
+    chat = [{'role': 'system', 'content': 'be nice'}]
+    chat += [{'role': 'user' if i % 2 == 0 else 'assistant', 'content': ' '.join(['word'] * 20)} for i in range(4)]
+    before = list(chat)
+    monkeypatch.setattr(gpt_ui.pt, 'prompt', lambda *args, **kwargs: '0')
+    with create_app_session(output=DummyOutput()), contextlib.redirect_stdout(io.StringIO()):
+        gpt_ui.compare_answers(conf, chat, 'small large: question')
+    sent = {r['model']: r['messages'] for r in server.requests}
+    assert len(sent['large']) == 6 and len(sent['small']) < len(sent['large'])
+    assert sent['small'][-1]['content'] == 'question'
+    assert chat == before
+    conf.client.close()
+    server.close()
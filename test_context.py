@@ -0,0 +1,14 @@
+from gpt_ui.context import cut_index
+
+
+def test_cut_index_keeps_longest_suffix_that_fits():
+    counts = [10, 5, 5, 5, 5]
+    assert cut_index(counts, 100) == 1
+    assert cut_index(counts, 20) == 3
+    assert cut_index(counts, 20, overhead=1) == 4
+
+
+def test_cut_index_always_keeps_first_and_last():
+    assert cut_index([10, 50, 50], 5) == 2
+    assert cut_index([10, 50], 5) == 1
+    assert cut_index([10], 5) == 1
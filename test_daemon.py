@@ -0,0 +1,134 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from threading import Thread
+from types import SimpleNamespace
+
+import pytest
+
+from gpt_ui.client import APIError, ChatClient, DaemonChatClient
+from gpt_ui.daemon import Daemon, daemon_running, run_remote
+from gpt_ui.ledger import Ledger
+from gpt_ui.scheduler import Scheduler
+from gpt_ui.setup import Conf
+from tests.helpers import FakeServer
+
+
+class FakeConf:
+    parse_args = Conf.parse_args
+
+    def __init__(self, tmp_path, api_url):
+        self.config_dir = tmp_path
+        self.config_file = tmp_path / 'config.yaml'
+        self.config_file_local = tmp_path / 'config_local.yaml'
+        self.project_dir = tmp_path
+        self.prompt_dir = tmp_path / 'prompts'
+        self.speak_default = self.compact_default = self.retrieve_default = self.markdown_default = False
+        self.config = {}
+        self.scheduler = Scheduler()
+        self.catalog = SimpleNamespace(refresh=lambda: None)
+        self.ledger = Ledger(tmp_path / 'ledger.jsonl', {})
+        self.client = ChatClient('key', base_url=api_url, backoff_base=0.01)
+        self.warmed_up = False
+
+    def warm_up(self):
+        self.warmed_up = True
+
+    def cleanup(self):
+        self.scheduler.shutdown()
+        self.client.close()
+
+
+def start_daemon(tmp_path, api_url):
+    (tmp_path / 'prompts').mkdir()
+    (tmp_path / 'config.yaml').write_text('user: me\n')
+    confs = []
+
+    def make_conf():
+        confs.append(FakeConf(tmp_path, api_url))
+        return confs[-1]
+    daemon = Daemon(make_conf, tmp_path / 'run' / 'daemon.sock')
+    Thread(target=daemon.serve, daemon=True).start()
+    while not daemon_running(daemon.path):
+        time.sleep(0.01)
+    return daemon, confs
+
+
+def remote(path, *argv):
+    """Run gpt-ui with the daemon at path, in another process, as stdout is replaced while the daemon runs a command."""
+    code = f"import sys; from gpt_ui.daemon import run_remote; print(run_remote({list(argv)!r}, {str(path)!r}), file=sys.stderr)"
+    process = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                             env={**os.environ, 'PYTHONPATH': str(Path(__file__).parent)})
+    *err, exit_code = process.stderr.strip().split('\n')
+    return None if exit_code == 'None' else int(exit_code), process.stdout, '\n'.join(err)
+
+
+def test_commands_run_in_the_daemon(tmp_path):
+    server = FakeServer([])
+    daemon, confs = start_daemon(tmp_path, server.url)
+    exit_code, out, err = remote(daemon.path, '--stats')
+    assert exit_code == 0 and 'total' in out
+    exit_code, out, err = remote(daemon.path, '--help')
+    assert exit_code == 0 and 'usage:' in out
+    exit_code, out, err = remote(daemon.path, '--no-such-option')
+    assert exit_code == 2 and 'unrecognized arguments' in err
+    # A chat needs the terminal, so it runs in the calling process
+    assert remote(daemon.path)[0] is None
+    assert remote(daemon.path, '--stats', '--no-daemon')[0] is None
+    # --batch reads and writes files relative to the working directory of the client
+    assert remote(daemon.path, '--batch', 'in.jsonl', 'out.jsonl')[0] is None
+    assert len(confs) == 1 and confs[0].warmed_up
+
+    # A changed config file makes a new conf
+    time.sleep(0.01)
+    (tmp_path / 'config.yaml').write_text('user: you\n')
+    assert remote(daemon.path, '--stats')[0] == 0
+    assert len(confs) == 2
+
+    assert remote(daemon.path, '--stop-daemon') == (0, 'Stopped the daemon.\n', '')
+    while daemon_running(daemon.path):
+        time.sleep(0.01)
+    assert not daemon.path.exists()
+    assert run_remote(['--stats'], daemon.path) is None
+    server.close()
+
+
+def test_chat_streams_through_the_daemon(tmp_path):
+    server = FakeServer([['Hello', ' world'], 400, ['direct']])
+    daemon, confs = start_daemon(tmp_path, server.url)
+    client = DaemonChatClient(daemon.path, 'key', base_url='http://127.0.0.1:1/v1')
+    stats = {}
+    assert ''.join(client.stream('gpt-4', [{'role': 'user', 'content': 'hi'}], stats)) == 'Hello world'
+    assert stats['retries'] == 0 and stats['ttft'] is not None
+    with pytest.raises(APIError) as e:
+        list(client.stream('gpt-4', []))
+    assert e.value.status == 400
+
+    # Without the daemon, the client connects to the API itself
+    daemon.server.shutdown()
+    while daemon_running(daemon.path):
+        time.sleep(0.01)
+    client.base_url = server.url
+    assert ''.join(client.stream('gpt-4', [])) == 'direct'
+    client.close()
+    server.close()
+
+
+def test_socket_directory_must_be_private(tmp_path):
+    from gpt_ui.daemon import is_private
+    shared = tmp_path / 'shared'
+    shared.mkdir(mode=0o700)
+    (shared / 'gpt-ui').mkdir(mode=0o700)
+    assert is_private(shared / 'gpt-ui')
+    # Like a directory in /tmp that another user created first
+    (shared / 'gpt-ui').chmod(0o777)
+    assert not is_private(shared / 'gpt-ui')
+    (shared / 'gpt-ui').chmod(0o700)
+    shared.chmod(0o777)
+    assert not is_private(shared / 'gpt-ui')
+    daemon = Daemon(lambda: None, shared / 'gpt-ui' / 'daemon.sock')
+    with pytest.raises(RuntimeError):
+        daemon.serve()
+    assert not daemon_running(daemon.path)
@@ -0,0 +1,41 @@
+import os
+
+from gpt_ui.expand import FileExpander
+
+
+class CharEncoder:
+    name = 'chars'
+
+    def encode(self, text):
+        return list(text)
+
+    def decode(self, tokens):
+        return ''.join(tokens)
+
+
+def test_expand_is_memoized_until_the_file_changes(tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_text('first')
+    expander = FileExpander(CharEncoder(), token_cap=100)
+    content = f'look at :file:{path}:'
+    expanded = expander.expand(content)
+    assert expanded == f'look at \n{path}>>>\nfirst\n<<<{path}\n'
+    assert expander.expand(content) is expanded
+
+    path.write_text('second version')
+    os.utime(path, ns=(1, 1))
+    assert 'second version' in expander.expand(content)
+    assert 'does not exist' in expander.expand(f':file:{tmp_path / "missing"}:')
+
+
+def test_large_files_are_cut_to_the_token_cap(tmp_path):
+    path = tmp_path / 'big.txt'
+    path.write_text('a' * 60 + 'b' * 40)
+    expander = FileExpander(CharEncoder(), token_cap=30)
+    text, _ = expander.embedding(path)
+    assert 'a' * 20 + '\n[... 70 tokens omitted ...]\n' + 'b' * 10 in text
+
+    # Files that are certainly too large are only read partially
+    path.write_text('a' * 1000 + 'b' * 1000)
+    text, _ = expander.embedding(path)
+    assert '\n' + 'a' * 20 + '\n[... the middle of the file is omitted ...]\n' + 'b' * 10 + '\n' in text
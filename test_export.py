@@ -0,0 +1,26 @@
+import json
+import os
+
+from gpt_ui.export import chat_to_markdown, export_chats_to_markdown
+
+
+def test_chat_to_markdown():
+    chat = [{'role': 'user', 'user': 'me', 'content': 'hi'}, {'role': 'assistant', 'model': 'gpt-4', 'content': 'hello'}]
+    assert chat_to_markdown(chat) == '%% Auto geneterated file, do not edit %%\n\n**me:** hi\n**gpt-4:** hello\n'
+
+
+def test_export_skips_unchanged_chats(tmp_path):
+    for name in ['a', 'b']:
+        (tmp_path / f'{name}.json').write_text(json.dumps([{'role': 'user', 'content': name}]))
+    (tmp_path / '.backup_1.json').write_text('[]')
+    (tmp_path / 'broken.json').write_text('{')
+    exported, skipped, failed = export_chats_to_markdown(tmp_path, max_workers=2)
+    assert sorted(name for name, _ in exported) == ['a.json', 'b.json']
+    assert len(failed) == 1 and skipped == 0
+    assert (tmp_path / 'a.md').read_text().endswith('**user:** a\n')
+
+    # Only touching a file does not export it again
+    os.utime(tmp_path / 'a.json', ns=(0, 0))
+    (tmp_path / 'b.json').write_text(json.dumps([{'role': 'user', 'content': 'changed'}]))
+    exported, skipped, failed = export_chats_to_markdown(tmp_path)
+    assert [name for name, _ in exported] == ['b.json'] and skipped == 1
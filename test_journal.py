@@ -0,0 +1,40 @@
+import json
+
+from gpt_ui.journal import ChatJournal, load_chat
+
+
+def message(role, content):
+    return {'role': role, 'content': content}
+
+
+def test_journal_appends_only_changes_and_replays(tmp_path):
+    path = tmp_path / '.backup_1.json'
+    journal = ChatJournal(path)
+    chat = [message('system', 'hi'), message('user', 'question')]
+    journal.sync(chat)
+    chat.append(message('assistant', 'answer'))
+    assert journal.sync(chat) == (2, [chat[2]])
+    assert journal.sync(chat) == (3, [])
+    assert len(journal.journal_path.read_text().splitlines()) == 3
+    assert not path.exists()
+    assert load_chat(path) == chat
+
+    # An edit in the middle truncates the journal to the first changed message
+    chat = chat[:1] + [message('user', 'other question')]
+    journal.sync(chat)
+    assert load_chat(path) == chat
+
+
+def test_compact_writes_manifest_and_replay_is_idempotent(tmp_path):
+    path = tmp_path / '.backup_1.json'
+    journal = ChatJournal(path)
+    chat = [message('system', 'hi'), message('user', 'question')]
+    journal.sync(chat)
+    journal_lines = journal.journal_path.read_text()
+    journal.compact(chat)
+    assert json.loads(path.read_text())['format'] == 'gpt-ui-manifest'
+    assert load_chat(path) == chat
+    assert not journal.journal_path.exists()
+    # A crash between writing the json and removing the journal leaves both behind
+    journal.journal_path.write_text(journal_lines + '{"op": "set", "ind')
+    assert load_chat(path) == chat
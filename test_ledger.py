@@ -0,0 +1,23 @@
+from gpt_ui.ledger import Ledger, aggregate, format_stats, tokens_per_s
+
+models_dict = {'gpt-4': {'name': 'gpt-4', 'cost_per_input_token': 0.01, 'cost_per_output_token': 0.02}}
+
+
+def test_ledger_records_and_aggregates(tmp_path):
+    ledger = Ledger(tmp_path / 'ledger.jsonl', models_dict)
+    ledger.chat = 'a'
+    ledger.record('chat', 'gpt-4', 100, 50, 2.0, ttft=1.0, retries=1)
+    ledger.record('summary', 'gpt-4', 10, 5, 0.5, chat='b')
+    ledger.record('chat', 'unknown', 10, 5, 0.5, error='timeout')
+    assert abs(ledger.session_cost - (1 + 1 + 0.1 + 0.1)) < 1e-9
+    assert tokens_per_s(ledger.last['chat']) is None
+    assert tokens_per_s(ledger.record('chat', 'gpt-4', 1, 50, 2.0, ttft=1.0)) == 50
+
+    # A second session reads the entries of the first from the file
+    entries = list(Ledger(tmp_path / 'ledger.jsonl', models_dict).entries())
+    by_model = {r['model']: r for r in aggregate(entries, 'model')}
+    assert by_model['gpt-4']['calls'] == 3 and by_model['gpt-4']['retries'] == 1
+    assert by_model['unknown']['errors'] == 1 and by_model['unknown']['cost'] == 0
+    assert [r['chat'] for r in aggregate(entries, 'chat')] == ['a', 'b']
+    assert len(aggregate(entries, 'day')) == 1
+    assert 'total' in format_stats(aggregate(entries, 'kind'), 'kind')
@@ -0,0 +1,35 @@
+import io
+
+from rich.console import Console
+
+from gpt_ui.markdown import BlockSplitter, StreamingMarkdown
+
+text = "# Title\n\nSome *text* here.\nMore.\n\n1. a\n2. b\n\n```python\nx = 1\n\ny = 2\n```\nAfter the code"
+
+
+def test_blocks_are_finished_by_blank_lines_headings_and_fences():
+    splitter = BlockSplitter()
+    blocks = []
+    for i in range(0, len(text), 3):
+        blocks += splitter.feed(text[i:i + 3])
+    assert blocks == ['# Title', 'Some *text* here.\nMore.', '1. a\n2. b', '```python\nx = 1\n\ny = 2\n```']
+    assert splitter.tail == 'After the code'
+    assert splitter.flush() == 'After the code'
+    assert splitter.tail == ''
+
+
+def test_long_fences_and_hashes_that_are_no_heading():
+    splitter = BlockSplitter()
+    blocks = splitter.feed("````md\n```python\nx = 1\n```\n````\n#hashtag and\n#1 are text\n\n")
+    assert blocks == ['````md\n```python\nx = 1\n```\n````', '#hashtag and\n#1 are text']
+
+
+def test_each_block_is_printed_once():
+    out = io.StringIO()
+    with StreamingMarkdown(Console(file=out, width=60)) as renderer:
+        for c in text:
+            renderer.feed(c)
+    output = out.getvalue()
+    for word in ['Title', 'More.', 'y = 2', 'After the code']:
+        assert output.count(word) == 1
+    assert '```' not in output
@@ -0,0 +1,33 @@
+from gpt_ui.player import MpvPlayer
+from tests.helpers import FakeMpv
+
+
+def test_mpv_player_over_ipc():
+    mpv = FakeMpv()
+    player = MpvPlayer(socket_path=mpv.socket_path, spawn=False)
+    player.enqueue('/tmp/a.mp3')
+    player.enqueue('/tmp/b.mp3')
+    assert player.pending() == 2
+    assert player.wait(max_pending=1, timeout=5)
+    player.set_speed(1.5)
+    assert player.wait(timeout=5)
+    player.enqueue('/tmp/c.mp3')
+    player.stop()
+    assert player.pending() == 0 and player._ended == set()
+    player.close()
+    assert [c[0] for c in mpv.commands] == ['loadfile', 'loadfile', 'set_property', 'loadfile', 'stop', 'quit']
+    assert mpv.commands[0] == ['loadfile', '/tmp/a.mp3', 'append-play']
+    assert mpv.commands[2] == ['set_property', 'speed', 1.5]
+
+
+def test_mpv_player_without_playlist_entry_ids():
+    mpv = FakeMpv(numbered=False)
+    player = MpvPlayer(socket_path=mpv.socket_path, spawn=False)
+    player.enqueue('/tmp/a.mp3')
+    player.enqueue('/tmp/b.mp3')
+    assert player.pending() == 2
+    assert player.wait(timeout=5)
+    player.enqueue('/tmp/c.mp3')
+    player.stop()
+    assert player.pending() == 0
+    player.close()
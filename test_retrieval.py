@@ -0,0 +1,50 @@
+import os
+
+from gpt_ui.expand import FileExpander
+from gpt_ui.gpt_ui import explode_message
+from gpt_ui.retrieval import ChunkIndex, chunk_text
+from gpt_ui.tokens import TokenCounter, WhitespaceEncoder
+from gpt_ui.vault import VaultIndex
+from tests.helpers import make_conf
+
+
+def test_chunk_text():
+    text = 'a b c\n\nd e\n\n\n' + ' '.join(['f'] * 7)
+    assert chunk_text(text, chunk_words=5) == ['a b c\n\nd e', 'f f f f f', 'f f']
+
+
+def test_retrieve_relevant_chunks_within_budget(tmp_path):
+    vault = tmp_path / 'vault'
+    vault.mkdir()
+    (vault / 'cooking.md').write_text('Pasta needs salted water.\n\nRisotto needs patience and stock.')
+    (vault / 'garden.md').write_text('Tomatoes need sun and water.')
+    index = ChunkIndex(tmp_path / 'retrieval.sqlite', VaultIndex(vault, tmp_path / 'vault.json'), min_refresh_interval=0)
+    counter = TokenCounter(WhitespaceEncoder())
+
+    result = index.retrieve('how much water', counter, token_budget=100)
+    assert sorted(result) == [str(vault / 'cooking.md'), str(vault / 'garden.md')]
+    result = index.retrieve('risotto stock', counter, token_budget=100, paths=[vault / 'cooking.md'])
+    assert list(result.values()) == [['Pasta needs salted water.\n\nRisotto needs patience and stock.']]
+    assert index.retrieve('risotto', counter, token_budget=3) == {}
+
+    # Changed files are indexed again
+    (vault / 'garden.md').write_text('Basil likes warmth.')
+    os.utime(vault / 'garden.md', ns=(1, 1))
+    assert index.retrieve('basil', counter, token_budget=100) == {str(vault / 'garden.md'): ['Basil likes warmth.']}
+
+
+def test_links_in_retrieved_passages_are_not_expanded(tmp_path):
+    vault = tmp_path / 'vault'
+    vault.mkdir()
+    (tmp_path / 'secret.txt').write_text('do not send')
+    (tmp_path / 'linked.txt').write_text('linked content')
+    (vault / 'setup.md').write_text(f"The key of the setup is in :file:{tmp_path / 'secret.txt'}:")
+    enc = WhitespaceEncoder()
+    vault_index = VaultIndex(vault, tmp_path / 'vault.json')
+    conf = make_conf(tmp_path, vault_index=vault_index, file_expander=FileExpander(enc, 1000),
+                     chunk_index=ChunkIndex(tmp_path / 'retrieval.sqlite', vault_index, min_refresh_interval=0),
+                     retrieve_token_budget=100, retrieve_top_k=8)
+
+    m = explode_message(conf, {'role': 'user', 'content': f":obsidian?:setup key:\nand :file:{tmp_path / 'linked.txt'}:"})
+    assert f":file:{tmp_path / 'secret.txt'}:" in m['content'] and 'do not send' not in m['content']
+    assert 'linked content' in m['content']
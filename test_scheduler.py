@@ -0,0 +1,73 @@
+import time
+from threading import Event
+
+from gpt_ui.scheduler import Scheduler
+
+
+def test_latest_wins_and_priorities():
+    scheduler = Scheduler()
+    results = []
+    gate = Event()
+    scheduler.submit('gate', gate.wait)
+    for i in range(5):
+        scheduler.submit('summary', results.append, f'summary {i}', priority=10)
+        scheduler.submit('tokens', results.append, f'tokens {i}', priority=0)
+    gate.set()
+    assert scheduler.wait_idle(timeout=5)
+    assert results == ['tokens 4', 'summary 4']
+    assert scheduler.stats['summary'].superseded == 4
+    assert scheduler.stats['summary'].runs == 1
+    scheduler.shutdown()
+
+
+def test_superseded_running_job_does_not_report():
+    scheduler = Scheduler()
+    done = []
+    started = Event()
+    release = Event()
+
+    def slow(x):
+        started.set()
+        release.wait()
+        return x
+    scheduler.submit('job', slow, 1, on_done=done.append)
+    started.wait(5)
+    scheduler.submit('job', lambda x: x, 2, on_done=done.append)
+    release.set()
+    assert scheduler.wait_idle(timeout=5)
+    assert done == [2]
+    scheduler.shutdown()
+
+
+def test_failing_job_does_not_stop_worker():
+    scheduler = Scheduler()
+    done = []
+    scheduler.submit('bad', lambda: 1 / 0)
+    scheduler.submit('good', time.monotonic, on_done=done.append)
+    assert scheduler.wait_idle(timeout=5)
+    assert len(done) == 1
+    assert scheduler.stats['bad'].failed == 1
+    scheduler.shutdown()
+
+
+def test_fast_jobs_do_not_wait_for_slow_lane():
+    scheduler = Scheduler()
+    release = Event()
+    started = Event()
+
+    def network_call():
+        started.set()
+        release.wait()
+    done = []
+    scheduler.submit('toolbar_summary', network_call, priority=10, lane='slow')
+    started.wait(5)
+    for i in range(3):
+        scheduler.submit('toolbar_tokens', lambda i: i, i, on_done=done.append)
+        deadline = time.monotonic() + 5
+        while len(done) <= i and time.monotonic() < deadline:
+            time.sleep(0.001)
+    assert done == [0, 1, 2]
+    assert not scheduler.wait_idle(timeout=0.01)
+    release.set()
+    assert scheduler.wait_idle(timeout=5)
+    scheduler.shutdown()
@@ -0,0 +1,33 @@
+import json
+
+from gpt_ui.search import SearchIndex, parse_query
+
+
+def message(role, content, date='2024-01-01_00-00-00-000000'):
+    return {'role': role, 'model': 'gpt-4', 'user': 'me', 'date': date, 'content': content}
+
+
+def test_parse_query():
+    assert parse_query('role:user since:2024-01 python: decorators') == \
+        ('python: decorators', {'role': 'user', 'since': '2024-01'})
+
+
+def test_search_with_filters_and_incremental_updates(tmp_path):
+    chat = [message('user', 'How do python decorators work?'),
+            message('assistant', 'A decorator wraps a function.', date='2024-03-01_00-00-00-000000')]
+    (tmp_path / 'decorators.json').write_text(json.dumps(chat))
+    (tmp_path / '.backup_1.json').write_text(json.dumps(chat))
+    index = SearchIndex(tmp_path)
+    assert [r[0] for r in index.search('decorators')] == ['decorators.json']
+    assert len(index.search('decorator', hide_backups=False)) == 2
+    assert index.search('decorator role:assistant')[0][1] == 1
+    assert index.search('decorators until:2024-02')[0][2] == 'user'
+    assert index.search('decorator since:2024-02')[0][2] == 'assistant'
+    assert index.search('nonexistent') == []
+
+    chat.append(message('user', 'And what about metaclasses?'))
+    (tmp_path / 'decorators.json').write_text(json.dumps(chat))
+    index.update('decorators.json', 2, chat[2:])
+    assert index.search('metaclasses')[0][:2] == ('decorators.json', 2)
+    index.update('decorators.json', 1, [])
+    assert index.search('metaclasses') == []
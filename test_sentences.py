@@ -0,0 +1,25 @@
+from gpt_ui.sentences import SentenceSegmenter
+
+text = ('Hello world. This is Mr. Smith, e.g. a test! Pi is 3.14 ok? He said "yes." Then\n'
+        '1. First item\nCode:\n```python\nx = 1. \ny = 2\n```\nAfter 你好。再见！End')
+
+
+def segment(text, chunk_size):
+    segmenter = SentenceSegmenter()
+    sentences = []
+    for i in range(0, len(text), chunk_size):
+        sentences += segmenter.feed(text[i:i + chunk_size])
+    return sentences, segmenter.flush()
+
+
+def test_sentences_do_not_depend_on_chunking():
+    expected = (['Hello world.', ' This is Mr. Smith, e.g. a test!', ' Pi is 3.14 ok?', ' He said "yes."', ' Then\n',
+                 '1. First item\n', 'Code:\n', '```python\nx = 1. \ny = 2\n```\n', 'After 你好。', '再见！'], 'End')
+    for chunk_size in [1, 2, 3, 7, len(text)]:
+        assert segment(text, chunk_size) == expected
+
+
+def test_unclosed_code_block_is_flushed():
+    sentences, rest = segment('Look.\n```\nprint("a. b")\n', 4)
+    assert sentences == ['Look.\n']
+    assert rest == '```\nprint("a. b")\n'
@@ -0,0 +1,39 @@
+import json
+import os
+
+from gpt_ui.journal import ChatJournal, load_chat
+from gpt_ui.store import gc, objects_dir_name, write_manifest
+
+
+def test_messages_are_stored_once(tmp_path):
+    chat = [{'role': 'system', 'content': 'hi'}, {'role': 'user', 'content': 'question'}]
+    write_manifest(tmp_path / 'a.json', chat)
+    journal = ChatJournal(tmp_path / '.backup_1.json')
+    journal.compact(chat + [{'role': 'assistant', 'content': 'answer'}])
+    assert len(list((tmp_path / objects_dir_name).glob('*/*.json'))) == 3
+    assert load_chat(tmp_path / 'a.json') == chat
+    assert len(load_chat(tmp_path / '.backup_1.json')) == 3
+
+
+def test_gc_deletes_old_backups_and_unreferenced_messages(tmp_path):
+    write_manifest(tmp_path / 'named.json', [{'role': 'user', 'content': 'keep'}])
+    for i in range(3):
+        write_manifest(tmp_path / f'.backup_{i}.json', [{'role': 'user', 'content': f'backup {i}'}])
+        os.utime(tmp_path / f'.backup_{i}.json', (0, 0))
+    (tmp_path / 'old.json').write_text(json.dumps([{'role': 'user', 'content': 'plain json'}]))
+    for p in (tmp_path / objects_dir_name).glob('*/*.json'):
+        os.utime(p, (0, 0))
+    assert gc(tmp_path, keep_backups=1, keep_backups_days=1) == (2, 2)
+    assert sorted(p.name for p in tmp_path.glob('*.json')) == ['.backup_2.json', 'named.json', 'old.json']
+    assert load_chat(tmp_path / '.backup_2.json') == [{'role': 'user', 'content': 'backup 2'}]
+    assert load_chat(tmp_path / 'named.json') == [{'role': 'user', 'content': 'keep'}]
+
+
+def test_messages_deleted_by_another_process_are_written_again(tmp_path):
+    chat = [{'role': 'user', 'content': 'question'}]
+    write_manifest(tmp_path / 'a.json', chat)
+    # Like gc of another process, while this one keeps running
+    for p in (tmp_path / objects_dir_name).glob('*/*.json'):
+        p.unlink()
+    write_manifest(tmp_path / 'b.json', chat)
+    assert load_chat(tmp_path / 'b.json') == chat
@@ -0,0 +1,78 @@
+import openai
+
+from gpt_ui.summary import SummaryService, cheapest_model
+from tests.helpers import make_conf
+
+
+def message(role, n_words):
+    return {'role': role, 'content': ' '.join(['word'] * n_words)}
+
+
+def test_summary_is_cached_and_regenerated_after_enough_new_tokens(monkeypatch, tmp_path):
+    requests = []
+
+    def create(model, messages, **kwargs):
+        requests.append((model, messages))
+        return {'choices': [{'message': {'content': f'title {len(requests)}'}}]}
+    monkeypatch.setattr(openai.ChatCompletion, 'create', create)
+
+    conf = make_conf(tmp_path)
+    service = SummaryService(conf, 'cheap', min_new_tokens=100, window_tokens=50)
+    chat = [message('system', 5)] + [message('user', 30), message('assistant', 30)]
+    assert service.get(chat) == 'title 1'
+    assert service.get(list(chat)) == 'title 1'
+    assert len(requests) == 1
+
+    # A few new tokens do not change the title
+    chat.append(message('user', 10))
+    assert service.get(chat) == 'title 1'
+    assert len(requests) == 1
+
+    # Enough new tokens do, and only a window of the chat and the previous title are sent
+    chat += [message('assistant', 100)] * 3
+    assert service.get(chat) == 'title 2'
+    model, sent = requests[-1]
+    assert model == 'cheap'
+    assert sent[0] == {'role': 'system', 'content': chat[0]['content']}
+    assert len(sent) == 3
+    assert '"title 1"' in sent[-1]['content']
+
+    # Going back to an earlier chat hits the cache
+    assert service.get(chat[:3]) == 'title 1'
+    assert len(requests) == 2
+    assert [e['kind'] for e in conf.ledger.entries()] == ['summary', 'summary']
+
+
+def test_cheapest_model():
+    models = {'a': {'name': 'a', 'cost_per_input_token': 2}, 'b': {'name': 'b', 'cost_per_input_token': 1}}
+    assert cheapest_model(models) == 'b'
+
+
+def test_summary_window_errors_and_cache_size(monkeypatch, tmp_path, capsys):
+    requests = []
+
+    def create(model, messages, **kwargs):
+        requests.append(messages)
+        if len(requests) == 2:
+            raise openai.error.APIConnectionError('offline')
+        return {'choices': [{'message': {'content': f'title {len(requests)}'}}]}
+    monkeypatch.setattr(openai.ChatCompletion, 'create', create)
+
+    conf = make_conf(tmp_path)
+    service = SummaryService(conf, 'cheap', min_new_tokens=0, window_tokens=50, max_cached=2)
+    chat = [message('system', 5), {'role': 'user', 'content': 'old ' * 100 + 'new ' * 10}]
+    assert service.get(chat) == 'title 1'
+    # Only the end of a message longer than the window is sent
+    last = requests[0][1]
+    assert conf.token_counter.count_message(last) == 50 and last['content'].endswith('new')
+
+    # A failed request keeps the title, and its error is shown in the toolbar instead of printed
+    assert service.get(chat + [message('assistant', 3)]) == 'title 1'
+    assert service.error == 'offline'
+    assert [e.get('error') for e in conf.ledger.entries()] == [None, 'offline']
+    assert capsys.readouterr().out == ''
+    assert service.get(chat + [message('assistant', 4)]) == 'title 3'
+    assert service.error is None
+
+    service.get(chat + [message('assistant', 5)])
+    assert len(service._cache) == 2
@@ -0,0 +1,31 @@
+from gpt_ui.tokens import TokenCounter, WhitespaceEncoder
+
+
+class CountingEncoder(WhitespaceEncoder):
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text):
+        self.calls += 1
+        return super().encode(text)
+
+
+def test_count_chat_includes_format_overhead():
+    counter = TokenCounter(CountingEncoder())
+    chat = [{'role': 'system', 'content': 'be nice'}, {'role': 'user', 'content': 'hello there you'}]
+    # 3 per message + 1 for the role + content tokens, plus 3 for priming the reply
+    assert counter.count_chat(chat) == (3 + 1 + 2) + (3 + 1 + 3) + 3
+    assert counter.count_chat([]) == 0
+
+
+def test_counts_are_cached_and_invalidated():
+    enc = CountingEncoder()
+    counter = TokenCounter(enc)
+    chat = [{'role': 'user', 'content': 'a b'}, {'role': 'assistant', 'content': 'c'}]
+    counter.count_chat(chat)
+    calls = enc.calls
+    counter.count_chat(chat)
+    assert enc.calls == calls
+    edited = [chat[0], {'role': 'assistant', 'content': 'd e'}]
+    counter.discard_changed(chat, edited)
+    assert 'c' not in counter._cache and 'a b' in counter._cache
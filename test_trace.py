@@ -0,0 +1,63 @@
+import json
+import pstats
+import time
+from threading import Thread
+
+from gpt_ui import trace
+from gpt_ui.scheduler import Scheduler
+
+
+def test_spans_do_nothing_when_not_tracing():
+    assert trace.span('a') is trace.span('b', n=1)
+    assert trace.turn('answer') is trace.span('a')
+    with trace.span('a'):
+        trace.mark('first token')
+
+
+def test_spans_are_written_as_chrome_trace_events(tmp_path):
+    tracer = trace.start(tmp_path / 'trace.json')
+    with trace.span('trim_chat', messages=3):
+        with trace.span('explode_chat'):
+            time.sleep(0.01)
+        trace.mark('first token')
+    # One after the other, so the second thread can get the ident of the first
+    for name in ['gpt-ui-tts_0', 'gpt-ui-tts_1']:
+        thread = Thread(target=lambda: trace.span('tts synthesize').__enter__().__exit__(None, None, None),
+                        name=name)
+        thread.start()
+        thread.join()
+    scheduler = Scheduler()
+    scheduler.submit('toolbar_tokens', time.sleep, 0.001)
+    assert scheduler.wait_idle(timeout=5)
+    scheduler.shutdown()
+    assert trace.stop() is tracer and trace.stop() is None
+    # Not recorded anymore
+    with trace.span('after'):
+        pass
+
+    events = json.loads((tmp_path / 'trace.json').read_text())['traceEvents']
+    spans = {e['name']: e for e in events if e['ph'] == 'X'}
+    tts_threads = [e['tid'] for e in events if e['name'] == 'tts synthesize']
+    assert set(spans) == {'trim_chat', 'explode_chat', 'tts synthesize', 'toolbar_tokens'}
+    outer, inner = spans['trim_chat'], spans['explode_chat']
+    assert outer['args'] == {'messages': 3} and 'args' not in inner
+    assert outer['ts'] <= inner['ts'] and inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+    assert inner['dur'] >= 10_000
+    assert [e['name'] for e in events if e['ph'] == 'i'] == ['first token']
+    thread_names = {e['tid']: e['args']['name'] for e in events if e['ph'] == 'M'}
+    assert [thread_names[tid] for tid in tts_threads] == ['gpt-ui-tts_0', 'gpt-ui-tts_1']
+    assert thread_names[spans['toolbar_tokens']['tid']] == 'gpt-ui-scheduler-fast'
+    assert spans['trim_chat']['tid'] != spans['tts synthesize']['tid']
+
+
+def test_turns_are_profiled(tmp_path):
+    tracer = trace.start(profile_dir=tmp_path / 'profiles')
+    for _ in range(2):
+        with trace.turn('answer', model='gpt-4'):
+            sorted(range(1000), key=lambda x: -x)
+    trace.stop()
+    assert not (tmp_path / 'trace.json').exists()
+    assert [p.name for p in tracer.profiles] == ['turn_001.prof', 'turn_002.prof']
+    functions = {name for _, _, name in pstats.Stats(str(tracer.profiles[0])).stats}
+    assert '<lambda>' in functions
+    assert [e['name'] for e in tracer.events] == ['answer', 'answer']
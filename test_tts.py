@@ -0,0 +1,102 @@
+import time
+
+from gpt_ui.tts import AudioCache, Speaker
+from tests.helpers import FakeMpv, FakePlayer, make_conf
+
+
+def make_speaker(tmp_path, player, synthesized, delay=0.0):
+    conf = make_conf(tmp_path, config={})
+    speaker = Speaker(conf, cmd='fake', player=player)
+
+    def run_tts(text, path):
+        time.sleep(delay)
+        synthesized.append(text)
+        path.write_text(text)
+
+    speaker._run_tts = run_tts
+    return speaker
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_texts_are_played_in_order_and_cached(tmp_path):
+    player, synthesized = FakePlayer(), []
+    played = player.played
+    speaker = make_speaker(tmp_path, player, synthesized, delay=0.01)
+    texts = [f'Sentence {i}.' for i in range(10)]
+    for text in texts:
+        speaker.speak(text)
+    assert wait_for(lambda: len(played) == 10)
+    assert played == texts
+    # Speaking again plays from the cache
+    for text in texts[:3]:
+        speaker.speak(text)
+    assert wait_for(lambda: len(played) == 13)
+    assert len(synthesized) == 10
+
+
+def test_stop_skips_queued_texts(tmp_path):
+    player, synthesized = FakePlayer(duration=0.2), []
+    played = player.played
+    speaker = make_speaker(tmp_path, player, synthesized)
+    for text in ['first', 'second', 'fourth']:
+        speaker.speak(text)
+    assert wait_for(lambda: player.pending() >= 1)
+    speaker.stop()
+    speaker.speak('third')
+    assert wait_for(lambda: 'third' in played)
+    assert 'second' not in played
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = AudioCache(tmp_path, max_bytes=25)
+    paths = []
+    for i in range(3):
+        tmp = tmp_path / f'{i}.tmp'
+        tmp.write_text('x' * 10)
+        paths.append(cache.add(tmp, cache.path('.mp3', i)))
+        time.sleep(0.01)
+    assert [p.exists() for p in paths] == [False, True, True]
+    assert cache.get(paths[0]) is None
+
+
+def test_player_is_replaced_when_mpv_goes_away(tmp_path, monkeypatch):
+    from gpt_ui import tts
+    from gpt_ui.player import MpvPlayer
+    fallback = FakePlayer()
+    monkeypatch.setattr(tts, 'ProcessPlayer', lambda speed: fallback)
+    mpv = FakeMpv()
+    player = MpvPlayer(socket_path=mpv.socket_path, spawn=False)
+    speaker = make_speaker(tmp_path, player, [])
+    speaker.speak('first')
+    assert wait_for(lambda: any(c[0] == 'loadfile' for c in mpv.commands))
+
+    mpv.crash()
+    assert wait_for(lambda: player._closed)
+    # CTRL+C and the speed command keep working
+    speaker.stop()
+    speaker.set_speed(1.2)
+    assert speaker.player is fallback and fallback.speed == 1.2
+    speaker.speak('second')
+    assert wait_for(lambda: fallback.played == ['second'])
+
+
+def test_player_errors_do_not_stop_speech(tmp_path):
+    class FailingOnce(FakePlayer):
+        failed = False
+
+        def enqueue(self, path):
+            if not self.failed:
+                self.failed = True
+                raise RuntimeError('mpv loadfile: error loading file')
+            super().enqueue(path)
+    player = FailingOnce()
+    speaker = make_speaker(tmp_path, player, [])
+    speaker.speak('first')
+    speaker.speak('second')
+    assert wait_for(lambda: player.played == ['second'])
@@ -0,0 +1,25 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from gpt_ui.util import lazy_property
+
+
+class Slow:
+    def __init__(self):
+        self.n_computed = 0
+
+    @lazy_property
+    def value(self):
+        self.n_computed += 1
+        time.sleep(0.05)
+        return object()
+
+
+def test_lazy_property_is_computed_once_across_threads():
+    slow = Slow()
+    assert slow.n_computed == 0
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        values = list(pool.map(lambda _: slow.value, range(8)))
+    assert slow.n_computed == 1
+    assert all(v is values[0] for v in values)
+    assert 'value' in vars(slow)
@@ -0,0 +1,49 @@
+import os
+
+from prompt_toolkit.document import Document
+
+from gpt_ui.vault import ObsidianCompleter, VaultIndex
+
+
+def test_vault_index_lookup_and_incremental_refresh(tmp_path):
+    vault = tmp_path / 'vault'
+    (vault / 'a' / 'b').mkdir(parents=True)
+    (vault / '.trash').mkdir()
+    (vault / 'a' / 'note.md').write_text('')
+    (vault / 'a' / 'b' / 'note.md').write_text('')
+    (vault / 'other.md').write_text('')
+    (vault / '.trash' / 'gone.md').write_text('')
+    index_path = tmp_path / 'index.json'
+    index = VaultIndex(vault, index_path, min_refresh_interval=0)
+    assert sorted(index.lookup('note.md')) == [vault / 'a' / 'b' / 'note.md', vault / 'a' / 'note.md']
+    assert index.lookup('gone.md') == []
+    assert index.lookup('oth*') == [vault / 'other.md']
+
+    (vault / 'a' / 'b' / 'new.md').write_text('')
+    os.utime(vault / 'a' / 'b', ns=(1, 1))
+    assert index.lookup('new.md') == [vault / 'a' / 'b' / 'new.md']
+    # The index is persisted, and is used without listing the vault again
+    reloaded = VaultIndex(vault, index_path, min_refresh_interval=3600)
+    reloaded._last_refresh = float('inf')
+    assert reloaded.lookup('new.md') == [vault / 'a' / 'b' / 'new.md']
+
+
+def test_completer_completes_note_names(tmp_path):
+    (tmp_path / 'Project plan.md').write_text('')
+    (tmp_path / 'Projects.md').write_text('')
+    completer = ObsidianCompleter(VaultIndex(tmp_path, tmp_path / 'index.json'))
+    completions = list(completer.get_completions(Document('see :obsidian:Proj'), None))
+    assert [c.text for c in completions] == ['Project plan:', 'Projects:']
+    assert list(completer.get_completions(Document('no link here'), None)) == []
+
+
+def test_completer_loads_the_index_when_first_completing(tmp_path):
+    (tmp_path / 'Notes.md').write_text('')
+    loaded = []
+
+    def vault_index():
+        loaded.append(True)
+        return VaultIndex(tmp_path, tmp_path / 'index.json')
+    completer = ObsidianCompleter(vault_index)
+    assert loaded == []
+    assert [c.text for c in completer.get_completions(Document(':obsidian:No'), None)] == ['Notes:']
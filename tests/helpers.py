@@ -0,0 +1,192 @@
+"""Fakes shared by the tests (and the benchmarks), such that they run offline and without mpv."""
+import json
+import os
+import socket
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Condition, Thread
+from types import SimpleNamespace
+
+from gpt_ui.ledger import Ledger
+from gpt_ui.tokens import TokenCounter, WhitespaceEncoder
+
+
+def make_conf(tmp_path, **attributes):
+    """A stand-in for gpt_ui.setup.Conf with what the chat processing functions read, counting words as tokens.
+       Pass attributes to add or replace some, e.g. max_tokens=200.
+    """
+    enc = attributes.pop('enc', WhitespaceEncoder())
+    conf = SimpleNamespace(
+        model='gpt-4', user='user', enc=enc, token_counter=TokenCounter(enc), max_tokens=8192, completion_reserve=0,
+        summary_reserve=512, models_dict={}, config={'prompt_postfix': ' '}, obsidian_vault_dir=Path(tmp_path) / 'vault',
+        voice_precache_dir=Path(tmp_path) / 'voice', args=SimpleNamespace(compact=False, retrieve=False, debug=False),
+        ledger=Ledger(Path(tmp_path) / 'ledger.jsonl', {}))
+    vars(conf).update(attributes)
+    return conf
+
+
+class FakeServer:
+    """Streams the answers in script, one per request. An int answer is returned as that status code, and a bytes
+       chunk is sent as the data of an event as it is."""
+    def __init__(self, script, delay=0.0):
+        self.script = list(script)
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                server.requests.append(body)
+                answer = server.script.pop(0)
+                if isinstance(answer, int):
+                    data = json.dumps({'error': {'message': 'slow down'}}).encode()
+                    self.send_response(answer)
+                    self.send_header('Retry-After', '0')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                time.sleep(delay)
+                for word in answer:
+                    chunk = {'choices': [{'delta': {'content': word}}]}
+                    # Bytes are sent as they are
+                    data = word if isinstance(word, bytes) else json.dumps(chunk).encode()
+                    self.wfile.write(b'data: ' + data + b'\n\n')
+                    self.wfile.flush()
+                self.wfile.write(b'data: [DONE]\n\n')
+                self.close_connection = True
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}/v1'
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+class FakePlayer:
+    """Plays a file by recording it and sleeping for duration seconds."""
+    def __init__(self, duration=0.0):
+        self.duration = duration
+        self.played = []
+        self.speed = 1.0
+        self._queue = []
+        self._playing = None
+        self._cv = Condition()
+        Thread(target=self._run, daemon=True).start()
+
+    def enqueue(self, path):
+        with self._cv:
+            self._queue.append(path)
+            self._cv.notify_all()
+
+    def pending(self):
+        with self._cv:
+            return len(self._queue) + (self._playing is not None)
+
+    def wait(self, max_pending=0, timeout=None):
+        with self._cv:
+            return self._cv.wait_for(lambda: len(self._queue) + (self._playing is not None) <= max_pending, timeout)
+
+    def set_speed(self, speed):
+        self.speed = speed
+
+    def skip(self):
+        pass
+
+    def stop(self):
+        with self._cv:
+            self._queue.clear()
+
+    def close(self):
+        self.stop()
+
+    def _run(self):
+        while True:
+            with self._cv:
+                self._cv.wait_for(lambda: self._queue)
+                self._playing = self._queue.pop(0)
+            time.sleep(self.duration)
+            with self._cv:
+                self.played.append(self._playing.read_text())
+                self._playing = None
+                self._cv.notify_all()
+
+
+class FakeMpv:
+    """Answers mpv IPC commands on a unix socket. Every loaded file ends after duration seconds.
+       With numbered=False, playlist entries have no id, as with mpv before 0.33.
+    """
+    def __init__(self, duration=0.05, numbered=True):
+        self.duration = duration
+        self.numbered = numbered
+        self.commands = []
+        self.conn = None
+        self.socket_path = os.path.join(tempfile.mkdtemp(), 'socket')
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        self.server.listen(1)
+        Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        conn, _ = self.server.accept()
+        self.conn = conn
+        entry_ids = iter(range(1, 1000))
+        playlist = []
+        buffer = b''
+
+        def send(message):
+            conn.sendall(json.dumps(message).encode() + b'\n')
+
+        def end_file(reason):
+            entry_id = playlist.pop(0)
+            send({'event': 'end-file', 'reason': reason, **({'playlist_entry_id': entry_id} if self.numbered else {})})
+
+        def end_files():
+            try:
+                while True:
+                    time.sleep(self.duration)
+                    if playlist:
+                        end_file('eof')
+            except OSError:
+                return
+        Thread(target=end_files, daemon=True).start()
+        try:
+            while (data := conn.recv(4096)):
+                *lines, buffer = (buffer + data).split(b'\n')
+                for line in lines:
+                    request = json.loads(line)
+                    command = request['command']
+                    self.commands.append(command)
+                    result = None
+                    if command[0] == 'loadfile':
+                        entry_id = next(entry_ids)
+                        playlist.append(entry_id)
+                        result = {'playlist_entry_id': entry_id} if self.numbered else None
+                    elif command[0] == 'stop':
+                        if playlist:
+                            end_file('stop')
+                        playlist.clear()
+                    send({'request_id': request['request_id'], 'error': 'success', 'data': result})
+                    if command[0] == 'quit':
+                        conn.close()
+                        return
+        except OSError:
+            # After crash
+            return
+
+    def crash(self):
+        """Go away like an mpv that crashed."""
+        self.conn.shutdown(socket.SHUT_RDWR)
+        self.conn.close()